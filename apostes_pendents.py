@@ -0,0 +1,80 @@
+"""Apostes confirmades que encara no s'han escrit a la base de dades.
+
+En el mode d'apostes diferides (config.APOSTES_DIFERIDES) el bot confirma
+l'aposta en desar-la aquí i database.buidar_apostes l'escriu més tard, per
+lots. Només es guarda la darrera aposta de cada participant a cada partit.
+
+Cada aposta s'apunta abans en un diari (diari.py), de manera que si el bot cau abans d'escriure-la no es perd:
+en arrencar es rellegeix el diari. Després de cada escriptura el diari es
+reescriu amb només les apostes que encara queden pendents.
+"""
+import threading
+from diari import Diari
+
+class ApostesPendents:
+    def __init__(self, diari=None, sincronitzar=True):
+        self._diari = Diari(diari, sincronitzar) if diari else None
+        self._lock = threading.Lock()
+        self._apostes = {}  # (partit_id, telegram_id) -> (grup_id, nom_usuari, gols_local, gols_visitant)
+
+    def __len__(self):
+        return len(self._apostes)
+
+    def obrir(self):
+        """Rellegeix les apostes del diari i l'obre per afegir-n'hi de noves.
+
+        Retorna les apostes recuperades com a tuples
+        (grup_id, partit_id, telegram_id, nom_usuari, gols_local, gols_visitant).
+        """
+        if self._diari is None:
+            return []
+        recuperades = {}
+        for aposta in self._diari.llegir():
+            recuperades[(aposta[1], aposta[2])] = tuple(aposta)
+        self._diari.obrir()
+        return list(recuperades.values())
+
+    def afegir(self, grup_id, partit_id, telegram_id, nom_usuari, gols_local, gols_visitant):
+        """Desa l'aposta (substitueix l'anterior del participant) i retorna quantes n'hi ha de pendents."""
+        with self._lock:
+            if self._diari is not None:
+                self._diari.apuntar((grup_id, partit_id, telegram_id, nom_usuari, gols_local, gols_visitant))
+            self._apostes[(partit_id, telegram_id)] = (grup_id, nom_usuari, gols_local, gols_visitant)
+            return len(self._apostes)
+
+    def restaurar(self, apostes):
+        """Torna a posar apostes que no s'han pogut escriure, llevat de les que ja tenen una aposta més nova."""
+        with self._lock:
+            for grup_id, partit_id, telegram_id, nom_usuari, gols_local, gols_visitant in apostes:
+                self._apostes.setdefault((partit_id, telegram_id), (grup_id, nom_usuari, gols_local, gols_visitant))
+
+    def treure(self, partits=None):
+        """Treu i retorna les apostes pendents (totes, o només les dels partits indicats)."""
+        with self._lock:
+            claus = [clau for clau in self._apostes if partits is None or clau[0] in partits]
+            apostes = []
+            for partit_id, telegram_id in claus:
+                grup_id, nom_usuari, gols_local, gols_visitant = self._apostes.pop((partit_id, telegram_id))
+                apostes.append((grup_id, partit_id, telegram_id, nom_usuari, gols_local, gols_visitant))
+            return apostes
+
+    def descartar(self, partit_id):
+        """Oblida les apostes pendents d'un partit anul·lat."""
+        self.treure({partit_id})
+        self.compactar()
+
+    def compactar(self):
+        """Reescriu el diari amb només les apostes que encara són pendents."""
+        if self._diari is None:
+            return
+        with self._lock:
+            self._diari.reescriure(
+                (grup_id, partit_id, telegram_id, nom_usuari, gols_local, gols_visitant)
+                for (partit_id, telegram_id), (grup_id, nom_usuari, gols_local, gols_visitant) in self._apostes.items()
+            )
+
+    def tancar(self):
+        if self._diari is None:
+            return
+        with self._lock:
+            self._diari.tancar()
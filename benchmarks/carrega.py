@@ -0,0 +1,328 @@
+"""Prova de càrrega dels handlers de porra.py amb actualitzacions sintètiques.
+
+Construeix Updates falsos i els passa pels handlers reals del bot (els de
+porra.application, amb el mateix ProcessadorPerUsuari), contra una base de dades
+de proves. El Bot fa servir una petició falsa (PeticioFalsa), així que no
+surt res a la xarxa: cada missatge que el bot enviaria només es compta.
+
+L'escenari és una jornada sencera: un administrador crea la porra amb /nova,
+N usuaris aposten alhora com si faltessin pocs minuts per al partit (amb
+alguns /consultar i /classificacio pel mig), l'administrador la tanca amb
+/finalitzar i tothom mira la classificació. Per a cada comanda es mostra el
+rendiment, la latència p50/p99 del handler i les consultes a la base de
+dades que fa de mitjana. Al final es comprova que un partit que ja ha
+començat no accepta apostes; si en accepta, la prova acaba amb error.
+
+    python benchmarks/carrega.py --usuaris 1000
+    python benchmarks/carrega.py --usuaris 5000 --apostes-per-usuari 2 --concurrents 32
+    python benchmarks/carrega.py --base-de-dades porra_bench   # obligatori amb MySQL
+    python benchmarks/carrega.py --usuaris 1000 --limits       # amb els límits de comandes de config.LIMITS
+
+Sense --limits, la prova no passa pel limitador de comandes (porra.limitar),
+que descartaria la majoria de consultes d'un grup tan gran; les consultes
+repetides sí que s'agrupen com al bot.
+
+Les taules de la base de dades de proves s'esborren i es tornen a crear. Amb
+SQLite, si no se n'indica cap, se'n fa servir una de temporal.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import database
+import metriques
+import porra
+from persistencia import PersistenciaDiari
+from config import ACTUALITZACIONS_CONCURRENTS, BD_BACKEND, DB_CONFIG, GRUPS_AUTORITZATS, SQLITE, USUARIS_AUTORITZATS
+from migracions import aplicar_migracions, esborrar_taules
+from planificador import ProcessadorPerUsuari
+
+GRUP = GRUPS_AUTORITZATS[0]
+ADMINISTRADOR = USUARIS_AUTORITZATS[0]
+PRIMER_USUARI = 1_000_000
+
+class PeticioFalsa(BaseRequest):
+    """Respon les crides a l'API de Telegram sense xarxa i compta quantes se'n fan."""
+
+    def __init__(self):
+        self.crides = Counter()
+        self.darrer_text = None
+        self._missatge_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        # No hi ha xarxa: cap crida s'ha d'esperar
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        metode = url.rsplit("/", 1)[-1]
+        self.crides[metode] += 1
+        parametres = request_data.parameters if request_data else {}
+
+        if metode == "getMe":
+            resultat = {"id": 1, "is_bot": True, "first_name": "Porra", "username": "porra_bot"}
+        elif metode == "sendMessage":
+            self._missatge_id += 1
+            self.darrer_text = parametres.get("text", "")
+            resultat = {
+                "message_id": self._missatge_id,
+                "date": int(time.time()),
+                "chat": {"id": int(parametres["chat_id"]), "type": "supergroup", "title": "Porra"},
+                "text": parametres.get("text", ""),
+            }
+        else:
+            resultat = True
+        return HTTPStatus.OK, json.dumps({"ok": True, "result": resultat}).encode()
+
+def consultes_totals():
+    """Sentències que ha executat database.py (metriques.CursorMesurat les mesura totes)."""
+    return sum(estat["total"] for estat in metriques.histogrames("porra_bd_consulta_segons").values())
+
+class Generador:
+    """Crea els Updates que Telegram enviaria per a cada missatge."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+        self._missatge_id = 0
+
+    def missatge(self, usuari_id, text):
+        self._update_id += 1
+        self._missatge_id += 1
+        dades = {
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._missatge_id,
+                "date": int(time.time()),
+                "chat": {"id": GRUP, "type": "supergroup", "title": "Porra"},
+                "from": {
+                    "id": usuari_id,
+                    "is_bot": False,
+                    "first_name": f"Usuari {usuari_id}",
+                    "username": f"usuari{usuari_id}",
+                },
+                "text": text,
+            },
+        }
+        if text.startswith("/"):
+            comanda = text.split()[0]
+            dades["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(comanda)}]
+        return Update.de_json(dades, self.bot)
+
+class Mesures:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # comanda -> [segons]
+        self.consultes = defaultdict(list)  # comanda -> [consultes per actualització]
+        self.durades = defaultdict(float)   # comanda -> segons de les fases on s'ha enviat
+
+    def afegir(self, comanda, latencia, consultes):
+        self.latencies[comanda].append(latencia)
+        self.consultes[comanda].append(consultes)
+
+def percentil(valors, p):
+    ordenats = sorted(valors)
+    return ordenats[min(len(ordenats) - 1, int(round(p * (len(ordenats) - 1))))]
+
+async def enviar(application, mesures, comanda, update):
+    comptador = [0]
+    metriques.consultes_en_curs.set(comptador)
+    inici = time.perf_counter()
+    await application.update_processor.process_update(update, application.process_update(update))
+    mesures.afegir(comanda, time.perf_counter() - inici, comptador[0])
+
+async def fase(application, mesures, actualitzacions):
+    """Envia alhora una llista de (comanda, update) i apunta quant ha durat."""
+    inici = time.perf_counter()
+    # Cada enviament en la seva tasca perquè tingui les seves contextvars
+    await asyncio.gather(*(
+        asyncio.create_task(enviar(application, mesures, comanda, update))
+        for comanda, update in actualitzacions
+    ))
+    durada = time.perf_counter() - inici
+    for comanda in {comanda for comanda, _ in actualitzacions}:
+        mesures.durades[comanda] += durada
+
+async def partit_comencat(application, generador, peticio):
+    """Comprova que no s'accepten apostes d'un partit que ja ha començat.
+
+    /nova no ha d'acceptar una hora passada, i un partit en marxa que ja ha
+    començat (com quan el bot es reinicia després de l'hora) s'ha de tancar de
+    seguida. Retorna la llista de problemes trobats.
+    """
+    problemes = []
+    fa_tres_hores = datetime.now() - timedelta(hours=3)
+    usuari = PRIMER_USUARI - 1
+
+    for text in ["/nova", "Betis", "fora", fa_tres_hores.strftime("%d-%m-%Y %H:%M")]:
+        await enviar(application, Mesures(), "nova", generador.missatge(ADMINISTRADOR, text))
+    if not peticio.darrer_text.startswith("Aquesta hora ja ha passat"):
+        problemes.append(f"/nova ha acceptat una hora passada: {peticio.darrer_text!r}")
+    await enviar(application, Mesures(), "nova", generador.missatge(ADMINISTRADOR, "/cancelar"))
+
+    # El partit ja era a la base de dades abans de l'hora d'inici
+    partit_id = database.registrar_partit(
+        {"rival": "Osasuna", "data": fa_tres_hores.strftime("%d-%m-%Y %H:%M"), "juga_a_casa": False}, GRUP,
+    )["partit_id"]
+    porra.programar_feines(application.job_queue, [
+        partit for partit in database.carregar_partits_en_marxa(GRUP) if partit["id"] == partit_id
+    ])
+    for _ in range(50):
+        partit = next(partit for partit in database.obtenir_partits_en_marxa(GRUP) if partit["id"] == partit_id)
+        if partit["apostes_tancades"]:
+            break
+        await asyncio.sleep(0.1)
+    else:
+        problemes.append("les apostes d'un partit que ja ha començat no s'han tancat")
+
+    await enviar(application, Mesures(), "apostar", generador.missatge(usuari, f"/apostar {partit_id} 1-0"))
+    if not peticio.darrer_text.startswith("Ja ha passat l'hora del partit"):
+        problemes.append(f"/apostar ha acceptat una aposta d'un partit començat: {peticio.darrer_text!r}")
+    return problemes
+
+async def jornada(args):
+    peticio = PeticioFalsa()
+    constructor = (
+        Application.builder()
+        .token("123456:PROVA")
+        .request(peticio)
+        .updater(None)
+        .concurrent_updates(ProcessadorPerUsuari(args.concurrents))
+    )
+    # La conversa de /nova és persistent: cal una persistència, amb un diari temporal
+    if porra.conversation_handler.persistent:
+        constructor.persistence(PersistenciaDiari(os.path.join(args.temporal, "converses.diari")))
+    application = constructor.build()
+    # Els mateixos handlers que el bot
+    for grup, handlers in porra.application.handlers.items():
+        for handler in handlers:
+            if getattr(handler, "callback", None) is porra.limitar and not args.limits:
+                continue
+            application.add_handler(handler, grup)
+
+    await application.initialize()
+    await application.start()
+    porra.programar_feines(application.job_queue, database.carregar_partits_en_marxa())
+    generador = Generador(application.bot)
+    mesures = Mesures()
+    usuaris = [PRIMER_USUARI + i for i in range(args.usuaris)]
+
+    # L'administrador crea la porra (la conversa de /nova, pas a pas)
+    data = (datetime.now() + timedelta(days=1)).strftime("%d-%m-%Y %H:%M")
+    for text in ["/nova", "Girona", "casa", data]:
+        await fase(application, mesures, [("nova", generador.missatge(ADMINISTRADOR, text))])
+
+    # Ràfega d'apostes abans del partit, amb consultes barrejades
+    for _ in range(args.apostes_per_usuari):
+        actualitzacions = [
+            ("apostar", generador.missatge(usuari, f"/apostar {random.randint(0, 4)}-{random.randint(0, 4)}"))
+            for usuari in usuaris
+        ]
+        for usuari in random.sample(usuaris, min(len(usuaris), args.consultes)):
+            actualitzacions.append(("consultar", generador.missatge(usuari, "/consultar")))
+        for usuari in random.sample(usuaris, min(len(usuaris), args.consultes)):
+            actualitzacions.append(("classificacio", generador.missatge(usuari, "/classificacio jo")))
+        random.shuffle(actualitzacions)
+        await fase(application, mesures, actualitzacions)
+
+    await fase(application, mesures, [("finalitzar", generador.missatge(ADMINISTRADOR, "/finalitzar 2-1"))])
+
+    # Tothom vol veure com ha quedat la classificació
+    await fase(application, mesures, [
+        ("classificacio", generador.missatge(usuari, random.choice(["/classificacio", "/classificacio jo"])))
+        for usuari in usuaris
+    ])
+
+    problemes = await partit_comencat(application, generador, peticio)
+
+    await application.stop()
+    await application.shutdown()
+    return mesures, peticio, problemes
+
+def informe(mesures, peticio, total_consultes):
+    print(f"{'comanda':<14} {'n':>7} {'act/s':>9} {'p50 (ms)':>10} {'p99 (ms)':>10} {'consultes BD':>13}")
+    for comanda, latencies in mesures.latencies.items():
+        consultes = mesures.consultes[comanda]
+        print(
+            f"{comanda:<14} {len(latencies):>7} {len(latencies) / mesures.durades[comanda]:>9.0f}"
+            f" {percentil(latencies, 0.50) * 1000:>10.2f} {percentil(latencies, 0.99) * 1000:>10.2f}"
+            f" {sum(consultes) / len(consultes):>13.2f}"
+        )
+    print()
+    print(f"Consultes a la base de dades: {total_consultes} (incloses les de feines en segon pla)")
+    print(f"Crides a l'API de Telegram: {dict(peticio.crides)}")
+    print(f"Cache de participants: {database.estadistiques_participants()}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-de-dades", help="Base de dades de proves (se n'esborren les taules)")
+    parser.add_argument("--usuaris", type=int, default=1000, help="Usuaris que aposten")
+    parser.add_argument("--apostes-per-usuari", type=int, default=1, help="Vegades que aposta cada usuari")
+    parser.add_argument("--consultes", type=int, default=50, help="/consultar i /classificacio durant cada ràfega")
+    parser.add_argument("--diferides", action="store_true", help="Activa el mode d'apostes diferides")
+    parser.add_argument("--limits", action="store_true", help="Passa també pel limitador de comandes")
+    parser.add_argument("--concurrents", type=int, default=ACTUALITZACIONS_CONCURRENTS, help="Actualitzacions en paral·lel")
+    args = parser.parse_args()
+
+    if args.base_de_dades in (DB_CONFIG.get("database"), SQLITE.get("fitxer")):
+        parser.error("No facis servir la base de dades del bot per a la prova de càrrega.")
+
+    temporal = None
+    if BD_BACKEND == "mysql":
+        if not args.base_de_dades:
+            parser.error("Amb MySQL cal indicar --base-de-dades.")
+        database.inicialitzar_bd({**DB_CONFIG, "database": args.base_de_dades})
+    else:
+        if not args.base_de_dades:
+            temporal = tempfile.TemporaryDirectory()
+            args.base_de_dades = os.path.join(temporal.name, "carrega.db")
+        database.inicialitzar_bd({**SQLITE, "fitxer": args.base_de_dades})
+
+    esborrar_taules()
+    aplicar_migracions()
+    database.carregar_classificacio(GRUP)
+    if args.diferides:
+        diari = tempfile.NamedTemporaryFile(suffix=".diari", delete=False)
+        diari.close()
+        database.activar_apostes_diferides(diari.name)
+
+    inicials = consultes_totals()
+    with tempfile.TemporaryDirectory() as args.temporal:
+        mesures, peticio, problemes = asyncio.run(jornada(args))
+    informe(mesures, peticio, consultes_totals() - inicials)
+    print()
+    for problema in problemes:
+        print(f"ERROR: {problema}")
+    if not problemes:
+        print("Partit que ja ha començat: /nova el rebutja i, si ja hi era, les apostes es tanquen de seguida.")
+
+    database.tancar_bd()
+    if temporal:
+        temporal.cleanup()
+    if args.diferides:
+        os.unlink(diari.name)
+    if problemes:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
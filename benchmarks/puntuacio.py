@@ -0,0 +1,119 @@
+"""Mesura el temps de tancar un partit (actualitzar_punts) amb N apostes.
+
+Compara la puntuació per conjunts de database.actualitzar_punts amb l'antic
+bucle que feia dos UPDATE per aposta. Fa servir el motor de BD_BACKEND amb una
+base de dades de proves (una base de dades MySQL o un fitxer SQLite) d'usar i
+llençar: les taules s'hi esborren i es tornen a crear.
+
+    python benchmarks/puntuacio.py --base-de-dades porra_bench
+    python benchmarks/puntuacio.py --base-de-dades /tmp/bench.db --mides 10 1000 --per-fila
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import database
+import regles
+from config import BD_BACKEND, DB_CONFIG, SQLITE
+from migracions import aplicar_migracions, esborrar_taules
+
+LOT = 5000
+GRUP = 1
+
+def preparar(n):
+    """Crea un partit amb n participants i una aposta per a cadascun."""
+    esborrar_taules()
+    aplicar_migracions()
+
+    with database.connexio() as db:
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO competicions (nom) VALUES (%s)", ("Benchmark",))
+        cursor.execute(
+            "INSERT INTO temporades (grup_id, competicio_id, nom, inici) VALUES (%s, %s, %s, %s)",
+            (GRUP, cursor.lastrowid, "Benchmark", datetime.now()),
+        )
+        cursor.execute(
+            "INSERT INTO partits (grup_id, temporada_id, nom_contrincant, data_hora, juga_a_casa) VALUES (%s, %s, %s, %s, 1)",
+            (GRUP, cursor.lastrowid, "Benchmark", datetime.now()),
+        )
+        partit_id = cursor.lastrowid
+
+        for inici in range(0, n, LOT):
+            files = [(f"usuari{i}", 1_000_000 + i) for i in range(inici, min(n, inici + LOT))]
+            cursor.executemany("INSERT INTO participants (nom_usuari, telegram_id) VALUES (%s, %s)", files)
+        db.commit()
+
+        cursor.execute("SELECT id FROM participants ORDER BY id")
+        participants = [fila[0] for fila in cursor.fetchall()]
+        for inici in range(0, n, LOT):
+            files = [
+                (partit_id, participant_id, random.randint(0, 4), random.randint(0, 4))
+                for participant_id in participants[inici:inici + LOT]
+            ]
+            cursor.executemany(
+                "INSERT INTO apostes (partit_id, participant_id, gols_local, gols_visitant) VALUES (%s, %s, %s, %s)",
+                files,
+            )
+        db.commit()
+        cursor.close()
+    return partit_id
+
+def actualitzar_punts_per_fila(grup_id, partit_id, resultat_local, resultat_visitant):
+    """L'implementació anterior (abans dels grups): dos UPDATE per aposta."""
+    with database.connexio() as db:
+        cursor = db.cursor(dictionary=True)
+        query = """
+            SELECT a.id AS aposta_id, a.participant_id, a.gols_local, a.gols_visitant, p.nom_usuari
+            FROM apostes a
+            INNER JOIN participants p ON a.participant_id = p.id
+            WHERE a.partit_id = %s
+        """
+        cursor.execute(query, (partit_id,))
+        ranquing = []
+        for aposta in cursor.fetchall():
+            punts_jornada = regles.punts_aposta(
+                regles.REGLES_PER_DEFECTE, aposta["gols_local"], aposta["gols_visitant"], resultat_local, resultat_visitant
+            )
+            cursor.execute("UPDATE apostes SET punts_jornada = %s WHERE id = %s", (punts_jornada, aposta["aposta_id"]))
+            cursor.execute("UPDATE participants SET punts = punts + %s WHERE id = %s", (punts_jornada, aposta["participant_id"]))
+            ranquing.append((aposta["nom_usuari"], aposta["gols_local"], aposta["gols_visitant"], punts_jornada))
+        db.commit()
+        cursor.close()
+    return sorted(ranquing, key=lambda x: x[3], reverse=True)
+
+def mesurar(funcio, n):
+    partit_id = preparar(n)
+    inici = time.perf_counter()
+    funcio(GRUP, partit_id, 2, 1)
+    return time.perf_counter() - inici
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-de-dades", required=True, help="Base de dades de proves (se n'esborren les taules)")
+    parser.add_argument("--mides", type=int, nargs="+", default=[10, 1_000, 100_000])
+    parser.add_argument("--per-fila", action="store_true", help="Mesura també l'antic bucle per fila")
+    args = parser.parse_args()
+
+    if args.base_de_dades in (DB_CONFIG.get("database"), SQLITE.get("fitxer")):
+        parser.error("No facis servir la base de dades del bot per al benchmark.")
+
+    if BD_BACKEND == "mysql":
+        database.inicialitzar_bd({**DB_CONFIG, "database": args.base_de_dades})
+    else:
+        database.inicialitzar_bd({**SQLITE, "fitxer": args.base_de_dades})
+
+    print(f"{'apostes':>10} {'conjunts (s)':>14} {'per fila (s)':>14}")
+    for n in args.mides:
+        conjunts = mesurar(database.actualitzar_punts, n)
+        per_fila = f"{mesurar(actualitzar_punts_per_fila, n):14.3f}" if args.per_fila else f"{'-':>14}"
+        print(f"{n:>10} {conjunts:14.3f} {per_fila}")
+
+    database.tancar_bd()
+
+if __name__ == "__main__":
+    main()
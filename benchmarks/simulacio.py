@@ -0,0 +1,65 @@
+"""Mesura el temps de /simular: puntuar totes les apostes d'un partit amb
+cadascun dels 100 resultats de 0-0 a 9-9.
+
+Compara regles.Apostes amb NumPy, regles.Apostes amb Python pur (com quan
+NumPy no està instal·lat) i el càlcul aposta per aposta amb
+regles.punts_aposta. No toca la base de dades.
+
+    python benchmarks/simulacio.py
+    python benchmarks/simulacio.py --apostes 1000 100000 --guanyador 1
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import regles
+
+RESULTATS = [(local, visitant) for local in range(10) for visitant in range(10)]
+
+def per_aposta(gols_local, gols_visitant, regles_partit):
+    for resultat_local, resultat_visitant in RESULTATS:
+        [
+            regles.punts_aposta(regles_partit, local, visitant, resultat_local, resultat_visitant)
+            for local, visitant in zip(gols_local, gols_visitant)
+        ]
+
+def vectors(gols_local, gols_visitant, regles_partit):
+    apostes = regles.Apostes(gols_local, gols_visitant)
+    for resultat_local, resultat_visitant in RESULTATS:
+        apostes.punts(regles_partit, resultat_local, resultat_visitant)
+
+def mesurar(funcio, *args):
+    inici = time.perf_counter()
+    funcio(*args)
+    return time.perf_counter() - inici
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apostes", type=int, nargs="+", default=[10, 1_000, 100_000])
+    parser.add_argument("--guanyador", type=int, default=0, help="Punts de més per encertar el guanyador")
+    args = parser.parse_args()
+
+    regles_partit = regles.completar({"guanyador": args.guanyador})
+    numpy = regles.np
+    if numpy is None:
+        print("NumPy no està instal·lat: només es mesura Python pur.")
+
+    print(f"{'apostes':>10} {'numpy (s)':>12} {'python (s)':>12} {'per aposta (s)':>16}")
+    for n in args.apostes:
+        gols_local = [random.randint(0, 4) for _ in range(n)]
+        gols_visitant = [random.randint(0, 4) for _ in range(n)]
+
+        amb_numpy = f"{mesurar(vectors, gols_local, gols_visitant, regles_partit):12.4f}" if numpy is not None else f"{'-':>12}"
+        regles.np = None
+        try:
+            python = mesurar(vectors, gols_local, gols_visitant, regles_partit)
+        finally:
+            regles.np = numpy
+        print(f"{n:>10} {amb_numpy} {python:12.4f} {mesurar(per_aposta, gols_local, gols_visitant, regles_partit):16.4f}")
+
+if __name__ == "__main__":
+    main()
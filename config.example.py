@@ -1,9 +1,77 @@
 TOKEN_API = "telegram_token_api"
+MODE = "polling"  # Com rep el bot les actualitzacions: "polling" o "webhook"
+WEBHOOK = {
+    "escoltar": "127.0.0.1",     # Adreça on escolta el servidor HTTP local
+    "port": 8443,
+    "ruta": "porra",             # Ruta de l'endpoint (http://escoltar:port/ruta)
+    "url": "https://exemple.cat/porra",  # URL pública que es registra a Telegram (None = no registrar cap webhook: només per a proves locals)
+    "secret_token": "canvia_aquest_secret",  # Telegram l'envia a cada petició (capçalera X-Telegram-Bot-Api-Secret-Token)
+    "certificat": None,          # Certificat TLS si el bot serveix HTTPS directament (sense proxy)
+    "clau": None                 # Clau privada del certificat
+}
+BD_BACKEND = "mysql"  # Motor de base de dades: "mysql" o "sqlite"
 DB_CONFIG = {
     "host": "localhost",
     "user": "database_user",
     "password": "password_database_user",
     "database": "database_name"
 }
-GRUP_AUTORITZAT = -1234567891011 # ID GRUP FUTBOL
-USUARIS_AUTORITZATS = [12345678, 12345678]  # ID USUARIS AUTORITZATS DEL GRUP
+DB_POOL = {
+    "mida": 5,                  # Nombre màxim de connexions obertes
+    "max_inactiva": 300,        # Segons d'inactivitat abans de comprovar (ping) una connexió
+    "comprovar_sempre": False,  # Fer ping a cada connexió que es treu del pool
+    "espera": 10                # Segons d'espera màxima si totes les connexions estan ocupades
+}
+SQLITE = {
+    "fitxer": "porra.db",  # Fitxer de la base de dades quan BD_BACKEND = "sqlite"
+    "espera": 10           # Segons d'espera si la base de dades està bloquejada
+}
+CACHE_PARTIT_TTL = 600  # Segons que es confia en la cache del partit en marxa (None = sense caducitat)
+ACTUALITZACIONS_CONCURRENTS = 8  # Actualitzacions processades alhora (les d'un mateix usuari sempre en ordre)
+MIDA_PAGINA_CLASSIFICACIO = 25  # Participants per missatge de /classificacio
+MAX_PARTITS_OBERTS = 10  # Porres en marxa alhora com a màxim en un mateix grup
+MIDA_CACHE_PARTICIPANTS = 10000  # Participants (telegram_id -> id) que es recorden en memòria
+METRIQUES = {
+    "escoltar": "127.0.0.1",     # Adreça del servidor de mètriques de Prometheus (http://escoltar:port/metrics)
+    "port": 9464,                # None = sense servidor (/stats continua funcionant)
+    "consulta_lenta_ms": 200     # Les consultes més lentes s'escriuen al log (None = mai)
+}
+APOSTES_DIFERIDES = {
+    "actiu": False,              # Confirmar les apostes des de memòria i escriure-les a la base de dades per lots
+    "interval_ms": 500,          # Cada quants mil·lisegons s'escriuen les apostes pendents
+    "max_apostes": 200,          # ... o abans, quan n'hi ha aquestes de pendents
+    "diari": "apostes.diari",    # Fitxer on s'apunten les apostes pendents per no perdre-les si el bot cau
+    "sincronitzar": True         # fsync del diari a cada aposta (més lent, però sobreviu a una caiguda del sistema)
+}
+RESULTATS = {
+    "font": None,                # D'on es treuen els resultats: None (només /finalitzar), "fitxer" o "http"
+    "fitxer": "resultats.json",  # JSON amb els resultats coneguts: {"id_partit": "X-Y", ...}
+    "url": None,                 # URL que retorna el mateix JSON (font "http")
+    "interval": 300              # Segons entre consultes a la font
+}
+LIMITS = {
+    "actiu": True,               # Limitar les comandes de cada usuari i de cada xat (els administradors no en tenen)
+    "comandes_usuari": 5,        # Comandes seguides que pot enviar un usuari...
+    "per_minut_usuari": 10,      # ... i quantes en recupera cada minut
+    "consultes_xat": 10,         # Consultes seguides (/consultar, /classificacio...) en un mateix xat...
+    "per_minut_xat": 30,         # ... i quantes en recupera cada minut
+    "finestra_repetides": 10,    # Segons en què una consulta idèntica en el mateix xat no es torna a respondre
+    "cua_enviaments": True,      # Cua d'enviament amb els límits de Telegram (python-telegram-bot[rate-limiter])
+    "reintents": 3               # Vegades que es torna a enviar un missatge quan Telegram respon 429
+}
+PERSISTENCIA = {
+    "actiu": True,               # Recordar les converses a mitges (/nova) si el bot es reinicia
+    "diari": "converses.diari",  # Fitxer on s'apunten els canvis d'estat de les converses
+    "interval": 5,               # Cada quants segons es desen els canvis
+    "sincronitzar": False        # fsync del fitxer a cada canvi
+}
+PUNTUACIO = {  # Regles de puntuació de les temporades noves (regles.py)
+    "exacte": 3,                 # Resultat exacte
+    "diferencia": 2,             # Diferència de gols
+    "parcial": 1,                # Gols d'un dels dos equips
+    "guanyador": 0,              # Punts de més per encertar qui guanya (o l'empat)
+    "sense_aposta": 0            # Punts dels participants de la temporada que no aposten (p. ex. -1)
+}
+PUNTUACIO_GRUPS = {}  # Regles diferents per a algun grup: {id_grup: {"guanyador": 1}, ...}
+GRUPS_AUTORITZATS = [-1234567891011]  # ID DELS GRUPS DE FUTBOL (el primer hereta les dades d'abans dels grups)
+USUARIS_AUTORITZATS = [12345678, 12345678]  # ID USUARIS AUTORITZATS DELS GRUPS
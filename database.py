@@ -1,7 +1,70 @@
-import mysql.connector
+import asyncio
+import contextvars
+import emmagatzematge
+import functools
+import inspect
+import itertools
+import json
+import metriques
+import ranquing
 import re
-from config import DB_CONFIG
+import regles
+import threading
+import time
+from apostes_pendents import ApostesPendents
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from config import BD_BACKEND, CACHE_PARTIT_TTL, DB_CONFIG, DB_POOL, MAX_PARTITS_OBERTS, MIDA_CACHE_PARTICIPANTS, SQLITE
 from datetime import datetime
+from identitats import CacheParticipants
+
+# El motor de base de dades es tria a config.py (BD_BACKEND). Les funcions
+# d'aquest mòdul només en fan servir la interfície d'emmagatzematge.base.
+_Motor = emmagatzematge.classe(BD_BACKEND)
+
+# Excepció base del driver triat
+ErrorBD = _Motor.Error
+
+_bd = None
+_bd_lock = threading.Lock()
+
+def inicialitzar_bd(config=None):
+    """Connecta amb la base de dades configurada (una sola vegada)."""
+    global _bd
+    with _bd_lock:
+        if _bd is None:
+            if _Motor.nom == "mysql":
+                _bd = _Motor(config or DB_CONFIG, DB_POOL)
+            else:
+                _bd = _Motor(config or SQLITE)
+    return _bd
+
+def tancar_bd():
+    global _bd
+    with _bd_lock:
+        if _bd is not None:
+            _bd.tancar()
+            _bd = None
+
+def motor():
+    return _bd or inicialitzar_bd()
+
+@contextmanager
+def connexio(escriptura=True):
+    metriques.incrementar("porra_bd_connexions_total", tipus="escriptura" if escriptura else "lectura")
+    with motor().connexio(escriptura) as db:
+        yield metriques.ConnexioMesurada(db)
+
+# Les funcions d'aquest mòdul són bloquejants. Els handlers del bot les criden
+# amb `await executar(funcio, ...)`, que les envia a un pool de fils de la mateixa
+# mida que el pool de connexions per no bloquejar el bucle d'asyncio.
+_executor = ThreadPoolExecutor(max_workers=DB_POOL.get("mida", 5), thread_name_prefix="bd")
+
+async def executar(funcio, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Com asyncio.to_thread, la funció veu les contextvars de qui la crida
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, funcio, *args, **kwargs))
 
 def validar_rival(rival):
     # Permet només lletres, números, espais i certs símbols (com guions o apòstrofs)
@@ -9,12 +72,12 @@ def validar_rival(rival):
         raise ValueError("El nom del rival conté caràcters no vàlids.")
     return True
 
-def registrar_partit(user_data, update):
+def registrar_partit(user_data, grup_id):
     if "rival" not in user_data or "data" not in user_data:
         return {"estat": 0, "missatge": "Falten dades: rival o data."}
 
-    if existeix_porra_en_marxa():
-        return {"estat": 0, "missatge": "Ja hi ha una porra en marxa. Espera que s'acabi abans de crear-ne una de nova."}
+    if len(obtenir_partits_en_marxa(grup_id)) >= MAX_PARTITS_OBERTS:
+        return {"estat": 0, "missatge": f"Ja hi ha {MAX_PARTITS_OBERTS} porres en marxa. Espera que se n'acabi alguna abans de crear-ne una de nova."}
 
     # Validar i convertir la data al format MySQL
     try:
@@ -22,254 +85,1107 @@ def registrar_partit(user_data, update):
     except ValueError:
         return {"estat": 0, "missatge": "El format de la data no és correcte. Usa 'dd-mm-aaaa hh:mm' (Exemple: 24-03-2025 18:30)."}
 
-    if existeix_partit(user_data['rival'], data_formatejada):
+    if existeix_partit(grup_id, user_data['rival'], data_formatejada):
         return {"estat": 0, "missatge": "Aquest partit ja està registrat a la base de dades. No es pot crear la mateixa porra dues vegades!"}
 
     try:
-        db = mysql.connector.connect(**DB_CONFIG)
-        cursor = db.cursor()
-
         rival = user_data["rival"]
         validar_rival(rival)
+        temporada_id = _temporada_per_escriure(grup_id)["id"]
 
+        with connexio() as db:
+            cursor = db.cursor()
+            try:
+                query = """
+                    INSERT INTO partits (grup_id, temporada_id, nom_contrincant, data_hora, juga_a_casa)
+                    VALUES (%s, %s, %s, %s, %s)
+                """
+                cursor.execute(query, (grup_id, temporada_id, rival, data_formatejada, user_data['juga_a_casa']))
+                partit_id = cursor.lastrowid
+                db.commit()
+                invalidar_partits_en_marxa(grup_id)
+                _apostes_canviades(grup_id)
+            finally:
+                cursor.close()
+    except ErrorBD as err:
+        return {"estat": 0, "missatge": f"Error al registrar el partit: {err}"}
+
+    return {"estat": 1, "missatge": "Porra creada correctament!", "partit_id": partit_id}
+
+# Versió de les apostes dels partits en marxa de cada grup. Augmenta cada vegada
+# que canvia alguna aposta o algun partit del grup, i permet saber si un missatge
+# ja generat de /consultar encara és vàlid sense tornar a llegir la base de dades.
+_versio_apostes = itertools.count(1)
+_versions_apostes = {}  # grup_id -> versió
+
+def versio_apostes(grup_id):
+    return _versions_apostes.get(grup_id)
+
+def _apostes_canviades(grup_id):
+    _versions_apostes[grup_id] = next(_versio_apostes)
+
+# Cache de participants (identitats.py). Els canvis de nom d'usuari de Telegram
+# s'apunten a _noms_pendents i escriure_noms_pendents els escriu tots junts.
+_participants = CacheParticipants(MIDA_CACHE_PARTICIPANTS)
+_noms_pendents = {}  # participant_id -> nom_usuari
+_noms_lock = threading.Lock()
+
+def carregar_participants():
+    """Omple la cache amb els participants que han apostat més recentment."""
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor()
         query = """
-            INSERT INTO partits (nom_contrincant, data_hora, juga_a_casa)
-            VALUES (%s, %s, %s)
+            SELECT p.telegram_id, p.id, p.nom_usuari
+            FROM participants p
+            LEFT JOIN apostes a ON a.participant_id = p.id
+            GROUP BY p.id, p.telegram_id, p.nom_usuari
+            ORDER BY MAX(a.id) DESC
+            LIMIT %s
         """
-        cursor.execute(query, (rival, data_formatejada, user_data['juga_a_casa']))
-        db.commit()
-    except mysql.connector.Error as err:
-        return {"estat": 0, "missatge": f"Error al registrar el partit: {err}"}
-    finally:
+        cursor.execute(query, (MIDA_CACHE_PARTICIPANTS,))
+        files = cursor.fetchall()
         cursor.close()
-        db.close()
 
-    return {"estat": 1, "missatge": "Porra creada correctament!"}
+    # Del menys recent al més recent, perquè l'ordre LRU quedi com a la base de dades
+    for telegram_id, participant_id, nom_usuari in reversed(files):
+        _participants.desar(telegram_id, participant_id, nom_usuari)
+    return len(files)
 
-def registrar_aposta(partit_id, participant_id, gols_local, gols_visitant):
-    db = mysql.connector.connect(**DB_CONFIG)
-    cursor = db.cursor()
+def _nom_canviat(telegram_id, participant_id, nom_usuari):
+    _participants.desar(telegram_id, participant_id, nom_usuari)
+    with _noms_lock:
+        _noms_pendents[participant_id] = nom_usuari
+    ranquing.canviar_nom(participant_id, nom_usuari)
+
+def identificar_participant(telegram_id, nom_usuari):
+    """Retorna l'id del participant si és a la cache, sense tocar la base de dades, o None.
+
+    Si el nom d'usuari ha canviat l'apunta per escriure'l més tard i el canvia
+    de seguida a les classificacions en memòria.
+    """
+    entrada = _participants.obtenir(telegram_id)
+    if entrada is None:
+        return None
+    participant_id, nom_anterior = entrada
+    if nom_usuari != nom_anterior:
+        _nom_canviat(telegram_id, participant_id, nom_usuari)
+    return participant_id
+
+def _participant_llegit(telegram_id, participant_id, nom_desat, nom_usuari):
+    """Desa a la cache un participant llegit de la base de dades i apunta el nom nou si ha canviat."""
+    if nom_usuari == nom_desat:
+        _participants.desar(telegram_id, participant_id, nom_desat)
+    else:
+        _nom_canviat(telegram_id, participant_id, nom_usuari)
+
+def _participant_desat(telegram_id, participant_id, nom_usuari):
+    # La base de dades ja té el nom actual: un canvi pendent més antic el trepitjaria
+    _participants.desar(telegram_id, participant_id, nom_usuari)
+    with _noms_lock:
+        _noms_pendents.pop(participant_id, None)
+    ranquing.canviar_nom(participant_id, nom_usuari)
+
+def escriure_noms_pendents():
+    """Escriu els noms d'usuari que han canviat i retorna quants n'ha escrit."""
+    with _noms_lock:
+        noms = dict(_noms_pendents)
+        _noms_pendents.clear()
+    if not noms:
+        return 0
 
     try:
-        # Comprovar si ja existeix una aposta per al participant i el partit
-        query = "SELECT COUNT(*) FROM apostes WHERE partit_id = %s AND participant_id = %s"
-        cursor.execute(query, (partit_id, participant_id))
-        (existeix,) = cursor.fetchone()
+        with connexio() as db:
+            cursor = db.cursor()
+            try:
+                query = "UPDATE participants SET nom_usuari = %s WHERE id = %s"
+                cursor.executemany(query, [(nom_usuari, participant_id) for participant_id, nom_usuari in noms.items()])
+                db.commit()
+            finally:
+                cursor.close()
+    except ErrorBD:
+        with _noms_lock:
+            for participant_id, nom_usuari in noms.items():
+                _noms_pendents.setdefault(participant_id, nom_usuari)
+        raise
+    return len(noms)
 
-        if existeix:
-            # Si ja existeix, actualitzem l'aposta
-            query = """
-                UPDATE apostes 
-                SET gols_local = %s, gols_visitant = %s
-                WHERE partit_id = %s AND participant_id = %s
-            """
-            cursor.execute(query, (gols_local, gols_visitant, partit_id, participant_id))
-        else:
-            # Si no existeix, fem un INSERT
-            query = """
-                INSERT INTO apostes (partit_id, participant_id, gols_local, gols_visitant)
-                VALUES (%s, %s, %s, %s)
-            """
-            cursor.execute(query, (partit_id, participant_id, gols_local, gols_visitant))
+def estadistiques_participants():
+    return _participants.estadistiques()
 
-        db.commit()
-        return {"estat": 1, "missatge": "Aposta registrada correctament."}
+def _inserir_participants(cursor, noms):
+    """Crea els participants {telegram_id: nom_usuari} que no existeixin.
 
-    except mysql.connector.Error as err:
+    Retorna {telegram_id: (id, nom_usuari desat)}. Els noms dels que ja
+    existien no es toquen. No omple la cache: la transacció encara es pot desfer.
+    """
+    cursor.executemany(motor().SQL_INSERIR_PARTICIPANT, [(nom, telegram_id) for telegram_id, nom in noms.items()])
+    participants = {}
+    telegram_ids = list(noms)
+    for inici in range(0, len(telegram_ids), 500):
+        tros = telegram_ids[inici:inici + 500]
+        marcadors = ", ".join(["%s"] * len(tros))
+        query = f"SELECT telegram_id, id, nom_usuari FROM participants WHERE telegram_id IN ({marcadors})"
+        cursor.execute(query, tuple(tros))
+        for telegram_id, participant_id, nom_usuari in cursor.fetchall():
+            participants[telegram_id] = (participant_id, nom_usuari)
+    return participants
+
+def registrar_aposta(grup_id, partit_id, participant_id, gols_local, gols_visitant):
+    try:
+        with connexio() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(motor().SQL_UPSERT_APOSTA, (partit_id, participant_id, gols_local, gols_visitant))
+                db.commit()
+                _apostes_canviades(grup_id)
+                return {"estat": 1, "missatge": "Aposta registrada correctament.", "participant_id": participant_id}
+            finally:
+                cursor.close()
+
+    except ErrorBD as err:
         return {"estat": 0, "missatge": f"Error al registrar l'aposta: {err}"}
 
-    finally:
-        cursor.close()
-        db.close()
-
-def existeix_porra_en_marxa():
-    db = mysql.connector.connect(**DB_CONFIG)
-    cursor = db.cursor()
-    query = "SELECT COUNT(*) FROM partits WHERE resultat IS NULL"
-    cursor.execute(query)
-    (count,) = cursor.fetchone()
-    cursor.close()
-    db.close()
-    return count > 0
+def registrar_aposta_participant(grup_id, partit_id, telegram_id, nom_usuari, gols_local, gols_visitant):
+    """Registra el participant (si no existeix) i la seva aposta en una sola transacció."""
+    # Si ja el coneixem, n'hi ha prou amb escriure l'aposta
+    participant_id = identificar_participant(telegram_id, nom_usuari)
+    if participant_id is not None:
+        return registrar_aposta(grup_id, partit_id, participant_id, gols_local, gols_visitant)
 
-def existeix_partit(rival, data):
-    db = mysql.connector.connect(**DB_CONFIG)
-    cursor = db.cursor()
-    query = "SELECT COUNT(*) FROM partits WHERE nom_contrincant = %s AND data_hora = %s"
-    cursor.execute(query, (rival, data))
-    (count,) = cursor.fetchone()
-    cursor.close()
-    db.close()
-    return count > 0
+    try:
+        with connexio() as db:
+            cursor = db.cursor()
+            try:
+                participant_id = motor().upsert_participant(cursor, nom_usuari, telegram_id)
 
-def obtenir_partit_en_marxa():
-    db = mysql.connector.connect(**DB_CONFIG)
-    cursor = db.cursor(dictionary=True)
-    query = "SELECT * FROM partits WHERE resultat IS NULL LIMIT 1"
-    cursor.execute(query)
-    partit = cursor.fetchone()
-    cursor.close()
-    db.close()
-    return partit
-
-def obtenir_participant(telegram_id, nom_usuari):
-    db = mysql.connector.connect(**DB_CONFIG)
-    cursor = db.cursor()
-
-    # Comprova si l'usuari ja està registrat
-    query = "SELECT id FROM participants WHERE telegram_id = %s"
-    cursor.execute(query, (telegram_id,))
-    result = cursor.fetchone()
-
-    if result:
-        participant_id = result[0]
-    else:
-        # Registra el nou usuari i obté el seu `id`
-        query = "INSERT INTO participants (nom_usuari, telegram_id) VALUES (%s, %s)"
-        cursor.execute(query, (nom_usuari, telegram_id))
-        db.commit()
-        participant_id = cursor.lastrowid
-
-    cursor.close()
-    db.close()
-    return participant_id
+                cursor.execute(motor().SQL_UPSERT_APOSTA, (partit_id, participant_id, gols_local, gols_visitant))
+                db.commit()
+                _participant_desat(telegram_id, participant_id, nom_usuari)
+                _apostes_canviades(grup_id)
+                return {"estat": 1, "missatge": "Aposta registrada correctament.", "participant_id": participant_id}
+            except ErrorBD:
+                db.rollback()
+                raise
+            finally:
+                cursor.close()
 
-def tancar_porra(partit_id, resultat):
-    db = mysql.connector.connect(**DB_CONFIG)
-    cursor = db.cursor()
+    except ErrorBD as err:
+        return {"estat": 0, "missatge": f"Error al registrar l'aposta: {err}"}
+
+# Mode d'apostes diferides: les apostes es confirmen en desar-les a memòria (i al
+# diari) i buidar_apostes les escriu a la base de dades per lots. Cal buidar-les
+# abans de llegir o puntuar les apostes d'un partit.
+_apostes_pendents = None
+_buidat_lock = threading.Lock()
+_partits_anulats = set()  # Partits anul·lats o que s'estan anul·lant: les seves apostes no s'escriuen
+
+def activar_apostes_diferides(diari, sincronitzar=True):
+    """Activa el mode diferit i escriu les apostes que havien quedat al diari."""
+    global _apostes_pendents
+    pendents = ApostesPendents(diari, sincronitzar)
+    recuperades = pendents.obrir()
 
+    # Les apostes de partits que ja s'han tancat o anul·lat no es poden escriure
+    oberts = {partit["id"] for partit in carregar_partits_en_marxa()}
+    pendents.restaurar(aposta for aposta in recuperades if aposta[1] in oberts)
+    _apostes_pendents = pendents
+    return buidar_apostes()
+
+def apostes_diferides():
+    return _apostes_pendents is not None
+
+def registrar_aposta_diferida(grup_id, partit_id, telegram_id, nom_usuari, gols_local, gols_visitant):
+    """Desa l'aposta a les pendents; buidar_apostes l'escriurà a la base de dades."""
+    if partit_id in _partits_anulats:
+        return {"estat": 0, "missatge": "Aquest partit s'ha anul·lat."}
     try:
-        query = "UPDATE partits SET resultat = %s WHERE id = %s"
-        cursor.execute(query, (resultat, partit_id))
-        db.commit()
-        return {"estat": 1, "missatge": "Porra finalitzada correctament."}
-    except mysql.connector.Error as err:
-        return {"estat": 0, "missatge": f"Error al tancar la porra: {err}"}
-    finally:
+        pendents = _apostes_pendents.afegir(grup_id, partit_id, telegram_id, nom_usuari, gols_local, gols_visitant)
+    except OSError as err:
+        return {"estat": 0, "missatge": f"Error al registrar l'aposta: {err}"}
+    _apostes_canviades(grup_id)
+    return {"estat": 1, "missatge": "Aposta registrada correctament.", "pendents": pendents}
+
+def buidar_apostes(partits=None):
+    """Escriu les apostes pendents (totes, o les dels partits indicats) i retorna quantes n'ha escrit.
+
+    Tots els participants nous i totes les apostes van en una sola transacció
+    amb dos executemany. Si falla, les apostes tornen a quedar pendents.
+    """
+    if _apostes_pendents is None:
+        return 0
+
+    with _buidat_lock:
+        apostes = _apostes_pendents.treure(partits)
+        # Les d'un partit que s'està anul·lant es queden pendents: si l'anul·lació
+        # falla, s'han d'escriure, i si va bé, descartar_apostes les oblida
+        anulades = [aposta for aposta in apostes if aposta[1] in _partits_anulats]
+        if anulades:
+            _apostes_pendents.restaurar(anulades)
+            apostes = [aposta for aposta in apostes if aposta[1] not in _partits_anulats]
+        if not apostes:
+            return 0
+
+        try:
+            with connexio() as db:
+                cursor = db.cursor()
+                try:
+                    noms = {telegram_id: nom_usuari for _, _, telegram_id, nom_usuari, _, _ in apostes}
+
+                    # Només cal anar a buscar a la base de dades els que no són a la cache
+                    participants = {}
+                    nous = {}
+                    for telegram_id, nom_usuari in noms.items():
+                        participant_id = identificar_participant(telegram_id, nom_usuari)
+                        if participant_id is None:
+                            nous[telegram_id] = nom_usuari
+                        else:
+                            participants[telegram_id] = participant_id
+
+                    inserits = _inserir_participants(cursor, nous) if nous else {}
+                    for telegram_id, (participant_id, _) in inserits.items():
+                        participants[telegram_id] = participant_id
+
+                    cursor.executemany(motor().SQL_UPSERT_APOSTA, [
+                        (partit_id, participants[telegram_id], gols_local, gols_visitant)
+                        for _, partit_id, telegram_id, _, gols_local, gols_visitant in apostes
+                    ])
+                    db.commit()
+                except ErrorBD:
+                    db.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        except ErrorBD:
+            _apostes_pendents.restaurar(apostes)
+            raise
+
+        _apostes_pendents.compactar()
+
+    # Els participants que no eren a la cache hi van directament, sense tornar-los a
+    # buscar; si ja existien amb un altre nom, s'apunta el nou
+    for telegram_id, (participant_id, nom_desat) in inserits.items():
+        _participant_llegit(telegram_id, participant_id, nom_desat, nous[telegram_id])
+
+    for grup_id in {aposta[0] for aposta in apostes}:
+        _apostes_canviades(grup_id)
+    return len(apostes)
+
+def descartar_apostes(partit_id):
+    """Oblida les apostes pendents d'un partit que ja s'ha anul·lat."""
+    if _apostes_pendents is None:
+        return
+    with _buidat_lock:
+        _apostes_pendents.descartar(partit_id)
+
+def existeix_partit(grup_id, rival, data):
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor()
+        query = "SELECT COUNT(*) FROM partits WHERE grup_id = %s AND nom_contrincant = %s AND data_hora = %s"
+        cursor.execute(query, (grup_id, rival, data))
+        (count,) = cursor.fetchone()
+        cursor.close()
+    return count > 0
+
+# Cache dels partits en marxa de cada grup. Les files només canvien quan es crea,
+# es tanca o s'anul·la un partit, i aquestes funcions invaliden la cache del grup.
+# CACHE_PARTIT_TTL (segons, o None) és una xarxa de seguretat per si algú toca
+# la taula a mà.
+_cache_partits = {}  # grup_id -> {"partits": [...], "moment": float}
+_generacions_partits = {}  # grup_id -> int
+_cache_partits_lock = threading.Lock()
+
+def carregar_partits_en_marxa(grup_id=None):
+    """Llegeix els partits en marxa d'un grup (o de tots) i els desa a la cache."""
+    with _cache_partits_lock:
+        generacions = dict(_generacions_partits)
+
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor(dictionary=True)
+        if grup_id is None:
+            query = "SELECT * FROM partits WHERE resultat IS NULL ORDER BY data_hora, id"
+            cursor.execute(query)
+        else:
+            query = "SELECT * FROM partits WHERE grup_id = %s AND resultat IS NULL ORDER BY data_hora, id"
+            cursor.execute(query, (grup_id,))
+        partits = cursor.fetchall()
         cursor.close()
-        db.close()
 
-def anular_partit(partit_id):
-    db = mysql.connector.connect(**DB_CONFIG)
-    cursor = db.cursor()
+    per_grup = {} if grup_id is None else {grup_id: []}
+    for partit in partits:
+        per_grup.setdefault(partit["grup_id"], []).append(partit)
+
+    ara = time.monotonic()
+    with _cache_partits_lock:
+        for grup, partits_grup in per_grup.items():
+            # Si s'ha invalidat mentre llegíem, el valor llegit pot ser antic
+            if generacions.get(grup, 0) == _generacions_partits.get(grup, 0):
+                _cache_partits[grup] = {"partits": partits_grup, "moment": ara}
+    return per_grup.get(grup_id, []) if grup_id is not None else partits
+
+def invalidar_partits_en_marxa(grup_id):
+    with _cache_partits_lock:
+        _cache_partits.pop(grup_id, None)
+        _generacions_partits[grup_id] = _generacions_partits.get(grup_id, 0) + 1
+
+def obtenir_partits_en_marxa(grup_id):
+    """Retorna els partits en marxa del grup, ordenats per data."""
+    with _cache_partits_lock:
+        en_cache = _cache_partits.get(grup_id)
+        vigent = en_cache is not None and (
+            CACHE_PARTIT_TTL is None or time.monotonic() - en_cache["moment"] < CACHE_PARTIT_TTL
+        )
+    metriques.incrementar("porra_cache_total", cache="partits", resultat="encert" if vigent else "errada")
+    partits = en_cache["partits"] if vigent else carregar_partits_en_marxa(grup_id)
+    return [dict(partit) for partit in partits]
+
+def tancar_apostes(grup_id, partit_id):
+    """Marca que el partit ja no accepta apostes. Retorna False si ja ho estava
+    (o si el partit ja no existeix), de manera que només es tanca una vegada."""
+    with connexio() as db:
+        cursor = db.cursor()
+        try:
+            query = """
+                UPDATE partits SET apostes_tancades = 1
+                WHERE id = %s AND grup_id = %s AND apostes_tancades = 0 AND resultat IS NULL
+            """
+            cursor.execute(query, (partit_id, grup_id))
+            tancat = cursor.rowcount > 0
+            db.commit()
+        finally:
+            cursor.close()
+    if tancat:
+        invalidar_partits_en_marxa(grup_id)
+        # Les apostes acceptades fins ara han de sortir a la llista definitiva
+        buidar_apostes({partit_id})
+        _apostes_canviades(grup_id)
+    return tancat
 
+def anular_partit(grup_id, partit_id):
+    # A partir d'ara no s'accepten ni s'escriuen apostes del partit. Amb el lock,
+    # un lot que s'estigui escrivint (i que en pot portar alguna) acaba abans de
+    # l'esborrat, i els lots següents ja veuen la marca
+    with _buidat_lock:
+        _partits_anulats.add(partit_id)
+    esborrat = False
     try:
-        # Elimina les apostes associades al partit
-        query = "DELETE FROM apostes WHERE partit_id = %s"
-        cursor.execute(query, (partit_id,))
+        with connexio() as db:
+            cursor = db.cursor()
+            try:
+                # Elimina les apostes associades al partit
+                query = "DELETE FROM apostes WHERE partit_id = %s"
+                cursor.execute(query, (partit_id,))
 
-        # Elimina el partit
-        query = "DELETE FROM partits WHERE id = %s"
-        cursor.execute(query, (partit_id,))
+                # Elimina el partit
+                query = "DELETE FROM partits WHERE id = %s AND grup_id = %s"
+                cursor.execute(query, (partit_id, grup_id))
 
-        db.commit()
-        return {"estat": 1, "missatge": "El partit i les apostes associades s'han eliminat correctament."}
+                db.commit()
+                esborrat = True
+            finally:
+                cursor.close()
 
-    except mysql.connector.Error as err:
+    except ErrorBD as err:
         return {"estat": 0, "missatge": f"Error al anul·lar el partit: {err}"}
-
     finally:
-        cursor.close()
-        db.close()
+        # Si no s'ha esborrat (per l'error que sigui), el partit continua en marxa:
+        # ha d'acceptar apostes i les pendents s'han d'escriure
+        if not esborrat:
+            _partits_anulats.discard(partit_id)
 
-def obtenir_porra_en_marxa():
-    db = mysql.connector.connect(**DB_CONFIG)
-    cursor = db.cursor(dictionary=True)
+    descartar_apostes(partit_id)
+    with _simulacions_lock:
+        _simulacions.pop(partit_id, None)
+    invalidar_partits_en_marxa(grup_id)
+    _apostes_canviades(grup_id)
+    return {"estat": 1, "missatge": "El partit i les apostes associades s'han eliminat correctament."}
 
+def obtenir_porra_en_marxa(grup_id):
+    """Retorna els partits en marxa del grup, cadascun amb les seves apostes."""
     try:
-        # Comprova si hi ha un partit en marxa (sense resultat)
-        query = "SELECT id, nom_contrincant, data_hora, juga_a_casa FROM partits WHERE resultat IS NULL LIMIT 1"
-        cursor.execute(query)
-        partit = cursor.fetchone()
-
-        if not partit:
+        # Comprova si hi ha partits en marxa (sense resultat)
+        partits = obtenir_partits_en_marxa(grup_id)
+        if not partits:
             return {"estat": 0, "missatge": "No hi ha cap partit en marxa actualment."}
+        buidar_apostes({partit["id"] for partit in partits})
+
+        with connexio(escriptura=False) as db:
+            cursor = db.cursor(dictionary=True)
+            try:
+                # Obtenim totes les apostes dels partits en marxa amb una sola consulta
+                marcadors = ", ".join(["%s"] * len(partits))
+                query = f"""
+                    SELECT a.partit_id, p.nom_usuari, a.gols_local, a.gols_visitant
+                    FROM apostes a
+                    JOIN participants p ON a.participant_id = p.id
+                    WHERE a.partit_id IN ({marcadors})
+                """
+                cursor.execute(query, tuple(partit["id"] for partit in partits))
+                apostes = {partit["id"]: [] for partit in partits}
+                for aposta in cursor.fetchall():
+                    apostes[aposta.pop("partit_id")].append(aposta)
+
+                return {
+                    "estat": 1,
+                    "partits": [{"partit": partit, "apostes": apostes[partit["id"]]} for partit in partits],
+                }
+            finally:
+                cursor.close()
+
+    except ErrorBD as err:
+        return {"estat": 0, "missatge": f"Error al consultar la porra: {err}"}
 
-        # Obtenim totes les apostes per al partit en marxa
+# La mateixa regla que regles.punts_aposta, expressada en SQL perquè la base de
+# dades puntuï totes les apostes d'un partit amb una sola sentència.
+# Paràmetres: (local, visitant, exacte, local - visitant, diferencia, local, visitant,
+# parcial, signe del resultat, guanyador); els dona parametres_punts
+EXPRESSIO_PUNTS = """
+    CASE
+        WHEN a.gols_local = %s AND a.gols_visitant = %s THEN %s
+        WHEN a.gols_local - a.gols_visitant = %s THEN %s
+        WHEN a.gols_local = %s OR a.gols_visitant = %s THEN %s
+        ELSE 0
+    END
+    + CASE
+        WHEN (CASE WHEN a.gols_local > a.gols_visitant THEN 1 WHEN a.gols_local < a.gols_visitant THEN -1 ELSE 0 END) = %s THEN %s
+        ELSE 0
+    END
+"""
+
+def parametres_punts(regles_temporada, resultat_local, resultat_visitant):
+    return (
+        resultat_local, resultat_visitant, regles_temporada["exacte"],
+        resultat_local - resultat_visitant, regles_temporada["diferencia"],
+        resultat_local, resultat_visitant, regles_temporada["parcial"],
+        regles.signe(resultat_local, resultat_visitant), regles_temporada["guanyador"],
+    )
+
+def actualitzar_punts(grup_id, partit_id, resultat_local, resultat_visitant):
+    """Posa el resultat al partit i el puntua, tot en una sola transacció.
+
+    Retorna el rànquing de la jornada, o None si el partit ja tenia resultat.
+    """
+    regles_temporada = temporada_actual(grup_id)["regles"]
+    buidar_apostes({partit_id})
+    with _simulacions_lock:
+        _simulacions.pop(partit_id, None)
+    # El rànquing de la jornada ha de sortir amb els noms actuals
+    escriure_noms_pendents()
+
+    with connexio() as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            # Només si encara no té resultat: /finalitzar i la font de resultats
+            # no poden puntuar dues vegades el mateix partit
+            query = "UPDATE partits SET resultat = %s, apostes_tancades = 1 WHERE id = %s AND grup_id = %s AND resultat IS NULL"
+            cursor.execute(query, (f"{resultat_local}-{resultat_visitant}", partit_id, grup_id))
+            if cursor.rowcount == 0:
+                db.rollback()
+                return None
+
+            # Punts de la jornada de totes les apostes del partit
+            query = motor().SQL_PUNTS_JORNADA.format(punts=EXPRESSIO_PUNTS)
+            cursor.execute(query, parametres_punts(regles_temporada, resultat_local, resultat_visitant) + (partit_id,))
+
+            # Sumem els punts de la jornada a la classificació de la temporada
+            cursor.execute(motor().SQL_SUMAR_PUNTS_TEMPORADA, (partit_id,))
+
+            # I el partit a les estadístiques de cada participant (/estadistiques)
+            cursor.execute(motor().SQL_SUMAR_ESTADISTIQUES, (grup_id, resultat_local, resultat_visitant, partit_id))
+
+            # Els participants de la temporada que no han apostat, si la regla sense_aposta ho diu
+            sense_aposta = []
+            if regles_temporada["sense_aposta"]:
+                query = """
+                    SELECT t.participant_id, p.nom_usuari, p.telegram_id
+                    FROM punts_temporada t
+                    INNER JOIN participants p ON p.id = t.participant_id
+                    WHERE t.temporada_id = (SELECT temporada_id FROM partits WHERE id = %s)
+                        AND t.participant_id NOT IN (SELECT participant_id FROM apostes WHERE partit_id = %s)
+                """
+                cursor.execute(query, (partit_id, partit_id))
+                sense_aposta = cursor.fetchall()
+                punts = regles_temporada["sense_aposta"]
+                cursor.executemany(
+                    "UPDATE punts_temporada SET punts = punts + %s WHERE participant_id = %s "
+                    "AND temporada_id = (SELECT temporada_id FROM partits WHERE id = %s)",
+                    [(punts, participant["participant_id"], partit_id) for participant in sense_aposta],
+                )
+
+            # Rànquing de la jornada, ja ordenat
+            query = """
+                SELECT a.participant_id, p.nom_usuari, p.telegram_id, a.gols_local, a.gols_visitant, a.punts_jornada
+                FROM apostes a
+                INNER JOIN participants p ON a.participant_id = p.id
+                WHERE a.partit_id = %s
+                ORDER BY a.punts_jornada DESC, a.id ASC
+            """
+            cursor.execute(query, (partit_id,))
+            apostes = cursor.fetchall()
+
+            # Tot o res: si alguna sentència falla, el partit queda sense resultat
+            # i sense cap total a mitges, i es pot tornar a finalitzar
+            db.commit()
+        except ErrorBD:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    invalidar_partits_en_marxa(grup_id)
+    _apostes_canviades(grup_id)
+    ranquing.sumar_punts(grup_id, itertools.chain(
+        ((aposta["participant_id"], aposta["nom_usuari"], aposta["telegram_id"], aposta["punts_jornada"])
+         for aposta in apostes),
+        ((participant["participant_id"], participant["nom_usuari"], participant["telegram_id"], regles_temporada["sense_aposta"])
+         for participant in sense_aposta),
+    ))
+
+    return [
+        (aposta["nom_usuari"], aposta["gols_local"], aposta["gols_visitant"], aposta["punts_jornada"])
+        for aposta in apostes
+    ]
+
+# Apostes de cada partit preparades per a /simular. Es tornen a llegir quan
+# canvia la versió de les apostes del grup.
+_simulacions = {}  # partit_id -> (versió de les apostes, participants, regles.Apostes)
+_simulacions_lock = threading.Lock()
+
+def _apostes_simulacio(grup_id, partit_id):
+    with _simulacions_lock:
+        en_cache = _simulacions.get(partit_id)
+    vigent = en_cache is not None and en_cache[0] == versio_apostes(grup_id)
+    metriques.incrementar("porra_cache_total", cache="simulacio", resultat="encert" if vigent else "errada")
+    if vigent:
+        return en_cache[1], en_cache[2]
+
+    buidar_apostes({partit_id})
+    # La versió es llegeix abans que les apostes: si n'arriba una de nova mentre
+    # llegim, la propera simulació les tornarà a llegir
+    versio = versio_apostes(grup_id)
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor()
         query = """
-            SELECT p.nom_usuari, a.gols_local, a.gols_visitant
+            SELECT a.participant_id, p.nom_usuari, p.telegram_id, a.gols_local, a.gols_visitant
             FROM apostes a
-            JOIN participants p ON a.participant_id = p.id
+            INNER JOIN participants p ON p.id = a.participant_id
             WHERE a.partit_id = %s
         """
-        cursor.execute(query, (partit["id"],))
-        apostes = cursor.fetchall()
+        cursor.execute(query, (partit_id,))
+        files = cursor.fetchall()
+        cursor.close()
 
-        return {"estat": 1, "partit": partit, "apostes": apostes}
+    participants = [(participant_id, nom_usuari, telegram_id) for participant_id, nom_usuari, telegram_id, _, _ in files]
+    apostes = regles.Apostes([fila[3] for fila in files], [fila[4] for fila in files])
+    with _simulacions_lock:
+        _simulacions[partit_id] = (versio, participants, apostes)
+    return participants, apostes
 
-    except mysql.connector.Error as err:
-        return {"estat": 0, "missatge": f"Error al consultar la porra: {err}"}
+def simular_resultat(grup_id, partit_id, resultat_local, resultat_visitant):
+    """Classificació de la temporada si el partit en marxa acabés amb aquest resultat.
 
-    finally:
+    Retorna una llista ordenada de diccionaris amb posicio, nom_usuari,
+    telegram_id, punts, punts_partit i canvi (posicions guanyades, o None si
+    el participant encara no era a la classificació).
+    """
+    regles_temporada = temporada_actual(grup_id)["regles"]
+    participants, apostes = _apostes_simulacio(grup_id, partit_id)
+    punts_partit = apostes.punts(regles_temporada, resultat_local, resultat_visitant)
+
+    if not ranquing.carregat(grup_id):
+        carregar_classificacio(grup_id)
+    actuals = ranquing.punts(grup_id)
+
+    # Mateix ordre que la classificació: punts descendents i després el nom
+    def ordenar(files):
+        return sorted(files, key=lambda participant_id: (-files[participant_id][2], files[participant_id][0].lower(), participant_id))
+
+    posicions = {participant_id: posicio for posicio, participant_id in enumerate(ordenar(actuals), start=1)}
+    projectats = {
+        participant_id: (nom_usuari, telegram_id, punts + regles_temporada["sense_aposta"], regles_temporada["sense_aposta"])
+        for participant_id, (nom_usuari, telegram_id, punts) in actuals.items()
+    }
+    for (participant_id, nom_usuari, telegram_id), punts in zip(participants, punts_partit):
+        punts = int(punts)
+        anteriors = actuals.get(participant_id, (nom_usuari, telegram_id, 0))[2]
+        projectats[participant_id] = (nom_usuari, telegram_id, anteriors + punts, punts)
+
+    return [
+        {
+            "posicio": posicio,
+            "nom_usuari": projectats[participant_id][0],
+            "telegram_id": projectats[participant_id][1],
+            "punts": projectats[participant_id][2],
+            "punts_partit": projectats[participant_id][3],
+            "canvi": posicions[participant_id] - posicio if participant_id in posicions else None,
+        }
+        for posicio, participant_id in enumerate(ordenar(projectats), start=1)
+    ]
+
+def obtenir_estadistiques(grup_id, telegram_id):
+    """Estadístiques acumulades del participant al grup, o None si encara no ha puntuat cap partit."""
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor(dictionary=True)
+        query = """
+            SELECT e.*, p.nom_usuari, m.nom_contrincant AS millor_rival, m.data_hora AS millor_data,
+                ma.nom_contrincant AS millor_rival_arxiu, ma.data_hora AS millor_data_arxiu
+            FROM estadistiques e
+            INNER JOIN participants p ON p.id = e.participant_id
+            LEFT JOIN partits m ON m.id = e.millor_partit_id
+            LEFT JOIN partits_arxiu ma ON ma.id = e.millor_partit_id
+            WHERE e.grup_id = %s AND p.telegram_id = %s
+        """
+        cursor.execute(query, (grup_id, telegram_id))
+        estadistiques = cursor.fetchone()
         cursor.close()
-        db.close()
-
-def calcular_punts(aposta_local, aposta_visitant, resultat_local, resultat_visitant):
-    punts = 0
-
-    # Punts per coincidència exacta
-    if aposta_local == resultat_local and aposta_visitant == resultat_visitant:
-        punts = 3
-    # Punts per encertar la diferència de gols
-    elif (aposta_local - aposta_visitant) == (resultat_local - resultat_visitant):
-        punts = 2
-    # Punts per encertar un dels dos marcadors
-    elif aposta_local == resultat_local or aposta_visitant == resultat_visitant:
-        punts = 1
-
-    return punts
-
-def actualitzar_punts(partit_id, resultat_local, resultat_visitant):
-    db = mysql.connector.connect(**DB_CONFIG)
-    cursor = db.cursor(dictionary=True)
-
-    # Obtenim totes les apostes del partit
-    query = """
-        SELECT a.id AS aposta_id, a.participant_id, a.gols_local, a.gols_visitant, p.nom_usuari, p.punts
-        FROM apostes a
-        INNER JOIN participants p ON a.participant_id = p.id
-        WHERE a.partit_id = %s
+    if estadistiques is not None:
+        # El millor partit pot ser d'una temporada ja arxivada
+        rival, data = estadistiques.pop("millor_rival_arxiu"), estadistiques.pop("millor_data_arxiu")
+        if estadistiques["millor_rival"] is None:
+            estadistiques["millor_rival"], estadistiques["millor_data"] = rival, data
+    return estadistiques
+
+def obtenir_cara_a_cara(grup_id, telegram_id, nom_rival):
+    """Compara els punts de dos participants als partits del grup on han apostat tots dos.
+
+    Retorna {"rival", "partits", "guanyades", "empatades", "perdudes"}, None
+    si el rival no existeix o {"rival", "ambigu": True} si hi ha més d'un
+    participant amb aquest nom. Compta també les temporades arxivades.
     """
-    cursor.execute(query, (partit_id,))
-    apostes = cursor.fetchall()
-
-    # Actualitzem punts per cada aposta
-    ranquing = []
-    for aposta in apostes:
-        punts_jornada = calcular_punts(
-            aposta["gols_local"],
-            aposta["gols_visitant"],
-            resultat_local,
-            resultat_visitant
-        )
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            # nom_usuari no és únic: n'hi ha prou de saber si n'hi ha més d'un
+            cursor.execute(
+                "SELECT id, nom_usuari FROM participants WHERE nom_usuari = %s AND telegram_id <> %s LIMIT 2",
+                (nom_rival, telegram_id),
+            )
+            rivals = cursor.fetchall()
+            if not rivals:
+                return None
+            if len(rivals) > 1:
+                return {"rival": nom_rival, "ambigu": True}
+            rival = rivals[0]
+
+            cara_a_cara = {"rival": rival["nom_usuari"], "partits": 0, "guanyades": 0, "empatades": 0, "perdudes": 0}
+            for apostes, partits in (("apostes", "partits"), ("apostes_arxiu", "partits_arxiu")):
+                query = f"""
+                    SELECT
+                        COUNT(*) AS partits,
+                        COALESCE(SUM(CASE WHEN a.punts_jornada > b.punts_jornada THEN 1 ELSE 0 END), 0) AS guanyades,
+                        COALESCE(SUM(CASE WHEN a.punts_jornada = b.punts_jornada THEN 1 ELSE 0 END), 0) AS empatades,
+                        COALESCE(SUM(CASE WHEN a.punts_jornada < b.punts_jornada THEN 1 ELSE 0 END), 0) AS perdudes
+                    FROM {apostes} a
+                    INNER JOIN participants p ON p.id = a.participant_id
+                    INNER JOIN {apostes} b ON b.partit_id = a.partit_id AND b.participant_id = %s
+                    INNER JOIN {partits} t ON t.id = a.partit_id
+                    WHERE p.telegram_id = %s AND t.grup_id = %s
+                        AND a.punts_jornada IS NOT NULL AND b.punts_jornada IS NOT NULL
+                """
+                cursor.execute(query, (rival["id"], telegram_id, grup_id))
+                for clau, valor in cursor.fetchone().items():
+                    cara_a_cara[clau] += int(valor)
+            return cara_a_cara
+        finally:
+            cursor.close()
+
+# Temporada en curs de cada grup. Els partits nous hi van a parar i la
+# classificació del grup és la seva. Només canvia amb nova_temporada. Un grup
+# no té cap temporada fins que s'hi crea el primer partit (o /temporada nova):
+# llegir no en crea cap, i a la cache només hi ha els grups que en tenen.
+COMPETICIO_PER_DEFECTE = "General"
+_temporades = {}  # grup_id -> {"id", "nom", "competicio", "inici", "regles"}
+_temporades_lock = threading.Lock()
+
+def _competicio(cursor, nom):
+    cursor.execute("SELECT id FROM competicions WHERE nom = %s", (nom,))
+    fila = cursor.fetchone()
+    if fila is not None:
+        return fila[0]
+    cursor.execute("INSERT INTO competicions (nom) VALUES (%s)", (nom,))
+    return cursor.lastrowid
+
+def _obrir_temporada(cursor, grup_id, competicio, nom):
+    # La temporada es queda les regles de puntuació d'ara, encara que després canviï config.py
+    inici = datetime.now().replace(microsecond=0)
+    regles_temporada = regles.del_grup(grup_id)
+    query = "INSERT INTO temporades (grup_id, competicio_id, nom, inici, regles) VALUES (%s, %s, %s, %s, %s)"
+    cursor.execute(query, (grup_id, _competicio(cursor, competicio), nom, inici, json.dumps(regles_temporada)))
+    return {"id": cursor.lastrowid, "nom": nom, "competicio": competicio, "inici": inici, "regles": regles_temporada}
+
+def _llegir_temporada(grup_id):
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor()
+        try:
+            query = """
+                SELECT t.id, t.nom, c.nom, t.inici, t.regles
+                FROM temporades t
+                INNER JOIN competicions c ON c.id = t.competicio_id
+                WHERE t.grup_id = %s AND t.tancada = 0
+            """
+            cursor.execute(query, (grup_id,))
+            fila = cursor.fetchone()
+            if fila is not None:
+                temporada = dict(zip(("id", "nom", "competicio", "inici"), fila))
+                # Les temporades d'abans de les regles puntuen amb les de config.py
+                temporada["regles"] = regles.completar(json.loads(fila[4])) if fila[4] else regles.del_grup(grup_id)
+                return temporada
+            return None
+        finally:
+            cursor.close()
+
+def temporada_actual(grup_id):
+    """Retorna la temporada en curs del grup: {"id", "nom", "competicio", "inici", "regles"}, o None si no en té cap."""
+    with _temporades_lock:
+        if grup_id not in _temporades:
+            temporada = _llegir_temporada(grup_id)
+            if temporada is None:
+                return None
+            _temporades[grup_id] = temporada
+        return dict(_temporades[grup_id])
+
+def _temporada_per_escriure(grup_id):
+    # Un grup que encara no té cap temporada n'obre una de la competició per defecte
+    with _temporades_lock:
+        if grup_id not in _temporades:
+            temporada = _llegir_temporada(grup_id)
+            if temporada is None:
+                with connexio() as db:
+                    cursor = db.cursor()
+                    try:
+                        temporada = _obrir_temporada(cursor, grup_id, COMPETICIO_PER_DEFECTE, str(datetime.now().year))
+                        db.commit()
+                    finally:
+                        cursor.close()
+            _temporades[grup_id] = temporada
+        return dict(_temporades[grup_id])
+
+def nova_temporada(grup_id, competicio, nom):
+    """Tanca la temporada en curs del grup i n'obre una de nova.
 
-        # Actualitzem punts a `apostes` i `participants`
-        query = "UPDATE apostes SET punts_jornada = %s WHERE id = %s"
-        cursor.execute(query, (punts_jornada, aposta["aposta_id"]))
+    Els partits i les apostes de la temporada tancada passen a partits_arxiu i
+    apostes_arxiu en la mateixa transacció, de manera que les consultes del dia
+    a dia no els tornen a tocar. La seva classificació es queda a punts_temporada.
+    """
+    with _temporades_lock:
+        actual = _temporades.get(grup_id) or _llegir_temporada(grup_id)
+        try:
+            with connexio() as db:
+                cursor = db.cursor()
+                try:
+                    # Un grup sense cap temporada només n'obre una
+                    arxivats = 0
+                    if actual is not None:
+                        query = "SELECT COUNT(*) FROM partits WHERE temporada_id = %s AND resultat IS NULL"
+                        cursor.execute(query, (actual["id"],))
+                        (oberts,) = cursor.fetchone()
+                        if oberts:
+                            return {"estat": 0, "missatge": f"Encara queden partits de la temporada sense resultat ({oberts}). Finalitza'ls o anul·la'ls abans de tancar-la."}
+
+                        query = """
+                            INSERT INTO partits_arxiu (id, grup_id, temporada_id, nom_contrincant, data_hora, juga_a_casa, resultat)
+                            SELECT id, grup_id, temporada_id, nom_contrincant, data_hora, juga_a_casa, resultat
+                            FROM partits WHERE temporada_id = %s
+                        """
+                        cursor.execute(query, (actual["id"],))
+                        arxivats = cursor.rowcount
+                        query = """
+                            INSERT INTO apostes_arxiu (partit_id, participant_id, gols_local, gols_visitant, punts_jornada)
+                            SELECT a.partit_id, a.participant_id, a.gols_local, a.gols_visitant, a.punts_jornada
+                            FROM apostes a
+                            INNER JOIN partits p ON p.id = a.partit_id
+                            WHERE p.temporada_id = %s
+                        """
+                        cursor.execute(query, (actual["id"],))
+                        cursor.execute("DELETE FROM apostes WHERE partit_id IN (SELECT id FROM partits WHERE temporada_id = %s)", (actual["id"],))
+                        cursor.execute("DELETE FROM partits WHERE temporada_id = %s", (actual["id"],))
+
+                        cursor.execute("UPDATE temporades SET tancada = 1, fi = %s WHERE id = %s", (datetime.now().replace(microsecond=0), actual["id"]))
+                    nova = _obrir_temporada(cursor, grup_id, competicio, nom)
+                    db.commit()
+                except ErrorBD:
+                    db.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        except ErrorBD as err:
+            return {"estat": 0, "missatge": f"Error al tancar la temporada: {err}"}
+        _temporades[grup_id] = nova
+
+    invalidar_partits_en_marxa(grup_id)
+    _apostes_canviades(grup_id)
+    carregar_classificacio(grup_id)
+    if actual is None:
+        return {"estat": 1, "missatge": f"Comença la temporada {nom} ({competicio})!"}
+    return {
+        "estat": 1,
+        "missatge": f"S'ha tancat la temporada {actual['nom']} ({arxivats} partits arxivats). Comença la temporada {nom} ({competicio})!",
+    }
+
+def obtenir_temporades(grup_id):
+    """Totes les temporades del grup, de la més nova a la més antiga."""
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor(dictionary=True)
+        query = """
+            SELECT t.id, t.nom, c.nom AS competicio, t.inici, t.fi, t.tancada
+            FROM temporades t
+            INNER JOIN competicions c ON c.id = t.competicio_id
+            WHERE t.grup_id = %s
+            ORDER BY t.inici DESC, t.id DESC
+        """
+        cursor.execute(query, (grup_id,))
+        temporades = cursor.fetchall()
+        cursor.close()
+    return temporades
+
+def obtenir_classificacio_temporada(grup_id, temporada_id, limit):
+    """Les `limit` primeres posicions de la classificació d'una temporada del grup, o None si no n'és."""
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT nom FROM temporades WHERE id = %s AND grup_id = %s", (temporada_id, grup_id))
+            temporada = cursor.fetchone()
+            if temporada is None:
+                return None
+            query = """
+                SELECT p.nom_usuari, t.punts
+                FROM punts_temporada t
+                INNER JOIN participants p ON p.id = t.participant_id
+                WHERE t.temporada_id = %s
+                ORDER BY t.punts DESC, p.nom_usuari
+                LIMIT %s
+            """
+            cursor.execute(query, (temporada_id, limit))
+            return {"temporada": temporada["nom"], "files": cursor.fetchall()}
+        finally:
+            cursor.close()
+
+def exportar_temporada(temporada_id):
+    """Llegeix una temporada tancada de l'arxiu per desar-la fora de la base de dades.
+
+    Retorna {"temporada", "partits", "apostes", "punts"}, o None si la temporada
+    no existeix o no està tancada. Els participants s'identifiquen pel
+    telegram_id, que és el mateix a qualsevol base de dades.
+    """
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            query = """
+                SELECT t.id, t.grup_id, c.nom AS competicio, t.nom, t.inici, t.fi
+                FROM temporades t
+                INNER JOIN competicions c ON c.id = t.competicio_id
+                WHERE t.id = %s AND t.tancada = 1
+            """
+            cursor.execute(query, (temporada_id,))
+            temporada = cursor.fetchone()
+            if temporada is None:
+                return None
+
+            query = """
+                SELECT id, nom_contrincant, data_hora, juga_a_casa, resultat
+                FROM partits_arxiu WHERE temporada_id = %s
+                ORDER BY data_hora, id
+            """
+            cursor.execute(query, (temporada_id,))
+            partits = cursor.fetchall()
+
+            query = """
+                SELECT a.partit_id, p.telegram_id, p.nom_usuari, a.gols_local, a.gols_visitant, a.punts_jornada
+                FROM apostes_arxiu a
+                INNER JOIN partits_arxiu t ON t.id = a.partit_id
+                INNER JOIN participants p ON p.id = a.participant_id
+                WHERE t.temporada_id = %s
+                ORDER BY a.partit_id, p.telegram_id
+            """
+            cursor.execute(query, (temporada_id,))
+            apostes = cursor.fetchall()
+
+            query = """
+                SELECT p.telegram_id, p.nom_usuari, t.punts
+                FROM punts_temporada t
+                INNER JOIN participants p ON p.id = t.participant_id
+                WHERE t.temporada_id = %s
+            """
+            cursor.execute(query, (temporada_id,))
+            punts = cursor.fetchall()
+        finally:
+            cursor.close()
+    return {"temporada": temporada, "partits": partits, "apostes": apostes, "punts": punts}
+
+def esborrar_arxiu_temporada(temporada_id):
+    """Esborra els partits i les apostes arxivats d'una temporada tancada i retorna quants partits eren.
+
+    La temporada i la seva classificació final es conserven.
+    """
+    with connexio() as db:
+        cursor = db.cursor()
+        try:
+            cursor.execute("SELECT tancada FROM temporades WHERE id = %s", (temporada_id,))
+            fila = cursor.fetchone()
+            if fila is None or not fila[0]:
+                return 0
+            cursor.execute("DELETE FROM apostes_arxiu WHERE partit_id IN (SELECT id FROM partits_arxiu WHERE temporada_id = %s)", (temporada_id,))
+            cursor.execute("DELETE FROM partits_arxiu WHERE temporada_id = %s", (temporada_id,))
+            esborrats = cursor.rowcount
+            db.commit()
+        except ErrorBD:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+    return esborrats
+
+def importar_temporada(dades):
+    """Torna a posar a l'arxiu una temporada exportada amb exportar_temporada.
+
+    Si la temporada ja no existeix (per exemple, en una base de dades nova) es
+    crea tancada, amb la seva classificació. Els partits han de conservar el
+    seu id: si algun ja existeix, no s'importa res.
+    """
+    temporada = dades["temporada"]
+    try:
+        with connexio() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute("SELECT grup_id, nom, tancada FROM temporades WHERE id = %s", (temporada["id"],))
+                fila = cursor.fetchone()
+                if fila is not None and tuple(fila) != (temporada["grup_id"], temporada["nom"], 1):
+                    return {"estat": 0, "missatge": f"La temporada {temporada['id']} de la base de dades no és la del fitxer."}
+
+                ids = [partit["id"] for partit in dades["partits"]]
+                for inici in range(0, len(ids), 500):
+                    tros = tuple(ids[inici:inici + 500])
+                    marcadors = ", ".join(["%s"] * len(tros))
+                    cursor.execute(
+                        f"SELECT id FROM partits WHERE id IN ({marcadors}) UNION SELECT id FROM partits_arxiu WHERE id IN ({marcadors})",
+                        tros + tros,
+                    )
+                    repetits = cursor.fetchall()
+                    if repetits:
+                        return {"estat": 0, "missatge": f"El partit {repetits[0][0]} ja és a la base de dades."}
+
+                if fila is None:
+                    query = """
+                        INSERT INTO temporades (id, grup_id, competicio_id, nom, inici, fi, tancada)
+                        VALUES (%s, %s, %s, %s, %s, %s, 1)
+                    """
+                    cursor.execute(query, (
+                        temporada["id"], temporada["grup_id"], _competicio(cursor, temporada["competicio"]),
+                        temporada["nom"], temporada["inici"], temporada["fi"],
+                    ))
+
+                noms = {fila["telegram_id"]: fila["nom_usuari"] for fila in dades["apostes"] + dades["punts"]}
+                inserits = _inserir_participants(cursor, noms) if noms else {}
+                participants = {telegram_id: participant_id for telegram_id, (participant_id, _) in inserits.items()}
+
+                query = """
+                    INSERT INTO partits_arxiu (id, grup_id, temporada_id, nom_contrincant, data_hora, juga_a_casa, resultat)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """
+                cursor.executemany(query, [
+                    (partit["id"], temporada["grup_id"], temporada["id"], partit["nom_contrincant"],
+                     partit["data_hora"], partit["juga_a_casa"], partit["resultat"])
+                    for partit in dades["partits"]
+                ])
+                query = """
+                    INSERT INTO apostes_arxiu (partit_id, participant_id, gols_local, gols_visitant, punts_jornada)
+                    VALUES (%s, %s, %s, %s, %s)
+                """
+                cursor.executemany(query, [
+                    (aposta["partit_id"], participants[aposta["telegram_id"]], aposta["gols_local"],
+                     aposta["gols_visitant"], aposta["punts_jornada"])
+                    for aposta in dades["apostes"]
+                ])
+                # Si la temporada ja hi era, la seva classificació també
+                if fila is None and dades["punts"]:
+                    cursor.executemany(
+                        "INSERT INTO punts_temporada (temporada_id, participant_id, punts) VALUES (%s, %s, %s)",
+                        [(temporada["id"], participants[punts["telegram_id"]], punts["punts"]) for punts in dades["punts"]],
+                    )
+                db.commit()
+            except ErrorBD:
+                db.rollback()
+                raise
+            finally:
+                cursor.close()
+    except ErrorBD as err:
+        return {"estat": 0, "missatge": f"Error al importar la temporada: {err}"}
+
+    return {
+        "estat": 1,
+        "missatge": f"S'han importat {len(dades['partits'])} partits i {len(dades['apostes'])} apostes de la temporada {temporada['nom']}.",
+    }
+
+def carregar_classificacio(grup_id):
+    """Llegeix els punts de la temporada en curs del grup i reconstrueix la seva classificació en memòria.
+
+    Si el grup encara no té cap temporada no hi ha res a carregar.
+    """
+    temporada = temporada_actual(grup_id)
+    if temporada is None:
+        return
+    temporada_id = temporada["id"]
+    with connexio(escriptura=False) as db:
+        cursor = db.cursor(dictionary=True)
+        query = """
+            SELECT p.id, p.nom_usuari, p.telegram_id, t.punts
+            FROM punts_temporada t
+            INNER JOIN participants p ON t.participant_id = p.id
+            WHERE t.temporada_id = %s
+        """
+        cursor.execute(query, (temporada_id,))
+        ranquing.carregar(grup_id, cursor.fetchall())
+        cursor.close()
 
-        query = "UPDATE participants SET punts = punts + %s WHERE id = %s"
-        cursor.execute(query, (punts_jornada, aposta["participant_id"]))
+def obtenir_pagina_classificacio(grup_id, pagina, mida):
+    """Retorna una pàgina (començant per 1) de la classificació del grup i la versió d'aquesta."""
+    temporada = temporada_actual(grup_id)
+    if temporada is None:
+        return {"versio": None, "temporada": None, "total": 0, "files": []}
+    if not ranquing.carregat(grup_id):
+        carregar_classificacio(grup_id)
 
-        # Afegim al rànquing
-        ranquing.append((aposta["nom_usuari"], aposta["gols_local"], aposta["gols_visitant"], punts_jornada))
+    return {
+        "versio": ranquing.versio(grup_id),
+        "temporada": temporada["nom"],
+        "total": ranquing.total(grup_id),
+        "files": ranquing.pagina(grup_id, (pagina - 1) * mida, mida),
+    }
 
-    db.commit()
-    cursor.close()
-    db.close()
+def obtenir_posicio_classificacio(grup_id, telegram_id):
+    if not ranquing.carregat(grup_id):
+        carregar_classificacio(grup_id)
 
-    # Retornem el rànquing ordenat
-    ranquing_ordenat = sorted(ranquing, key=lambda x: x[3], reverse=True)
-    return ranquing_ordenat
+    return ranquing.posicio(grup_id, telegram_id)
 
-def obtenir_classificacio():
-    db = mysql.connector.connect(**DB_CONFIG)
-    cursor = db.cursor(dictionary=True)
+def versio_classificacio(grup_id):
+    return ranquing.versio(grup_id)
 
-    # Obtenim la classificació ordenada
-    query = "SELECT nom_usuari, punts FROM participants ORDER BY punts DESC, nom_usuari ASC"
-    cursor.execute(query)
-    classificacio = cursor.fetchall()
+metriques.calculada(
+    "porra_cache_participants",
+    "Cache de participants: encerts, errades i entrades",
+    lambda: {
+        (("valor", clau),): valor
+        for clau, valor in estadistiques_participants().items()
+        if clau in ("encerts", "errades", "mida")
+    },
+)
+metriques.calculada(
+    "porra_apostes_pendents",
+    "Apostes diferides encara no escrites a la base de dades",
+    lambda: {(): len(_apostes_pendents) if _apostes_pendents is not None else 0},
+)
 
-    cursor.close()
-    db.close()
-    return classificacio
+# Totes les funcions públiques del mòdul queden mesurades (metriques.instrumentar_bd),
+# llevat de les que només retornen un valor que ja és a memòria.
+NO_INSTRUMENTAR = {
+    "motor", "connexio", "versio_apostes", "versio_classificacio", "apostes_diferides", "estadistiques_participants",
+}
+for _nom, _funcio in list(globals().items()):
+    if (
+        inspect.isfunction(_funcio)
+        and _funcio.__module__ == __name__
+        and not _nom.startswith("_")
+        and _nom not in NO_INSTRUMENTAR
+        and not inspect.iscoroutinefunction(_funcio)
+    ):
+        globals()[_nom] = metriques.instrumentar_bd(_funcio)
@@ -0,0 +1,60 @@
+"""Diaris: fitxers on només s'afegeixen línies JSON, una per canvi.
+
+El fan servir apostes_pendents.py (apostes diferides) i persistencia.py
+(estat de les converses). Cada línia s'escriu sencera i es buida al disc de
+seguida; si el bot cau a mitja línia, en rellegir-lo aquesta línia se salta.
+Per no créixer sense límit, el diari es reescriu amb només l'estat vigent en
+un fitxer temporal que substitueix l'original (os.replace), de manera que
+en cap moment hi ha un diari a mig escriure.
+"""
+import json
+import os
+
+class Diari:
+    def __init__(self, cami, sincronitzar=True):
+        self.cami = cami
+        self.sincronitzar = sincronitzar
+        self._fitxer = None
+
+    def llegir(self):
+        """Retorna les línies del diari, ja descodificades, en l'ordre en què es van apuntar."""
+        if not os.path.exists(self.cami):
+            return
+        with open(self.cami, encoding="utf-8") as fitxer:
+            for linia in fitxer:
+                try:
+                    yield json.loads(linia)
+                except ValueError:
+                    # L'última línia pot haver quedat a mitges si el bot va caure escrivint-la
+                    continue
+
+    def obrir(self):
+        """Obre el diari per afegir-hi línies."""
+        if self._fitxer is None:
+            self._fitxer = open(self.cami, "a", encoding="utf-8")
+
+    def apuntar(self, canvi):
+        """Afegeix una línia al diari. No fa res si el diari no és obert."""
+        if self._fitxer is None:
+            return
+        self._fitxer.write(json.dumps(canvi, ensure_ascii=False) + "\n")
+        self._fitxer.flush()
+        if self.sincronitzar:
+            os.fsync(self._fitxer.fileno())
+
+    def reescriure(self, canvis):
+        """Substitueix el contingut del diari per aquestes línies i el deixa obert."""
+        temporal = self.cami + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as fitxer:
+            for canvi in canvis:
+                fitxer.write(json.dumps(canvi, ensure_ascii=False) + "\n")
+            fitxer.flush()
+            os.fsync(fitxer.fileno())
+        self.tancar()
+        os.replace(temporal, self.cami)
+        self.obrir()
+
+    def tancar(self):
+        if self._fitxer is not None:
+            self._fitxer.close()
+            self._fitxer = None
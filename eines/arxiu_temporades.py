@@ -0,0 +1,120 @@
+"""Exporta i importa temporades arxivades en fitxers JSONL comprimits amb gzip.
+
+Quan es tanca una temporada ('/temporada nova ...'), els seus partits i
+apostes passen a les taules d'arxiu. Per fer més petites la base de dades i
+les còpies de seguretat, una temporada arxivada es pot exportar a un fitxer i
+esborrar de l'arxiu (la temporada i la seva classificació final es queden).
+Si cal, es torna a importar amb el mateix fitxer.
+
+La primera línia del fitxer és la temporada; després hi ha una línia per
+partit, per aposta i per participant de la classificació, cadascuna amb el
+seu "tipus".
+
+    python eines/arxiu_temporades.py llista -1001234567890
+    python eines/arxiu_temporades.py exportar 3 temporada-3.jsonl.gz --esborrar
+    python eines/arxiu_temporades.py importar temporada-3.jsonl.gz
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import database
+from migracions import aplicar_migracions
+
+# Columnes de data de cada tipus de registre
+DATES = {"temporada": ("inici", "fi"), "partit": ("data_hora",)}
+
+def escriure(fitxer, tipus, registre):
+    registre = {"tipus": tipus, **registre}
+    for columna in DATES.get(tipus, ()):
+        if registre[columna] is not None:
+            registre[columna] = registre[columna].isoformat(" ")
+    fitxer.write(json.dumps(registre, ensure_ascii=False) + "\n")
+
+def llegir(fitxer):
+    dades = {"temporada": None, "partits": [], "apostes": [], "punts": []}
+    for linia in fitxer:
+        if not linia.strip():
+            continue
+        registre = json.loads(linia)
+        tipus = registre.pop("tipus")
+        for columna in DATES.get(tipus, ()):
+            if registre[columna] is not None:
+                registre[columna] = datetime.fromisoformat(registre[columna])
+        if tipus == "temporada":
+            dades["temporada"] = registre
+        else:
+            dades[{"partit": "partits", "aposta": "apostes", "punts": "punts"}[tipus]].append(registre)
+    if dades["temporada"] is None:
+        raise ValueError("El fitxer no conté cap temporada.")
+    return dades
+
+def llista(args):
+    for temporada in database.obtenir_temporades(args.grup):
+        estat = f"tancada el {temporada['fi']:%d-%m-%Y}" if temporada["tancada"] else "en curs"
+        print(f"{temporada['id']}: {temporada['nom']} ({temporada['competicio']}), des del {temporada['inici']:%d-%m-%Y}, {estat}")
+
+def exportar(args):
+    dades = database.exportar_temporada(args.temporada)
+    if dades is None:
+        sys.exit(f"No hi ha cap temporada tancada amb el número {args.temporada}.")
+
+    with gzip.open(args.fitxer, "wt", encoding="utf-8") as fitxer:
+        escriure(fitxer, "temporada", dades["temporada"])
+        for partit in dades["partits"]:
+            escriure(fitxer, "partit", partit)
+        for aposta in dades["apostes"]:
+            escriure(fitxer, "aposta", aposta)
+        for punts in dades["punts"]:
+            escriure(fitxer, "punts", punts)
+    print(f"{args.fitxer}: {len(dades['partits'])} partits i {len(dades['apostes'])} apostes.")
+
+    if args.esborrar:
+        # Abans d'esborrar res, comprovem que el fitxer es pot tornar a llegir sencer
+        with gzip.open(args.fitxer, "rt", encoding="utf-8") as fitxer:
+            comprovacio = llegir(fitxer)
+        if (len(comprovacio["partits"]), len(comprovacio["apostes"])) != (len(dades["partits"]), len(dades["apostes"])):
+            sys.exit("El fitxer exportat no coincideix amb l'arxiu: no s'ha esborrat res.")
+        print(f"S'han esborrat de l'arxiu {database.esborrar_arxiu_temporada(args.temporada)} partits.")
+
+def importar(args):
+    with gzip.open(args.fitxer, "rt", encoding="utf-8") as fitxer:
+        dades = llegir(fitxer)
+    resultat = database.importar_temporada(dades)
+    if resultat["estat"] == 0:
+        sys.exit(resultat["missatge"])
+    print(resultat["missatge"])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ordres = parser.add_subparsers(dest="ordre", required=True)
+
+    ordre = ordres.add_parser("llista", help="Temporades d'un grup")
+    ordre.add_argument("grup", type=int, help="Id del grup de Telegram")
+    ordre.set_defaults(funcio=llista)
+
+    ordre = ordres.add_parser("exportar", help="Desa una temporada tancada en un fitxer .jsonl.gz")
+    ordre.add_argument("temporada", type=int, help="Número de la temporada")
+    ordre.add_argument("fitxer", help="Fitxer de sortida")
+    ordre.add_argument("--esborrar", action="store_true", help="Esborra els partits i les apostes de l'arxiu un cop exportats")
+    ordre.set_defaults(funcio=exportar)
+
+    ordre = ordres.add_parser("importar", help="Torna a posar a l'arxiu una temporada exportada")
+    ordre.add_argument("fitxer", help="Fitxer .jsonl.gz exportat")
+    ordre.set_defaults(funcio=importar)
+
+    args = parser.parse_args()
+    database.inicialitzar_bd()
+    try:
+        aplicar_migracions()
+        args.funcio(args)
+    finally:
+        database.tancar_bd()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Envia actualitzacions de Telegram desades a l'endpoint del webhook local.
+
+Serveix per provar el mode webhook sense Telegram: cada línia del fitxer és
+una actualització en JSON, tal com l'envia Telegram (per exemple, copiada de
+la resposta de getUpdates). Les peticions porten el secret_token de
+config.WEBHOOK, així que el bot les accepta com si vinguessin de Telegram.
+
+    python eines/reproduir_updates.py actualitzacions.jsonl
+    python eines/reproduir_updates.py actualitzacions.jsonl --interval 0.2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from config import WEBHOOK
+
+def enviar(url, actualitzacio, secret_token):
+    peticio = urllib.request.Request(
+        url,
+        data=json.dumps(actualitzacio).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    if secret_token:
+        peticio.add_header("X-Telegram-Bot-Api-Secret-Token", secret_token)
+    try:
+        with urllib.request.urlopen(peticio, timeout=10) as resposta:
+            return resposta.status
+    except urllib.error.HTTPError as err:
+        return err.code
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fitxer", help="Fitxer JSONL amb una actualització per línia")
+    parser.add_argument(
+        "--url",
+        default=f"http://{WEBHOOK['escoltar']}:{WEBHOOK['port']}/{WEBHOOK['ruta']}",
+        help="Endpoint del webhook (per defecte, el de config.WEBHOOK)",
+    )
+    parser.add_argument("--interval", type=float, default=0.0, help="Segons d'espera entre actualitzacions")
+    args = parser.parse_args()
+
+    with open(args.fitxer, encoding="utf-8") as fitxer:
+        actualitzacions = [json.loads(linia) for linia in fitxer if linia.strip()]
+
+    inici = time.perf_counter()
+    errors = 0
+    for actualitzacio in actualitzacions:
+        estat = enviar(args.url, actualitzacio, WEBHOOK["secret_token"])
+        if estat != 200:
+            errors += 1
+            print(f"Actualització {actualitzacio.get('update_id')}: HTTP {estat}")
+        if args.interval:
+            time.sleep(args.interval)
+
+    durada = time.perf_counter() - inici
+    print(f"{len(actualitzacions)} actualitzacions enviades en {durada:.2f} s ({errors} errors).")
+
+if __name__ == "__main__":
+    main()
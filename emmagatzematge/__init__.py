@@ -0,0 +1,20 @@
+"""Motors d'emmagatzematge de la porra.
+
+database.py parla amb la base de dades a través d'un objecte Emmagatzematge,
+que dona connexions i les poques sentències que no són iguals a tots els
+motors. El motor es tria amb BD_BACKEND a config.py.
+"""
+import importlib
+
+MOTORS = {
+    "mysql": "emmagatzematge.mysql:EmmagatzematgeMySQL",
+    "sqlite": "emmagatzematge.sqlite:EmmagatzematgeSQLite",
+}
+
+def classe(nom):
+    """Importa i retorna la classe del motor `nom` (només s'importa el driver triat)."""
+    try:
+        modul, nom_classe = MOTORS[nom].split(":")
+    except KeyError:
+        raise ValueError(f"Motor de base de dades desconegut: {nom!r}. Opcions: {', '.join(MOTORS)}.")
+    return getattr(importlib.import_module(modul), nom_classe)
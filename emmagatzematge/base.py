@@ -0,0 +1,58 @@
+from contextlib import contextmanager
+
+class Emmagatzematge:
+    """Interfície comuna dels motors de base de dades.
+
+    Les sentències de database.py fan servir `%s` com a marcador de paràmetres
+    i els cursors poden retornar diccionaris amb `cursor(dictionary=True)`, com
+    a mysql.connector. Cada motor adapta la resta: connexions, upserts, UPDATE
+    amb JOIN i DDL de les migracions.
+    """
+
+    nom = None
+
+    # Excepció base del driver
+    Error = Exception
+
+    # INSERT o UPDATE d'una aposta. Paràmetres: (partit_id, participant_id, gols_local, gols_visitant)
+    SQL_UPSERT_APOSTA = None
+
+    # Crea el participant si encara no existeix (per a executemany). Paràmetres: (nom_usuari, telegram_id)
+    SQL_INSERIR_PARTICIPANT = None
+
+    # Punts de la jornada de totes les apostes d'un partit. Rep l'expressió de punts
+    # (amb les columnes de l'aposta com a a.gols_local / a.gols_visitant) i el partit_id
+    SQL_PUNTS_JORNADA = None
+
+    # Suma els punts de la jornada de cada aposta del partit a la classificació de la
+    # temporada (punts_temporada), i hi crea la fila del participant si encara no en
+    # tenia. Paràmetres: (partit_id)
+    SQL_SUMAR_PUNTS_TEMPORADA = None
+
+    # Suma el partit a les estadístiques acumulades de cada participant que hi ha apostat
+    # (partits, exactes, punts, partits a casa, ratxa i millor jornada).
+    # Paràmetres: (grup_id, resultat_local, resultat_visitant, partit_id)
+    SQL_SUMAR_ESTADISTIQUES = None
+
+    def __init__(self, config):
+        self.config = config
+
+    @contextmanager
+    def connexio(self, escriptura=True):
+        """Dona una connexió amb cursor(), commit() i rollback().
+
+        `escriptura=False` indica que el bloc només llegeix, cosa que permet al
+        motor fer-lo servir en paral·lel amb una escriptura.
+        """
+        raise NotImplementedError
+
+    def upsert_participant(self, cursor, nom_usuari, telegram_id):
+        """Crea el participant si no existeix (o n'actualitza el nom) i retorna el seu id."""
+        raise NotImplementedError
+
+    def error_ja_aplicada(self, err):
+        """Indica si l'error d'una migració vol dir que ja s'havia aplicat."""
+        return False
+
+    def tancar(self):
+        pass
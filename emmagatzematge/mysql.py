@@ -0,0 +1,185 @@
+import mysql.connector
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from emmagatzematge.base import Emmagatzematge
+
+class PoolConnexions:
+    """Pool de connexions MySQL reutilitzables.
+
+    Les connexions es creen a demanda fins a `mida` i es tornen al pool en
+    acabar. Si una connexió ha estat inactiva més de `max_inactiva` segons
+    (o sempre, amb `comprovar_sempre`) es fa un ping abans de donar-la, i es
+    reconnecta si el servidor l'havia tancat.
+    """
+
+    def __init__(self, config, mida=5, max_inactiva=300, comprovar_sempre=False, espera=10):
+        self.config = config
+        self.mida = mida
+        self.max_inactiva = max_inactiva
+        self.comprovar_sempre = comprovar_sempre
+        self.espera = espera
+        self._lliures = queue.LifoQueue()
+        self._obertes = 0
+        self._lock = threading.Lock()
+
+    def agafar(self):
+        try:
+            cnx, darrer_us = self._lliures.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                crear = self._obertes < self.mida
+                if crear:
+                    self._obertes += 1
+            if crear:
+                try:
+                    return mysql.connector.connect(**self.config)
+                except mysql.connector.Error:
+                    self._oblidar()
+                    raise
+            try:
+                cnx, darrer_us = self._lliures.get(timeout=self.espera)
+            except queue.Empty:
+                raise mysql.connector.errors.PoolError(
+                    f"No hi ha cap connexió lliure al pool després de {self.espera} segons."
+                )
+
+        # Comprovació de salut: reconnecta les connexions caducades
+        if self.comprovar_sempre or time.monotonic() - darrer_us > self.max_inactiva:
+            try:
+                cnx.ping(reconnect=True, attempts=3, delay=1)
+            except mysql.connector.Error:
+                self.descartar(cnx)
+                raise
+        return cnx
+
+    def retornar(self, cnx):
+        if cnx.in_transaction:
+            cnx.rollback()
+        self._lliures.put((cnx, time.monotonic()))
+
+    def descartar(self, cnx):
+        try:
+            cnx.close()
+        except mysql.connector.Error:
+            pass
+        self._oblidar()
+
+    def tancar(self):
+        while True:
+            try:
+                cnx, _ = self._lliures.get_nowait()
+            except queue.Empty:
+                break
+            self.descartar(cnx)
+
+    def _oblidar(self):
+        with self._lock:
+            self._obertes -= 1
+
+class EmmagatzematgeMySQL(Emmagatzematge):
+    """Servidor MySQL/MariaDB accedit amb mysql.connector i un pool de connexions."""
+
+    nom = "mysql"
+    Error = mysql.connector.Error
+
+    # Depèn de la clau única apostes(partit_id, participant_id)
+    SQL_UPSERT_APOSTA = """
+        INSERT INTO apostes (partit_id, participant_id, gols_local, gols_visitant)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE gols_local = VALUES(gols_local), gols_visitant = VALUES(gols_visitant)
+    """
+
+    SQL_INSERIR_PARTICIPANT = """
+        INSERT INTO participants (nom_usuari, telegram_id) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE id = id
+    """
+
+    SQL_PUNTS_JORNADA = "UPDATE apostes a SET a.punts_jornada = {punts} WHERE a.partit_id = %s"
+
+    SQL_SUMAR_PUNTS_TEMPORADA = """
+        INSERT INTO punts_temporada (temporada_id, participant_id, punts)
+        SELECT p.temporada_id, a.participant_id, a.punts_jornada
+        FROM apostes a
+        INNER JOIN partits p ON p.id = a.partit_id
+        WHERE a.partit_id = %s
+        ON DUPLICATE KEY UPDATE punts = punts + VALUES(punts)
+    """
+
+    # A ON DUPLICATE KEY UPDATE cada assignació ja veu les anteriors: les que
+    # depenen del valor antic d'una columna han d'anar abans que la que la canvia.
+    # Les columnes de la subconsulta j no es poden dir com les d'estadistiques: a
+    # l'UPDATE, un nom que hi fos a totes dues seria ambigu (error 1052)
+    SQL_SUMAR_ESTADISTIQUES = """
+        INSERT INTO estadistiques (
+            grup_id, participant_id, partits, exactes, punts, partits_casa, exactes_casa, punts_casa,
+            ratxa_actual, ratxa_maxima, millor_jornada, millor_partit_id
+        )
+        SELECT %s, j.participant_id, 1, j.exacte_partit, j.punts_partit, j.casa_partit,
+               j.exacte_partit * j.casa_partit, j.punts_partit * j.casa_partit,
+               CASE WHEN j.punts_partit > 0 THEN 1 ELSE 0 END, CASE WHEN j.punts_partit > 0 THEN 1 ELSE 0 END,
+               j.punts_partit, j.partit_id
+        FROM (
+            SELECT a.participant_id, a.partit_id, a.punts_jornada AS punts_partit, p.juga_a_casa AS casa_partit,
+                   CASE WHEN a.gols_local = %s AND a.gols_visitant = %s THEN 1 ELSE 0 END AS exacte_partit
+            FROM apostes a
+            INNER JOIN partits p ON p.id = a.partit_id
+            WHERE a.partit_id = %s
+        ) j
+        ON DUPLICATE KEY UPDATE
+            ratxa_maxima = GREATEST(ratxa_maxima, CASE WHEN VALUES(punts) > 0 THEN ratxa_actual + 1 ELSE 0 END),
+            ratxa_actual = CASE WHEN VALUES(punts) > 0 THEN ratxa_actual + 1 ELSE 0 END,
+            millor_partit_id = CASE WHEN VALUES(punts) > millor_jornada THEN VALUES(millor_partit_id) ELSE millor_partit_id END,
+            millor_jornada = GREATEST(millor_jornada, VALUES(millor_jornada)),
+            partits = partits + 1,
+            exactes = exactes + VALUES(exactes),
+            punts = punts + VALUES(punts),
+            partits_casa = partits_casa + VALUES(partits_casa),
+            exactes_casa = exactes_casa + VALUES(exactes_casa),
+            punts_casa = punts_casa + VALUES(punts_casa)
+    """
+
+    # Errors de MySQL que indiquen que una sentència de migració ja s'havia aplicat
+    JA_APLICADA = {
+        1060,  # ER_DUP_FIELDNAME: la columna ja existeix
+        1061,  # ER_DUP_KEYNAME: l'índex ja existeix
+        1091,  # ER_CANT_DROP_FIELD_OR_KEY: l'índex ja s'havia esborrat
+        1826,  # ER_FK_DUP_NAME: la clau forana ja existeix
+    }
+
+    def __init__(self, config, pool):
+        super().__init__(config)
+        self.pool = PoolConnexions(config, **pool)
+        # Obrim una primera connexió per fallar ràpid si la configuració és incorrecta
+        self.pool.retornar(self.pool.agafar())
+
+    @contextmanager
+    def connexio(self, escriptura=True):
+        db = self.pool.agafar()
+        try:
+            yield db
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            # La connexió pot haver quedat inservible: no la tornem al pool
+            self.pool.descartar(db)
+            db = None
+            raise
+        finally:
+            if db is not None:
+                self.pool.retornar(db)
+
+    def upsert_participant(self, cursor, nom_usuari, telegram_id):
+        # LAST_INSERT_ID(id) fa que el servidor recordi l'id del participant
+        # tant si l'acabem d'inserir com si ja existia. De passada s'actualitza el nom.
+        query = """
+            INSERT INTO participants (nom_usuari, telegram_id) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), nom_usuari = VALUES(nom_usuari)
+        """
+        cursor.execute(query, (nom_usuari, telegram_id))
+        return cursor.lastrowid
+
+    def error_ja_aplicada(self, err):
+        return err.errno in self.JA_APLICADA
+
+    def tancar(self):
+        self.pool.tancar()
@@ -0,0 +1,209 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from emmagatzematge.base import Emmagatzematge
+
+# Les dates es desen com a text ISO i es llegeixen com a datetime a les
+# columnes declarades TIMESTAMP, igual que els DATETIME de MySQL.
+sqlite3.register_adapter(datetime, lambda valor: valor.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda valor: datetime.fromisoformat(valor.decode()))
+
+@lru_cache(maxsize=256)
+def _traduir(query):
+    # database.py escriu les sentències amb el marcador de mysql.connector
+    return query.replace("%s", "?")
+
+class CursorSQLite:
+    """Cursor de sqlite3 amb la interfície de mysql.connector que fa servir database.py."""
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    def execute(self, query, params=()):
+        self._cursor.execute(_traduir(query), params)
+
+    def executemany(self, query, params):
+        self._cursor.executemany(_traduir(query), params)
+
+    def _fila(self, fila):
+        if fila is None or not self._dictionary:
+            return fila
+        return dict(zip((columna[0] for columna in self._cursor.description), fila))
+
+    def fetchone(self):
+        return self._fila(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._fila(fila) for fila in self._cursor.fetchall()]
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+class ConnexioSQLite:
+    def __init__(self, cnx):
+        self._cnx = cnx
+
+    def cursor(self, dictionary=False):
+        return CursorSQLite(self._cnx.cursor(), dictionary)
+
+    def commit(self):
+        self._cnx.commit()
+
+    def rollback(self):
+        self._cnx.rollback()
+
+    @property
+    def in_transaction(self):
+        return self._cnx.in_transaction
+
+class EmmagatzematgeSQLite(Emmagatzematge):
+    """Base de dades SQLite en un fitxer local, sense cap servidor.
+
+    Fa servir el mode WAL: hi ha una sola connexió d'escriptura, protegida amb
+    un lock perquè cada transacció s'executi sencera, i una connexió de
+    lectura per fil que pot llegir mentre s'escriu. sqlite3 manté a cada
+    connexió una cache de sentències ja preparades (`cached_statements`).
+    """
+
+    nom = "sqlite"
+    Error = sqlite3.Error
+
+    SQL_UPSERT_APOSTA = """
+        INSERT INTO apostes (partit_id, participant_id, gols_local, gols_visitant)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (partit_id, participant_id)
+        DO UPDATE SET gols_local = excluded.gols_local, gols_visitant = excluded.gols_visitant
+    """
+
+    SQL_INSERIR_PARTICIPANT = """
+        INSERT INTO participants (nom_usuari, telegram_id) VALUES (%s, %s)
+        ON CONFLICT (telegram_id) DO NOTHING
+    """
+
+    SQL_PUNTS_JORNADA = "UPDATE apostes AS a SET punts_jornada = {punts} WHERE a.partit_id = %s"
+
+    SQL_SUMAR_PUNTS_TEMPORADA = """
+        INSERT INTO punts_temporada (temporada_id, participant_id, punts)
+        SELECT p.temporada_id, a.participant_id, a.punts_jornada
+        FROM apostes AS a
+        INNER JOIN partits AS p ON p.id = a.partit_id
+        WHERE a.partit_id = %s
+        ON CONFLICT (temporada_id, participant_id) DO UPDATE SET punts = punts + excluded.punts
+    """
+
+    # A DO UPDATE totes les columnes sense excluded. tenen el valor d'abans.
+    # El WHERE true evita que SQLite llegeixi l'ON CONFLICT com part del FROM.
+    SQL_SUMAR_ESTADISTIQUES = """
+        INSERT INTO estadistiques (
+            grup_id, participant_id, partits, exactes, punts, partits_casa, exactes_casa, punts_casa,
+            ratxa_actual, ratxa_maxima, millor_jornada, millor_partit_id
+        )
+        SELECT %s, j.participant_id, 1, j.exacte_partit, j.punts_partit, j.casa_partit,
+               j.exacte_partit * j.casa_partit, j.punts_partit * j.casa_partit,
+               CASE WHEN j.punts_partit > 0 THEN 1 ELSE 0 END, CASE WHEN j.punts_partit > 0 THEN 1 ELSE 0 END,
+               j.punts_partit, j.partit_id
+        FROM (
+            SELECT a.participant_id, a.partit_id, a.punts_jornada AS punts_partit, p.juga_a_casa AS casa_partit,
+                   CASE WHEN a.gols_local = %s AND a.gols_visitant = %s THEN 1 ELSE 0 END AS exacte_partit
+            FROM apostes AS a
+            INNER JOIN partits AS p ON p.id = a.partit_id
+            WHERE a.partit_id = %s
+        ) AS j
+        WHERE true
+        ON CONFLICT (grup_id, participant_id) DO UPDATE SET
+            ratxa_maxima = MAX(ratxa_maxima, CASE WHEN excluded.punts > 0 THEN ratxa_actual + 1 ELSE 0 END),
+            ratxa_actual = CASE WHEN excluded.punts > 0 THEN ratxa_actual + 1 ELSE 0 END,
+            millor_partit_id = CASE WHEN excluded.punts > millor_jornada THEN excluded.millor_partit_id ELSE millor_partit_id END,
+            millor_jornada = MAX(millor_jornada, excluded.millor_jornada),
+            partits = partits + 1,
+            exactes = exactes + excluded.exactes,
+            punts = punts + excluded.punts,
+            partits_casa = partits_casa + excluded.partits_casa,
+            exactes_casa = exactes_casa + excluded.exactes_casa,
+            punts_casa = punts_casa + excluded.punts_casa
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.fitxer = config.get("fitxer", "porra.db")
+        self.espera = config.get("espera", 10)
+        self._escriptor = self._obrir()
+        self._escriptor.execute("PRAGMA journal_mode = WAL")
+        self._escriptor.execute("PRAGMA synchronous = NORMAL")
+        self._lock_escriptura = threading.RLock()
+        self._nivell = 0
+        self._lectors = threading.local()
+        self._obertes = [self._escriptor]
+
+    def _obrir(self):
+        cnx = sqlite3.connect(
+            self.fitxer,
+            timeout=self.espera,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        cnx.execute("PRAGMA foreign_keys = ON")
+        return cnx
+
+    def _lector(self):
+        # Una base de dades en memòria només existeix dins la seva connexió
+        if self.fitxer == ":memory:":
+            return None
+        cnx = getattr(self._lectors, "cnx", None)
+        if cnx is None:
+            cnx = self._lectors.cnx = self._obrir()
+            self._obertes.append(cnx)
+        return cnx
+
+    @contextmanager
+    def connexio(self, escriptura=True):
+        lector = None if escriptura else self._lector()
+        if lector is not None:
+            db = ConnexioSQLite(lector)
+            try:
+                yield db
+            finally:
+                if db.in_transaction:
+                    db.rollback()
+            return
+
+        with self._lock_escriptura:
+            # El lock és reentrant: un bloc niat comparteix la transacció del de fora
+            self._nivell += 1
+            db = ConnexioSQLite(self._escriptor)
+            try:
+                yield db
+            finally:
+                self._nivell -= 1
+                if self._nivell == 0 and db.in_transaction:
+                    db.rollback()
+
+    def upsert_participant(self, cursor, nom_usuari, telegram_id):
+        query = """
+            INSERT INTO participants (nom_usuari, telegram_id) VALUES (%s, %s)
+            ON CONFLICT (telegram_id) DO UPDATE SET nom_usuari = excluded.nom_usuari
+            RETURNING id
+        """
+        cursor.execute(query, (nom_usuari, telegram_id))
+        (participant_id,) = cursor.fetchone()
+        return participant_id
+
+    def error_ja_aplicada(self, err):
+        return "duplicate column name" in str(err)
+
+    def tancar(self):
+        for cnx in self._obertes:
+            cnx.close()
+        self._obertes.clear()
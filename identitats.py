@@ -0,0 +1,47 @@
+"""Cache de la identitat dels participants: telegram_id -> (participant_id, nom_usuari).
+
+Els participants gairebé no canvien, però cada aposta necessita el seu id. La
+cache guarda els `mida` participants usats més recentment (LRU) i compta els
+encerts i les errades perquè es pugui veure si la mida és suficient.
+"""
+import threading
+from collections import OrderedDict
+
+class CacheParticipants:
+    def __init__(self, mida):
+        self.mida = mida
+        self.encerts = 0
+        self.errades = 0
+        self._entrades = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entrades)
+
+    def obtenir(self, telegram_id):
+        """Retorna (participant_id, nom_usuari) o None si el participant no hi és."""
+        with self._lock:
+            entrada = self._entrades.get(telegram_id)
+            if entrada is None:
+                self.errades += 1
+                return None
+            self.encerts += 1
+            self._entrades.move_to_end(telegram_id)
+            return entrada
+
+    def desar(self, telegram_id, participant_id, nom_usuari):
+        with self._lock:
+            self._entrades[telegram_id] = (participant_id, nom_usuari)
+            self._entrades.move_to_end(telegram_id)
+            while len(self._entrades) > self.mida:
+                self._entrades.popitem(last=False)
+
+    def estadistiques(self):
+        with self._lock:
+            consultes = self.encerts + self.errades
+            return {
+                "mida": len(self._entrades),
+                "encerts": self.encerts,
+                "errades": self.errades,
+                "taxa_encerts": self.encerts / consultes if consultes else None,
+            }
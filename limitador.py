@@ -0,0 +1,130 @@
+"""Límits de comandes per usuari i per xat, i consultes repetides.
+
+Cada usuari té un cubell de tokens: pot enviar unes quantes comandes
+seguides i en recupera a un ritme fix. Les consultes (/consultar,
+/classificacio...) també gasten del cubell del xat, perquè en un grup amb
+molta gent no es llegeixi la base de dades ni s'enviïn missatges sense parar.
+Agrupador recorda l'última resposta a cada consulta d'un xat, i una consulta
+idèntica dins la finestra (sense que hagin canviat les dades) no es torna a
+respondre: la resposta és just a sobre. Si arriba mentre l'altra encara
+s'està responent, n'espera el final i tampoc es respon.
+
+Tot s'executa al fil de l'event loop, com els handlers, i no cal cap lock.
+"""
+import asyncio
+import math
+import time
+from contextlib import contextmanager
+
+# Cada quants segons s'esborren els cubells plens i les respostes caducades
+INTERVAL_NETEJA = 60
+
+def comanda(text):
+    """'/Classificacio@porra_bot  2' -> ('classificacio', '2')."""
+    nom, _, args = (text or "").strip().partition(" ")
+    return nom.lstrip("/").split("@", 1)[0].lower(), " ".join(args.split())
+
+class CubellTokens:
+    __slots__ = ("capacitat", "ritme", "tokens", "instant", "avisat")
+
+    def __init__(self, capacitat, per_minut, ara):
+        self.capacitat = capacitat
+        self.ritme = per_minut / 60
+        self.tokens = capacitat
+        self.instant = ara
+        # Només s'avisa una vegada cada vegada que el cubell es buida
+        self.avisat = False
+
+    def omplir(self, ara):
+        self.tokens = min(self.capacitat, self.tokens + (ara - self.instant) * self.ritme)
+        self.instant = ara
+
+    def ple(self, ara):
+        self.omplir(ara)
+        return self.tokens >= self.capacitat
+
+    def espera(self):
+        """Segons (arrodonits cap amunt) que falten perquè hi hagi un token."""
+        return max(1, math.ceil((1 - self.tokens) / self.ritme))
+
+class Limitador:
+    def __init__(self, comandes_usuari, per_minut_usuari, consultes_xat, per_minut_xat):
+        self._limits = {"usuari": (comandes_usuari, per_minut_usuari), "xat": (consultes_xat, per_minut_xat)}
+        self._cubells = {}  # (àmbit, id) -> CubellTokens
+        self._neteja = time.monotonic()
+
+    def __len__(self):
+        return len(self._cubells)
+
+    def _cubell(self, ambit, id_, ara):
+        cubell = self._cubells.get((ambit, id_))
+        if cubell is None:
+            cubell = self._cubells[(ambit, id_)] = CubellTokens(*self._limits[ambit], ara)
+        else:
+            cubell.omplir(ara)
+        return cubell
+
+    def _netejar(self, ara):
+        # Un cubell ple és igual que un de nou: no cal recordar-lo
+        self._neteja = ara
+        for clau in [clau for clau, cubell in self._cubells.items() if cubell.ple(ara)]:
+            del self._cubells[clau]
+
+    def comprovar(self, usuari_id, xat_id, consulta):
+        """Gasta els tokens d'una comanda.
+
+        Retorna None si la comanda pot passar i, si no, (àmbit, segons
+        d'espera, si cal avisar l'usuari). Si algun cubell és buit, no es gasta
+        de cap.
+        """
+        ara = time.monotonic()
+        if ara - self._neteja > INTERVAL_NETEJA:
+            self._netejar(ara)
+
+        cubells = [("usuari", self._cubell("usuari", usuari_id, ara))]
+        if consulta:
+            cubells.append(("xat", self._cubell("xat", xat_id, ara)))
+
+        for ambit, cubell in cubells:
+            if cubell.tokens < 1:
+                avisar = not cubell.avisat
+                cubell.avisat = True
+                return ambit, cubell.espera(), avisar
+        for _, cubell in cubells:
+            cubell.tokens -= 1
+            cubell.avisat = False
+        return None
+
+class Agrupador:
+    def __init__(self, finestra):
+        self.finestra = finestra
+        self._respostes = {}  # clau -> (versió de les dades, instant de la resposta)
+        self._en_curs = {}    # clau -> asyncio.Event que s'activa quan s'acaba de respondre
+        self._neteja = time.monotonic()
+
+    async def esperar(self, clau):
+        """Espera que s'acabi de respondre la mateixa consulta, si s'està responent."""
+        while clau in self._en_curs:
+            await self._en_curs[clau].wait()
+
+    @contextmanager
+    def responent(self, clau):
+        fet = self._en_curs[clau] = asyncio.Event()
+        try:
+            yield
+        finally:
+            del self._en_curs[clau]
+            fet.set()
+
+    def repetida(self, clau, versio):
+        """Si ja s'ha respost aquesta consulta, amb les mateixes dades, fa menys de `finestra` segons."""
+        resposta = self._respostes.get(clau)
+        return resposta is not None and resposta[0] == versio and time.monotonic() - resposta[1] < self.finestra
+
+    def respost(self, clau, versio):
+        ara = time.monotonic()
+        self._respostes[clau] = (versio, ara)
+        if ara - self._neteja > INTERVAL_NETEJA:
+            self._neteja = ara
+            for caducada in [c for c, (_, instant) in self._respostes.items() if ara - instant >= self.finestra]:
+                del self._respostes[caducada]
@@ -0,0 +1,233 @@
+"""Mètriques del bot: comptadors i histogrames en memòria.
+
+database.py i porra.py mesuren els handlers, les funcions de la base de
+dades, les consultes i les caches. Les mètriques es poden llegir en format
+de text de Prometheus (servidor HTTP local, config.METRIQUES) o resumides al
+xat amb /stats. Les consultes que passen de METRIQUES["consulta_lenta_ms"]
+s'escriuen al log.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import re
+import threading
+import time
+from config import METRIQUES
+
+logger = logging.getLogger(__name__)
+
+# Límits (en segons) dels intervals dels histogrames
+INTERVALS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONSULTA_LENTA = (METRIQUES.get("consulta_lenta_ms") or 0) / 1000
+
+_lock = threading.Lock()
+_families = {}    # nom -> {"tipus", "ajuda", "valors": {etiquetes: valor}}
+_calculades = []  # (nom, ajuda, funció que retorna {etiquetes: valor})
+INICI = time.time()
+
+# Si l'actualització o la feina en curs hi ha posat una llista [n], cada sentència
+# hi suma 1 (benchmarks/carrega.py compta així les consultes de cada comanda).
+# database.executar copia les contextvars al fil que fa la consulta.
+consultes_en_curs = contextvars.ContextVar("consultes_en_curs", default=None)
+
+def _familia(nom, tipus, ajuda):
+    familia = _families.get(nom)
+    if familia is None:
+        familia = _families[nom] = {"tipus": tipus, "ajuda": ajuda, "valors": {}}
+    return familia
+
+def comptador(nom, ajuda):
+    with _lock:
+        _familia(nom, "counter", ajuda)
+
+def histograma(nom, ajuda):
+    with _lock:
+        _familia(nom, "histogram", ajuda)
+
+def calculada(nom, ajuda, funcio):
+    """Valor que es calcula en el moment de llegir les mètriques (p. ex. la mida d'una cache)."""
+    _calculades.append((nom, ajuda, funcio))
+
+def incrementar(nom, valor=1, **etiquetes):
+    clau = tuple(sorted(etiquetes.items()))
+    with _lock:
+        valors = _families[nom]["valors"]
+        valors[clau] = valors.get(clau, 0) + valor
+
+def observar(nom, segons, **etiquetes):
+    clau = tuple(sorted(etiquetes.items()))
+    with _lock:
+        valors = _families[nom]["valors"]
+        estat = valors.get(clau)
+        if estat is None:
+            estat = valors[clau] = {"intervals": [0] * len(INTERVALS), "suma": 0.0, "total": 0}
+        for i, limit in enumerate(INTERVALS):
+            if segons <= limit:
+                estat["intervals"][i] += 1
+                break
+        estat["suma"] += segons
+        estat["total"] += 1
+
+comptador("porra_handler_errors_total", "Handlers que han acabat amb una excepció")
+histograma("porra_handler_segons", "Temps de resposta de cada handler")
+comptador("porra_bd_errors_total", "Funcions de database.py que han acabat amb una excepció")
+histograma("porra_bd_funcio_segons", "Temps de cada funció de database.py")
+comptador("porra_bd_connexions_total", "Connexions demanades a la base de dades")
+histograma("porra_bd_consulta_segons", "Temps de cada sentència SQL, per tipus")
+comptador("porra_bd_consultes_lentes_total", "Sentències SQL més lentes que el llindar")
+comptador("porra_cache_total", "Consultes a les caches, per cache i resultat")
+comptador("porra_comandes_descartades_total", "Comandes no ateses pels límits o per repetides, per motiu")
+
+def instrumentar_handler(funcio):
+    """Mesura un handler (o una feina del JobQueue) de porra.py."""
+    @functools.wraps(funcio)
+    async def wrapper(*args, **kwargs):
+        inici = time.perf_counter()
+        try:
+            return await funcio(*args, **kwargs)
+        except Exception:
+            incrementar("porra_handler_errors_total", handler=funcio.__name__)
+            raise
+        finally:
+            observar("porra_handler_segons", time.perf_counter() - inici, handler=funcio.__name__)
+    return wrapper
+
+def instrumentar_bd(funcio):
+    """Mesura una funció bloquejant de database.py."""
+    @functools.wraps(funcio)
+    def wrapper(*args, **kwargs):
+        inici = time.perf_counter()
+        try:
+            return funcio(*args, **kwargs)
+        except Exception:
+            incrementar("porra_bd_errors_total", funcio=funcio.__name__)
+            raise
+        finally:
+            observar("porra_bd_funcio_segons", time.perf_counter() - inici, funcio=funcio.__name__)
+    return wrapper
+
+def _mesurar_consulta(executar, query, params):
+    inici = time.perf_counter()
+    try:
+        return executar(query, params)
+    finally:
+        durada = time.perf_counter() - inici
+        comptador = consultes_en_curs.get()
+        if comptador is not None:
+            comptador[0] += 1
+        paraules = query.split(None, 1)
+        observar("porra_bd_consulta_segons", durada, tipus=paraules[0].lower() if paraules else "")
+        if CONSULTA_LENTA and durada > CONSULTA_LENTA:
+            incrementar("porra_bd_consultes_lentes_total")
+            logger.warning("Consulta lenta (%.0f ms): %s", durada * 1000, " ".join(query.split())[:500])
+
+class CursorMesurat:
+    """Cursor que mesura el temps de cada sentència."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        return _mesurar_consulta(self._cursor.execute, query, params)
+
+    def executemany(self, query, params):
+        return _mesurar_consulta(self._cursor.executemany, query, params)
+
+    def __getattr__(self, nom):
+        return getattr(self._cursor, nom)
+
+class ConnexioMesurada:
+    def __init__(self, db):
+        self._db = db
+
+    def cursor(self, *args, **kwargs):
+        return CursorMesurat(self._db.cursor(*args, **kwargs))
+
+    def __getattr__(self, nom):
+        return getattr(self._db, nom)
+
+def _etiquetes(clau, extra=()):
+    parelles = list(clau) + list(extra)
+    if not parelles:
+        return ""
+    return "{" + ",".join(f'{nom}="{_escapar(valor)}"' for nom, valor in parelles) + "}"
+
+def _escapar(valor):
+    return re.sub(r'(["\\])', r"\\\1", str(valor)).replace("\n", "\\n")
+
+def text_prometheus():
+    """Totes les mètriques en el format de text de Prometheus (versió 0.0.4)."""
+    linies = []
+    with _lock:
+        for nom, familia in _families.items():
+            linies.append(f"# HELP {nom} {familia['ajuda']}")
+            linies.append(f"# TYPE {nom} {familia['tipus']}")
+            for clau, valor in familia["valors"].items():
+                if familia["tipus"] == "histogram":
+                    acumulat = 0
+                    for limit, n in zip(INTERVALS, valor["intervals"]):
+                        acumulat += n
+                        linies.append(f"{nom}_bucket{_etiquetes(clau, [('le', limit)])} {acumulat}")
+                    linies.append(f"{nom}_bucket{_etiquetes(clau, [('le', '+Inf')])} {valor['total']}")
+                    linies.append(f"{nom}_sum{_etiquetes(clau)} {valor['suma']}")
+                    linies.append(f"{nom}_count{_etiquetes(clau)} {valor['total']}")
+                else:
+                    linies.append(f"{nom}{_etiquetes(clau)} {valor}")
+
+    for nom, ajuda, funcio in _calculades:
+        linies.append(f"# HELP {nom} {ajuda}")
+        linies.append(f"# TYPE {nom} gauge")
+        for clau, valor in funcio().items():
+            linies.append(f"{nom}{_etiquetes(clau)} {valor}")
+    return "\n".join(linies) + "\n"
+
+def percentil(estat, p):
+    """Límit superior de l'interval on cau el percentil p (0-1) d'un histograma."""
+    objectiu = p * estat["total"]
+    acumulat = 0
+    for limit, n in zip(INTERVALS, estat["intervals"]):
+        acumulat += n
+        if acumulat >= objectiu:
+            return limit
+    return float("inf")
+
+def histogrames(nom):
+    """Còpia dels histogrames d'una família: {valor de l'etiqueta: estat}."""
+    with _lock:
+        return {
+            clau[0][1] if clau else "": {**estat, "intervals": list(estat["intervals"])}
+            for clau, estat in _families[nom]["valors"].items()
+        }
+
+def valors(nom):
+    with _lock:
+        return dict(_families[nom]["valors"])
+
+async def _respondre(reader, writer):
+    try:
+        peticio = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        if peticio.split(b" ")[1:2] == [b"/metrics"]:
+            estat, cos = "200 OK", text_prometheus().encode()
+        else:
+            estat, cos = "404 Not Found", b"Prova /metrics\n"
+        writer.write(
+            f"HTTP/1.1 {estat}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(cos)}\r\n"
+            "Connection: close\r\n\r\n".encode() + cos
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def iniciar_servidor():
+    """Serveix /metrics a METRIQUES["escoltar"]:METRIQUES["port"]. Retorna el servidor, o None si no n'hi ha."""
+    if not METRIQUES.get("port"):
+        return None
+    servidor = await asyncio.start_server(_respondre, METRIQUES.get("escoltar", "127.0.0.1"), METRIQUES["port"])
+    logger.info("Mètriques a http://%s:%s/metrics", METRIQUES.get("escoltar", "127.0.0.1"), METRIQUES["port"])
+    return servidor
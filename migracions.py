@@ -0,0 +1,528 @@
+"""Esquema versionat de la base de dades.
+
+Cada migració té un número de versió i una llista de sentències per a cada
+motor (MySQL i SQLite han de quedar amb el mateix número de versió). En
+arrencar, el bot aplica en ordre les que encara no consten a la taula
+versio_esquema. Les migracions s'han de poder tornar a executar si una es
+queda a mitges (el DDL fa commit implícit), per això s'ignoren els errors que
+el motor reconeix com a "ja existeix". Una sentència pot ser un text, una
+tupla (text, paràmetres) o una funció que rep el cursor, per als canvis de
+dades que no es poden fer amb una sola sentència.
+"""
+import logging
+import re
+from config import GRUPS_AUTORITZATS
+from database import ErrorBD, connexio, motor
+from datetime import datetime
+from resultats import llegir_resultat
+
+logger = logging.getLogger(__name__)
+
+# Les dades anteriors a la versió 3 (un sol grup) s'assignen al primer grup autoritzat
+GRUP_INICIAL = GRUPS_AUTORITZATS[0]
+
+# Els partits anteriors a la versió 6 (sense temporades) van a aquesta temporada
+COMPETICIO_INICIAL = "General"
+TEMPORADA_INICIAL = "Inicial"
+
+def omplir_estadistiques(cursor):
+    """Calcula les estadístiques de tots els partits ja puntuats, en ordre cronològic.
+
+    A partir d'aquí database.actualitzar_punts les manté partit a partit.
+    """
+    cursor.execute("DELETE FROM estadistiques")
+    cursor.execute("""
+        SELECT p.grup_id, p.id, p.resultat, p.juga_a_casa, a.participant_id, a.gols_local, a.gols_visitant, a.punts_jornada
+        FROM apostes a
+        INNER JOIN partits p ON p.id = a.partit_id
+        WHERE p.resultat IS NOT NULL AND a.punts_jornada IS NOT NULL
+        ORDER BY p.data_hora, p.id
+    """)
+    estadistiques = {}
+    for grup_id, partit_id, resultat, juga_a_casa, participant_id, gols_local, gols_visitant, punts in cursor.fetchall():
+        e = estadistiques.get((grup_id, participant_id))
+        if e is None:
+            e = estadistiques[(grup_id, participant_id)] = {
+                "partits": 0, "exactes": 0, "punts": 0, "partits_casa": 0, "exactes_casa": 0, "punts_casa": 0,
+                "ratxa_actual": 0, "ratxa_maxima": 0, "millor_jornada": punts, "millor_partit_id": partit_id,
+            }
+        exacte = 1 if llegir_resultat(resultat) == (gols_local, gols_visitant) else 0
+        casa = 1 if juga_a_casa else 0
+        e["partits"] += 1
+        e["exactes"] += exacte
+        e["punts"] += punts
+        e["partits_casa"] += casa
+        e["exactes_casa"] += exacte * casa
+        e["punts_casa"] += punts * casa
+        e["ratxa_actual"] = e["ratxa_actual"] + 1 if punts > 0 else 0
+        e["ratxa_maxima"] = max(e["ratxa_maxima"], e["ratxa_actual"])
+        if punts > e["millor_jornada"]:
+            e["millor_jornada"], e["millor_partit_id"] = punts, partit_id
+
+    columnes = (
+        "partits", "exactes", "punts", "partits_casa", "exactes_casa", "punts_casa",
+        "ratxa_actual", "ratxa_maxima", "millor_jornada", "millor_partit_id",
+    )
+    cursor.executemany(
+        f"INSERT INTO estadistiques (grup_id, participant_id, {', '.join(columnes)}) "
+        f"VALUES ({', '.join(['%s'] * (len(columnes) + 2))})",
+        [(grup_id, participant_id) + tuple(e[columna] for columna in columnes)
+         for (grup_id, participant_id), e in estadistiques.items()],
+    )
+
+def crear_temporades_inicials(cursor):
+    """Posa tots els partits que ja hi ha a una primera temporada oberta de cada grup.
+
+    La classificació d'aquesta temporada és la que el grup tenia fins ara.
+    """
+    cursor.execute("SELECT id FROM competicions WHERE nom = %s", (COMPETICIO_INICIAL,))
+    fila = cursor.fetchone()
+    if fila is None:
+        cursor.execute("INSERT INTO competicions (nom) VALUES (%s)", (COMPETICIO_INICIAL,))
+        competicio_id = cursor.lastrowid
+    else:
+        (competicio_id,) = fila
+
+    cursor.execute("""
+        SELECT grup_id, MIN(data_hora) FROM partits GROUP BY grup_id
+        UNION
+        SELECT grup_id, NULL FROM punts_grup
+    """)
+    inicis = {}
+    for grup_id, inici in cursor.fetchall():
+        if inicis.get(grup_id) is None:
+            inicis[grup_id] = inici
+
+    for grup_id, inici in inicis.items():
+        # Si la migració es va quedar a mitges, la temporada del grup ja pot existir
+        cursor.execute("SELECT id FROM temporades WHERE grup_id = %s AND tancada = 0", (grup_id,))
+        fila = cursor.fetchone()
+        if fila is None:
+            cursor.execute(
+                "INSERT INTO temporades (grup_id, competicio_id, nom, inici) VALUES (%s, %s, %s, %s)",
+                (grup_id, competicio_id, TEMPORADA_INICIAL, inici or datetime.now()),
+            )
+            temporada_id = cursor.lastrowid
+        else:
+            (temporada_id,) = fila
+        cursor.execute("UPDATE partits SET temporada_id = %s WHERE grup_id = %s AND temporada_id IS NULL", (temporada_id, grup_id))
+        cursor.execute("DELETE FROM punts_temporada WHERE temporada_id = %s", (temporada_id,))
+        cursor.execute(
+            "INSERT INTO punts_temporada (temporada_id, participant_id, punts) "
+            "SELECT %s, participant_id, punts FROM punts_grup WHERE grup_id = %s",
+            (temporada_id, grup_id),
+        )
+
+MIGRACIONS_MYSQL = [
+    (1, "Taules inicials", [
+        """
+        CREATE TABLE IF NOT EXISTS partits (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            nom_contrincant VARCHAR(100) NOT NULL,
+            data_hora DATETIME NOT NULL,
+            juga_a_casa TINYINT(1) NOT NULL,
+            resultat VARCHAR(10) NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS participants (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            nom_usuari VARCHAR(100) NOT NULL,
+            telegram_id BIGINT NOT NULL,
+            punts INT NOT NULL DEFAULT 0
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS apostes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            partit_id INT NOT NULL,
+            participant_id INT NOT NULL,
+            gols_local INT NOT NULL,
+            gols_visitant INT NOT NULL,
+            punts_jornada INT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ]),
+    (2, "Índexs de les consultes habituals i claus foranes", [
+        # Abans de les claus úniques eliminem apostes duplicades (ens quedem la darrera)
+        """
+        DELETE a1 FROM apostes a1
+        INNER JOIN apostes a2
+            ON a1.partit_id = a2.partit_id AND a1.participant_id = a2.participant_id AND a1.id < a2.id
+        """,
+        "ALTER TABLE participants ADD UNIQUE KEY uq_participants_telegram (telegram_id)",
+        # També serveix per a les consultes per apostes.partit_id (prefix de l'índex)
+        "ALTER TABLE apostes ADD UNIQUE KEY uq_apostes_partit_participant (partit_id, participant_id)",
+        "ALTER TABLE apostes ADD INDEX idx_apostes_participant (participant_id)",
+        # Partit en marxa (resultat IS NULL) i comprovació de partits repetits
+        "ALTER TABLE partits ADD INDEX idx_partits_obert (resultat, data_hora)",
+        "ALTER TABLE partits ADD INDEX idx_partits_rival_data (nom_contrincant, data_hora)",
+        # Les apostes òrfenes impedirien crear les claus foranes
+        "DELETE FROM apostes WHERE partit_id NOT IN (SELECT id FROM partits)",
+        "DELETE FROM apostes WHERE participant_id NOT IN (SELECT id FROM participants)",
+        """
+        ALTER TABLE apostes
+            ADD CONSTRAINT fk_apostes_partit FOREIGN KEY (partit_id) REFERENCES partits (id) ON DELETE CASCADE
+        """,
+        """
+        ALTER TABLE apostes
+            ADD CONSTRAINT fk_apostes_participant FOREIGN KEY (participant_id) REFERENCES participants (id)
+        """,
+    ]),
+    (3, "Diversos grups: partits i classificació per grup", [
+        "ALTER TABLE partits ADD COLUMN grup_id BIGINT NULL AFTER id",
+        ("UPDATE partits SET grup_id = %s WHERE grup_id IS NULL", (GRUP_INICIAL,)),
+        "ALTER TABLE partits MODIFY grup_id BIGINT NOT NULL",
+        "ALTER TABLE partits ADD INDEX idx_partits_grup_obert (grup_id, resultat, data_hora)",
+        "ALTER TABLE partits ADD INDEX idx_partits_grup_rival_data (grup_id, nom_contrincant, data_hora)",
+        "ALTER TABLE partits DROP INDEX idx_partits_obert",
+        "ALTER TABLE partits DROP INDEX idx_partits_rival_data",
+        """
+        CREATE TABLE IF NOT EXISTS punts_grup (
+            grup_id BIGINT NOT NULL,
+            participant_id INT NOT NULL,
+            punts INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (grup_id, participant_id),
+            CONSTRAINT fk_punts_grup_participant FOREIGN KEY (participant_id) REFERENCES participants (id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        # Fins ara participants.punts era la classificació de l'únic grup
+        ("INSERT IGNORE INTO punts_grup (grup_id, participant_id, punts) SELECT %s, id, punts FROM participants", (GRUP_INICIAL,)),
+    ]),
+    (4, "Apostes tancades a l'hora del partit", [
+        "ALTER TABLE partits ADD COLUMN apostes_tancades TINYINT(1) NOT NULL DEFAULT 0",
+        # Els partits que ja han començat no tornen a publicar la llista d'apostes
+        ("UPDATE partits SET apostes_tancades = 1 WHERE data_hora <= %s", (datetime.now(),)),
+    ]),
+    (5, "Estadístiques acumulades per participant i grup", [
+        """
+        CREATE TABLE IF NOT EXISTS estadistiques (
+            grup_id BIGINT NOT NULL,
+            participant_id INT NOT NULL,
+            partits INT NOT NULL DEFAULT 0,
+            exactes INT NOT NULL DEFAULT 0,
+            punts INT NOT NULL DEFAULT 0,
+            partits_casa INT NOT NULL DEFAULT 0,
+            exactes_casa INT NOT NULL DEFAULT 0,
+            punts_casa INT NOT NULL DEFAULT 0,
+            ratxa_actual INT NOT NULL DEFAULT 0,
+            ratxa_maxima INT NOT NULL DEFAULT 0,
+            millor_jornada INT NOT NULL DEFAULT 0,
+            millor_partit_id INT NULL,
+            PRIMARY KEY (grup_id, participant_id),
+            CONSTRAINT fk_estadistiques_participant FOREIGN KEY (participant_id) REFERENCES participants (id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        omplir_estadistiques,
+    ]),
+    (6, "Temporades i competicions, classificació per temporada i arxiu", [
+        """
+        CREATE TABLE IF NOT EXISTS competicions (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            nom VARCHAR(100) NOT NULL,
+            UNIQUE KEY uq_competicions_nom (nom)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS temporades (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            grup_id BIGINT NOT NULL,
+            competicio_id INT NOT NULL,
+            nom VARCHAR(100) NOT NULL,
+            inici DATETIME NOT NULL,
+            fi DATETIME NULL,
+            tancada TINYINT(1) NOT NULL DEFAULT 0,
+            INDEX idx_temporades_grup (grup_id, tancada),
+            CONSTRAINT fk_temporades_competicio FOREIGN KEY (competicio_id) REFERENCES competicions (id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS punts_temporada (
+            temporada_id INT NOT NULL,
+            participant_id INT NOT NULL,
+            punts INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (temporada_id, participant_id),
+            CONSTRAINT fk_punts_temporada_temporada FOREIGN KEY (temporada_id) REFERENCES temporades (id),
+            CONSTRAINT fk_punts_temporada_participant FOREIGN KEY (participant_id) REFERENCES participants (id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        "ALTER TABLE partits ADD COLUMN temporada_id INT NULL AFTER grup_id",
+        crear_temporades_inicials,
+        "ALTER TABLE partits MODIFY temporada_id INT NOT NULL",
+        "ALTER TABLE partits ADD CONSTRAINT fk_partits_temporada FOREIGN KEY (temporada_id) REFERENCES temporades (id)",
+        # Les temporades tancades surten de partits i apostes: les consultes del dia a
+        # dia només toquen la temporada en curs. Els id es conserven.
+        """
+        CREATE TABLE IF NOT EXISTS partits_arxiu (
+            id INT PRIMARY KEY,
+            grup_id BIGINT NOT NULL,
+            temporada_id INT NOT NULL,
+            nom_contrincant VARCHAR(100) NOT NULL,
+            data_hora DATETIME NOT NULL,
+            juga_a_casa TINYINT(1) NOT NULL,
+            resultat VARCHAR(10) NULL,
+            INDEX idx_partits_arxiu_temporada (temporada_id),
+            CONSTRAINT fk_partits_arxiu_temporada FOREIGN KEY (temporada_id) REFERENCES temporades (id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS apostes_arxiu (
+            partit_id INT NOT NULL,
+            participant_id INT NOT NULL,
+            gols_local INT NOT NULL,
+            gols_visitant INT NOT NULL,
+            punts_jornada INT NULL,
+            PRIMARY KEY (partit_id, participant_id),
+            INDEX idx_apostes_arxiu_participant (participant_id),
+            CONSTRAINT fk_apostes_arxiu_partit FOREIGN KEY (partit_id) REFERENCES partits_arxiu (id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ]),
+    (7, "Regles de puntuació de cada temporada", [
+        # JSON amb les regles (regles.py); NULL = les de config.py
+        "ALTER TABLE temporades ADD COLUMN regles VARCHAR(500) NULL",
+    ]),
+    (8, "Una sola temporada oberta per grup i fora la classificació global", [
+        # MySQL no té índexs parcials: la columna val grup_id mentre la temporada és
+        # oberta i NULL quan es tanca, i la clau única no compara els NULL
+        "ALTER TABLE temporades ADD COLUMN grup_obert BIGINT AS (IF(tancada = 0, grup_id, NULL)) STORED",
+        "ALTER TABLE temporades ADD UNIQUE KEY uq_temporades_grup_oberta (grup_obert)",
+        # La classificació és per temporada (punts_temporada) des de la versió 6
+        "DROP TABLE IF EXISTS punts_grup",
+    ]),
+]
+
+MIGRACIONS_SQLITE = [
+    (1, "Taules inicials", [
+        """
+        CREATE TABLE IF NOT EXISTS partits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom_contrincant TEXT NOT NULL,
+            data_hora TIMESTAMP NOT NULL,
+            juga_a_casa INTEGER NOT NULL,
+            resultat TEXT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS participants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom_usuari TEXT NOT NULL,
+            telegram_id INTEGER NOT NULL,
+            punts INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS apostes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            partit_id INTEGER NOT NULL REFERENCES partits (id) ON DELETE CASCADE,
+            participant_id INTEGER NOT NULL REFERENCES participants (id),
+            gols_local INTEGER NOT NULL,
+            gols_visitant INTEGER NOT NULL,
+            punts_jornada INTEGER NULL
+        )
+        """,
+    ]),
+    (2, "Índexs de les consultes habituals", [
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_participants_telegram ON participants (telegram_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_apostes_partit_participant ON apostes (partit_id, participant_id)",
+        "CREATE INDEX IF NOT EXISTS idx_apostes_participant ON apostes (participant_id)",
+        # SQLite sí que té índexs parcials: només els partits sense resultat
+        "CREATE INDEX IF NOT EXISTS idx_partits_obert ON partits (data_hora) WHERE resultat IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_partits_rival_data ON partits (nom_contrincant, data_hora)",
+    ]),
+    (3, "Diversos grups: partits i classificació per grup", [
+        "ALTER TABLE partits ADD COLUMN grup_id INTEGER NULL",
+        ("UPDATE partits SET grup_id = %s WHERE grup_id IS NULL", (GRUP_INICIAL,)),
+        "DROP INDEX IF EXISTS idx_partits_obert",
+        "DROP INDEX IF EXISTS idx_partits_rival_data",
+        "CREATE INDEX IF NOT EXISTS idx_partits_grup_obert ON partits (grup_id, data_hora) WHERE resultat IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_partits_grup_rival_data ON partits (grup_id, nom_contrincant, data_hora)",
+        """
+        CREATE TABLE IF NOT EXISTS punts_grup (
+            grup_id INTEGER NOT NULL,
+            participant_id INTEGER NOT NULL REFERENCES participants (id),
+            punts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (grup_id, participant_id)
+        )
+        """,
+        # Fins ara participants.punts era la classificació de l'únic grup
+        ("INSERT OR IGNORE INTO punts_grup (grup_id, participant_id, punts) SELECT %s, id, punts FROM participants", (GRUP_INICIAL,)),
+    ]),
+    (4, "Apostes tancades a l'hora del partit", [
+        "ALTER TABLE partits ADD COLUMN apostes_tancades INTEGER NOT NULL DEFAULT 0",
+        ("UPDATE partits SET apostes_tancades = 1 WHERE data_hora <= %s", (datetime.now(),)),
+    ]),
+    (5, "Estadístiques acumulades per participant i grup", [
+        """
+        CREATE TABLE IF NOT EXISTS estadistiques (
+            grup_id INTEGER NOT NULL,
+            participant_id INTEGER NOT NULL REFERENCES participants (id),
+            partits INTEGER NOT NULL DEFAULT 0,
+            exactes INTEGER NOT NULL DEFAULT 0,
+            punts INTEGER NOT NULL DEFAULT 0,
+            partits_casa INTEGER NOT NULL DEFAULT 0,
+            exactes_casa INTEGER NOT NULL DEFAULT 0,
+            punts_casa INTEGER NOT NULL DEFAULT 0,
+            ratxa_actual INTEGER NOT NULL DEFAULT 0,
+            ratxa_maxima INTEGER NOT NULL DEFAULT 0,
+            millor_jornada INTEGER NOT NULL DEFAULT 0,
+            millor_partit_id INTEGER NULL,
+            PRIMARY KEY (grup_id, participant_id)
+        )
+        """,
+        omplir_estadistiques,
+    ]),
+    (6, "Temporades i competicions, classificació per temporada i arxiu", [
+        """
+        CREATE TABLE IF NOT EXISTS competicions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom TEXT NOT NULL UNIQUE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS temporades (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            grup_id INTEGER NOT NULL,
+            competicio_id INTEGER NOT NULL REFERENCES competicions (id),
+            nom TEXT NOT NULL,
+            inici TIMESTAMP NOT NULL,
+            fi TIMESTAMP NULL,
+            tancada INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        # Una sola temporada oberta per grup
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_temporades_grup_oberta ON temporades (grup_id) WHERE tancada = 0",
+        """
+        CREATE TABLE IF NOT EXISTS punts_temporada (
+            temporada_id INTEGER NOT NULL REFERENCES temporades (id),
+            participant_id INTEGER NOT NULL REFERENCES participants (id),
+            punts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (temporada_id, participant_id)
+        )
+        """,
+        "ALTER TABLE partits ADD COLUMN temporada_id INTEGER NULL REFERENCES temporades (id)",
+        crear_temporades_inicials,
+        "CREATE INDEX IF NOT EXISTS idx_partits_temporada ON partits (temporada_id)",
+        """
+        CREATE TABLE IF NOT EXISTS partits_arxiu (
+            id INTEGER PRIMARY KEY,
+            grup_id INTEGER NOT NULL,
+            temporada_id INTEGER NOT NULL REFERENCES temporades (id),
+            nom_contrincant TEXT NOT NULL,
+            data_hora TIMESTAMP NOT NULL,
+            juga_a_casa INTEGER NOT NULL,
+            resultat TEXT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_partits_arxiu_temporada ON partits_arxiu (temporada_id)",
+        """
+        CREATE TABLE IF NOT EXISTS apostes_arxiu (
+            partit_id INTEGER NOT NULL REFERENCES partits_arxiu (id) ON DELETE CASCADE,
+            participant_id INTEGER NOT NULL,
+            gols_local INTEGER NOT NULL,
+            gols_visitant INTEGER NOT NULL,
+            punts_jornada INTEGER NULL,
+            PRIMARY KEY (partit_id, participant_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_apostes_arxiu_participant ON apostes_arxiu (participant_id)",
+    ]),
+    (7, "Regles de puntuació de cada temporada", [
+        "ALTER TABLE temporades ADD COLUMN regles TEXT NULL",
+    ]),
+    (8, "Una sola temporada oberta per grup i fora la classificació global", [
+        # L'índex únic parcial uq_temporades_grup_oberta ja ho garanteix des de la versió 6
+        "DROP TABLE IF EXISTS punts_grup",
+    ]),
+]
+
+MIGRACIONS = {
+    "mysql": MIGRACIONS_MYSQL,
+    "sqlite": MIGRACIONS_SQLITE,
+}
+
+def taules():
+    """Taules que creen les migracions del motor, en un ordre en què es poden
+    esborrar: cada taula abans de les taules a què fa referència."""
+    referencies = {}  # taula -> taules a què fa referència
+    for _, _, sentencies in MIGRACIONS[motor().nom]:
+        for sentencia in sentencies:
+            if isinstance(sentencia, tuple):
+                sentencia = sentencia[0]
+            if not isinstance(sentencia, str):
+                continue
+            esborrada = re.match(r"\s*DROP TABLE (?:IF EXISTS )?(\w+)", sentencia)
+            if esborrada:
+                referencies.pop(esborrada.group(1), None)
+                continue
+            taula = re.match(r"\s*(?:CREATE TABLE IF NOT EXISTS|ALTER TABLE)\s+(\w+)", sentencia)
+            if taula:
+                referencies.setdefault(taula.group(1), set()).update(re.findall(r"REFERENCES\s+(\w+)", sentencia))
+
+    ordre = []
+    while referencies:
+        lliures = sorted(
+            taula for taula in referencies
+            if not any(taula in altres for altra, altres in referencies.items() if altra != taula)
+        )
+        if not lliures:
+            # Referències circulars: l'ordre de la resta ja no importa
+            lliures = sorted(referencies)
+        ordre.extend(lliures)
+        for taula in lliures:
+            del referencies[taula]
+    return ordre + ["versio_esquema"]
+
+def esborrar_taules():
+    """Esborra totes les taules de l'esquema (només per a bases de dades de proves)."""
+    with connexio() as db:
+        cursor = db.cursor()
+        try:
+            for taula in taules():
+                cursor.execute(f"DROP TABLE IF EXISTS {taula}")
+        finally:
+            cursor.close()
+
+def versio_actual(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS versio_esquema (
+            versio INT PRIMARY KEY,
+            descripcio VARCHAR(200) NOT NULL,
+            aplicada TIMESTAMP NOT NULL
+        )
+    """)
+    cursor.execute("SELECT COALESCE(MAX(versio), 0) FROM versio_esquema")
+    (versio,) = cursor.fetchone()
+    return versio
+
+def aplicar_migracions():
+    """Aplica les migracions pendents i retorna la versió final de l'esquema."""
+    with connexio() as db:
+        cursor = db.cursor()
+        try:
+            versio = versio_actual(cursor)
+            for numero, descripcio, sentencies in MIGRACIONS[motor().nom]:
+                if numero <= versio:
+                    continue
+
+                logger.info("Aplicant la migració %s: %s", numero, descripcio)
+                for sentencia in sentencies:
+                    if callable(sentencia):
+                        sentencia(cursor)
+                        continue
+                    if isinstance(sentencia, str):
+                        sentencia = (sentencia, ())
+                    try:
+                        cursor.execute(*sentencia)
+                    except ErrorBD as err:
+                        if not motor().error_ja_aplicada(err):
+                            raise
+                cursor.execute(
+                    "INSERT INTO versio_esquema (versio, descripcio, aplicada) VALUES (%s, %s, %s)",
+                    (numero, descripcio, datetime.now()),
+                )
+                db.commit()
+                versio = numero
+        finally:
+            cursor.close()
+    return versio
@@ -0,0 +1,140 @@
+"""Estat de les converses (/nova) i user_data que sobreviu als reinicis del bot.
+
+PersistenciaDiari és la persistència de python-telegram-bot. Només guarda el
+que el bot fa servir entre missatges: l'estat de les converses persistents i
+user_data en un diari (diari.py), una línia JSON per canvi:
+
+    ["conversa", "nova", [-1001234567890, 12345678], 1]
+    ["usuari", 12345678, {"rival": "Girona"}]
+
+python-telegram-bot demana desar, cada `interval` segons, les dades de tots
+els usuaris que han enviat alguna cosa, encara que no hagin canviat (per
+exemple, en apostar). Aquí només s'apunta una línia quan l'estat és diferent
+del que ja hi ha al diari, així que apostar no escriu res. En arrencar i en
+aturar el bot, el diari es reescriu amb només l'estat vigent.
+"""
+import json
+from diari import Diari
+from telegram.ext import BasePersistence, PersistenceInput
+
+# Línies que pot tenir el diari abans de reescriure'l amb només l'estat vigent
+MAX_LINIES = 1000
+
+def _json(dades):
+    return json.dumps(dades, sort_keys=True, ensure_ascii=False)
+
+class PersistenciaDiari(BasePersistence):
+    def __init__(self, diari, interval=5, sincronitzar=False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=interval,
+        )
+        self._diari = Diari(diari, sincronitzar)
+        self._converses = {}  # nom -> {clau: estat}
+        self._usuaris = {}    # user_id -> user_data en JSON, tal com és al diari
+        self._obert = False
+        self._linies = 0
+
+    def _obrir(self):
+        """Rellegeix el diari (la primera vegada) i el deixa obert per afegir-hi línies."""
+        if self._obert:
+            return
+        for canvi in self._diari.llegir():
+            if canvi[0] == "conversa":
+                self._canviar_conversa(canvi[1], tuple(canvi[2]), canvi[3])
+            else:
+                self._canviar_usuari(canvi[1], _json(canvi[2]))
+        self._compactar()
+        self._obert = True
+
+    def _canviar_conversa(self, nom, clau, estat):
+        converses = self._converses.setdefault(nom, {})
+        if estat is None:
+            converses.pop(clau, None)
+        else:
+            converses[clau] = estat
+
+    def _canviar_usuari(self, user_id, dades):
+        if dades == "{}":
+            self._usuaris.pop(user_id, None)
+        else:
+            self._usuaris[user_id] = dades
+
+    def _apuntar(self, canvi):
+        self._obrir()
+        self._diari.apuntar(canvi)
+        self._linies += 1
+        if self._linies > MAX_LINIES:
+            self._compactar()
+
+    def _compactar(self):
+        """Reescriu el diari amb només l'estat vigent."""
+        canvis = [
+            ["conversa", nom, clau, estat]
+            for nom, converses in self._converses.items()
+            for clau, estat in converses.items()
+        ]
+        canvis += [["usuari", user_id, json.loads(dades)] for user_id, dades in self._usuaris.items()]
+        self._diari.reescriure(canvis)
+        self._linies = 0
+
+    async def get_conversations(self, name):
+        self._obrir()
+        return dict(self._converses.get(name, {}))
+
+    async def update_conversation(self, name, key, new_state):
+        if self._converses.get(name, {}).get(key) == new_state:
+            return
+        self._canviar_conversa(name, key, new_state)
+        self._apuntar(["conversa", name, key, new_state])
+
+    async def get_user_data(self):
+        self._obrir()
+        return {user_id: json.loads(dades) for user_id, dades in self._usuaris.items()}
+
+    async def update_user_data(self, user_id, data):
+        dades = _json(data)
+        if self._usuaris.get(user_id, "{}") == dades:
+            return
+        self._canviar_usuari(user_id, dades)
+        self._apuntar(["usuari", user_id, data])
+
+    async def drop_user_data(self, user_id):
+        await self.update_user_data(user_id, {})
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    # chat_data, bot_data i callback_data no es guarden (store_data)
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        if self._obert:
+            self._compactar()
+            self._diari.tancar()
+            self._obert = False
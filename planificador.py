@@ -0,0 +1,69 @@
+"""Processament concurrent de les actualitzacions amb ordre per usuari.
+
+python-telegram-bot processa les actualitzacions d'una en una si no se li
+indica el contrari. ProcessadorPerUsuari en deixa processar fins a
+`max_concurrent_updates` alhora, però les d'un mateix usuari sempre
+s'executen en ordre d'arribada: així la conversa de /nova (que va per xat i
+usuari) i les apostes d'un mateix usuari no es trepitgen mai. Les
+actualitzacions sense usuari (p. ex. les d'un canal) van en ordre per xat.
+
+Usuaris diferents d'un mateix grup sí que van en paral·lel: quan tothom
+aposta alhora, cap aposta n'espera una altra.
+
+L'ordre es decideix abans d'ocupar una de les `max_concurrent_updates`
+places: una actualització que espera el seu torn no ocupa cap plaça, i un
+usuari amb moltes actualitzacions a la cua no fa esperar la resta.
+"""
+import asyncio
+from telegram.ext import BaseUpdateProcessor
+
+class ProcessadorPerUsuari(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # clau -> [lock, nombre d'actualitzacions que l'esperen o el tenen]
+        self._locks = {}
+
+    @staticmethod
+    def _clau(update):
+        usuari = getattr(update, "effective_user", None)
+        if usuari is not None:
+            return ("usuari", usuari.id)
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return ("xat", chat.id)
+        return None
+
+    def _agafar(self, clau):
+        entrada = self._locks.setdefault(clau, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        return entrada[0]
+
+    def _deixar(self, clau):
+        entrada = self._locks[clau]
+        entrada[1] -= 1
+        if entrada[1] == 0:
+            del self._locks[clau]
+
+    async def process_update(self, update, coroutine):
+        # BaseUpdateProcessor.process_update ocupa la plaça (el semàfor) i crida
+        # do_process_update: el torn de l'usuari s'ha d'esperar abans
+        clau = self._clau(update)
+        if clau is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self._agafar(clau)
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._deixar(clau)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -1,14 +1,106 @@
+import asyncio
+import functools
 import html
+import importlib.util
+import json
+import logging
+import metriques
+import regles
+import signal
+import time
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters, ConversationHandler
-from config import TOKEN_API, GRUP_AUTORITZAT, USUARIS_AUTORITZATS # Importa la configuració
+from telegram.ext import AIORateLimiter, Application, ApplicationHandlerStop, CommandHandler, MessageHandler, ContextTypes, filters, ConversationHandler
+from config import TOKEN_API, GRUPS_AUTORITZATS, USUARIS_AUTORITZATS, MIDA_PAGINA_CLASSIFICACIO, MODE, WEBHOOK, ACTUALITZACIONS_CONCURRENTS, RESULTATS, APOSTES_DIFERIDES, LIMITS, PERSISTENCIA # Importa la configuració
+from database import (
+    ErrorBD, activar_apostes_diferides, actualitzar_punts, anular_partit, apostes_diferides, buidar_apostes,
+    carregar_classificacio, carregar_participants, carregar_partits_en_marxa, escriure_noms_pendents,
+    estadistiques_participants, executar, inicialitzar_bd, nova_temporada, obtenir_cara_a_cara,
+    obtenir_classificacio_temporada, obtenir_estadistiques, obtenir_pagina_classificacio, obtenir_partits_en_marxa,
+    obtenir_porra_en_marxa, obtenir_posicio_classificacio, obtenir_temporades, registrar_aposta_diferida,
+    registrar_aposta_participant, registrar_partit, simular_resultat, tancar_apostes, tancar_bd,
+    temporada_actual, versio_apostes, versio_classificacio,
+)
+from migracions import aplicar_migracions
+from metriques import instrumentar_handler
+from limitador import Agrupador, Limitador, comanda
+from persistencia import PersistenciaDiari
+from planificador import ProcessadorPerUsuari
+from resultats import crear_font, llegir_resultat
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+# Límit de caràcters d'un missatge de Telegram
+LIMIT_MISSATGE = 4096
+
+# Cada quants segons s'escriuen a la base de dades els noms d'usuari que han canviat
+INTERVAL_NOMS = 60
+
+# Comandes que només llegeixen: a més del límit de l'usuari, gasten del límit del xat
+COMANDES_CONSULTA = {"consultar", "classificacio", "temporada", "simular", "estadistiques", "stats"}
+
 # Definim els estats del procés
 ESPERANT_RIVAL, ESPERANT_LOCAL_FORA, ESPERANT_DATA = range(3)
 
-# Inicialitza l'aplicació amb el Token API
-application = Application.builder().token(TOKEN_API).build()
+async def fase_arrencada(nom, funcio, *args):
+    inici = time.perf_counter()
+    resultat = await executar(funcio, *args)
+    logger.info("Arrencada: %s (%.0f ms)", nom, (time.perf_counter() - inici) * 1000)
+    return resultat
+
+async def post_init(application: Application):
+    """Prepara tot el que necessiten els handlers abans de rebre la primera actualització."""
+    inici = time.perf_counter()
+    await fase_arrencada("connexió amb la base de dades", inicialitzar_bd)
+    await fase_arrencada("migracions", aplicar_migracions)
+    await fase_arrencada("cache de participants", carregar_participants)
+    if APOSTES_DIFERIDES["actiu"]:
+        await fase_arrencada(
+            "apostes diferides pendents", activar_apostes_diferides,
+            APOSTES_DIFERIDES["diari"], APOSTES_DIFERIDES["sincronitzar"],
+        )
+    for grup_id in GRUPS_AUTORITZATS:
+        await fase_arrencada(f"classificació del grup {grup_id}", carregar_classificacio, grup_id)
+    partits = await fase_arrencada("partits en marxa", carregar_partits_en_marxa)
+    programar_feines(application.job_queue, partits)
+
+    # Servidor de mètriques de Prometheus (si config.METRIQUES té port)
+    application.bot_data["servidor_metriques"] = await metriques.iniciar_servidor()
+    logger.info("Bot preparat en %.0f ms", (time.perf_counter() - inici) * 1000)
+
+async def post_shutdown(application: Application):
+    servidor = application.bot_data.get("servidor_metriques")
+    if servidor is not None:
+        servidor.close()
+        await servidor.wait_closed()
+
+    # Les apostes que quedin pendents en aturar el bot s'escriuen ara (i, si no, són al diari)
+    await executar(buidar_apostes)
+    await executar(escriure_noms_pendents)
+    logger.info("Cache de participants: %s", estadistiques_participants())
+    tancar_bd()
+
+# Inicialitza l'aplicació amb el Token API. Les actualitzacions d'usuaris
+# diferents es processen en paral·lel; les d'un mateix usuari, en ordre
+constructor = (
+    Application.builder()
+    .token(TOKEN_API)
+    .concurrent_updates(ProcessadorPerUsuari(ACTUALITZACIONS_CONCURRENTS))
+    .post_init(post_init)
+    .post_shutdown(post_shutdown)
+)
+# Els missatges que envia el bot fan cua per no passar dels límits de Telegram
+# (30 per segon en total i 20 per minut a cada grup) i, si Telegram respon amb
+# un 429, s'esperen i es tornen a enviar. Necessita python-telegram-bot[rate-limiter].
+if LIMITS["cua_enviaments"]:
+    if importlib.util.find_spec("aiolimiter") is None:
+        logger.warning("Falta python-telegram-bot[rate-limiter]: els missatges s'enviaran sense cua.")
+    else:
+        constructor.rate_limiter(AIORateLimiter(max_retries=LIMITS["reintents"]))
+# La conversa de /nova a mitges (i el seu user_data) sobreviu als reinicis
+if PERSISTENCIA["actiu"]:
+    constructor.persistence(PersistenciaDiari(PERSISTENCIA["diari"], PERSISTENCIA["interval"], PERSISTENCIA["sincronitzar"]))
+application = constructor.build()
 
 def validar_data(data):
     try:
@@ -19,38 +111,285 @@ def validar_data(data):
 def escapar_html(input_text):
     return html.escape(input_text)
 
+def dividir_missatge(linies, limit=LIMIT_MISSATGE):
+    """Agrupa les línies en missatges que no superin el límit de Telegram."""
+    missatges = []
+    actual = []
+    mida = 0
+    for linia in linies:
+        # Una línia sola més llarga que el límit es talla a trossos
+        while len(linia) > limit:
+            tros, linia = linia[:limit], linia[limit:]
+            if actual:
+                missatges.append("\n".join(actual))
+                actual, mida = [], 0
+            missatges.append(tros)
+        if actual and mida + 1 + len(linia) > limit:
+            missatges.append("\n".join(actual))
+            actual, mida = [], 0
+        mida += len(linia) + (1 if actual else 0)
+        actual.append(linia)
+    if actual:
+        missatges.append("\n".join(actual))
+    return missatges
+
 def verificar_grup(func):
+    @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.message.chat.id
-        if chat_id != GRUP_AUTORITZAT:
-            await update.message.reply_text("Aquest bot només està configurat per funcionar en un grup específic.")
+        if chat_id not in GRUPS_AUTORITZATS:
+            await update.message.reply_text("Aquest bot només està configurat per funcionar en uns grups específics.")
             return
         return await func(update, context)
     return wrapper
 
+limits = Limitador(LIMITS["comandes_usuari"], LIMITS["per_minut_usuari"], LIMITS["consultes_xat"], LIMITS["per_minut_xat"])
+agrupador = Agrupador(LIMITS["finestra_repetides"])
+
+async def limitar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """S'executa abans que qualsevol handler i atura les comandes de qui n'envia massa."""
+    usuari = update.effective_user
+    if usuari is None or usuari.id in USUARIS_AUTORITZATS:
+        return
+
+    nom, _ = comanda(update.effective_message.text)
+    limitada = limits.comprovar(usuari.id, update.effective_chat.id, nom in COMANDES_CONSULTA)
+    if limitada is None:
+        return
+
+    ambit, espera, avisar = limitada
+    metriques.incrementar("porra_comandes_descartades_total", motiu=ambit)
+    if avisar:
+        if ambit == "usuari":
+            text = f"⏳ Massa comandes seguides. Torna-ho a provar d'aquí a {espera} segons."
+        else:
+            text = f"⏳ Massa consultes en aquest xat. Mireu les respostes d'abans o torneu-ho a provar d'aquí a {espera} segons."
+        await update.effective_message.reply_text(text)
+    raise ApplicationHandlerStop
+
+if LIMITS["actiu"]:
+    application.add_handler(MessageHandler(filters.COMMAND, limitar), group=-1)
+
+def agrupar(versio, personal=None):
+    """No torna a respondre una consulta idèntica a una que s'acaba de respondre al mateix xat.
+
+    `versio(xat_id)` canvia quan canvien les dades de la resposta. Si
+    `personal(context)`, la resposta depèn de qui pregunta i només s'agrupen
+    les consultes del mateix usuari.
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            chat_id = update.effective_chat.id
+            clau = (chat_id, comanda(update.message.text))
+            if personal is not None and personal(context):
+                clau += (update.effective_user.id,)
+            actual = versio(chat_id)
+            await agrupador.esperar(clau)
+            if agrupador.repetida(clau, actual):
+                metriques.incrementar("porra_comandes_descartades_total", motiu="repetida")
+                return
+            with agrupador.responent(clau):
+                await func(update, context)
+                agrupador.respost(clau, actual)
+        return wrapper
+    return decorador
+
+def descriure_partit(partit):
+    return f"{partit['id']}: {escapar_html(partit['nom_contrincant'])} ({partit['data_hora']:%d-%m-%Y %H:%M})"
+
+def linies_porra(partit, apostes):
+    """Línies del missatge amb un partit i les seves apostes."""
+    linies = [
+        f"<b>Partit en marxa ({partit['id']}):</b>",
+        f"Rival: {escapar_html(partit['nom_contrincant'])}",
+        f"Data: {partit['data_hora']}",
+        f"Lloc: {'a casa' if partit['juga_a_casa'] == 1 else 'fora'}",
+        "",
+        "<b>Apostes:</b>",
+    ]
+    if apostes:
+        linies.extend(
+            f"- {escapar_html(aposta['nom_usuari'])}: {aposta['gols_local']} - {aposta['gols_visitant']}"
+            for aposta in apostes
+        )
+    else:
+        linies.append("Encara no hi ha apostes registrades.")
+    return linies
+
+def nom_tancament(partit_id):
+    return f"tancament-{partit_id}"
+
+def programar_tancament(job_queue, partit):
+    """Programa el tancament de les apostes del partit a l'hora d'inici.
+
+    data_hora és hora local sense zona; astimezone() la fa explícita perquè el
+    JobQueue no la interpreti com a UTC. Si l'hora ja ha passat (un partit en
+    marxa quan el bot es reinicia), la feina s'executa de seguida: APScheduler
+    descarta les feines que arriben més d'un segon tard si no se li diu el
+    contrari (misfire_grace_time).
+    """
+    inici = partit["data_hora"].astimezone()
+    job_queue.run_once(
+        tancar_apostes_partit,
+        when=inici if inici > datetime.now().astimezone() else 0,
+        data={"grup_id": partit["grup_id"], "partit_id": partit["id"]},
+        name=nom_tancament(partit["id"]),
+        chat_id=partit["grup_id"],
+        job_kwargs={"misfire_grace_time": None},
+    )
+
+def treure_tancament(job_queue, partit_id):
+    for job in job_queue.get_jobs_by_name(nom_tancament(partit_id)):
+        job.schedule_removal()
+
+@instrumentar_handler
+async def tancar_apostes_partit(context: ContextTypes.DEFAULT_TYPE):
+    """Feina del JobQueue: tanca les apostes en començar el partit i publica la llista."""
+    grup_id = context.job.data["grup_id"]
+    partit_id = context.job.data["partit_id"]
+    if not await executar(tancar_apostes, grup_id, partit_id):
+        return
+
+    resultat = await executar(obtenir_porra_en_marxa, grup_id)
+    porra = next((porra for porra in resultat.get("partits", []) if porra["partit"]["id"] == partit_id), None)
+    if porra is None:
+        return
+
+    linies = ["⏱️ Comença el partit! Ja no s'accepten més apostes.", ""]
+    linies.extend(linies_porra(porra["partit"], porra["apostes"]))
+    for missatge in dividir_missatge(linies):
+        await context.bot.send_message(grup_id, missatge, parse_mode="HTML")
+
+async def finalitzar_partit(partit, gols_local, gols_visitant):
+    """Tanca la porra amb el resultat, puntua les apostes i retorna el missatge de la jornada."""
+    try:
+        ranquing = await executar(actualitzar_punts, partit["grup_id"], partit["id"], gols_local, gols_visitant)
+    except ErrorBD as err:
+        # La transacció s'ha desfet: el partit continua en marxa i es pot tornar a provar
+        logger.exception("No s'ha pogut finalitzar el partit %s", partit["id"])
+        return {"estat": 0, "missatge": f"Error al finalitzar la porra: {err}"}
+    if ranquing is None:
+        return {"estat": 0, "missatge": "Aquesta porra ja estava finalitzada."}
+
+    missatge = "🎉 <b>Classificació de la jornada:</b>\n"
+    for i, (nom_usuari, gols_local, gols_visitant, punts) in enumerate(ranquing, start=1):
+        missatge += f"{i}.- {nom_usuari} ({gols_local}-{gols_visitant}): {punts} punts\n"
+    return {"estat": 1, "missatge": missatge}
+
+@instrumentar_handler
+async def comprovar_resultats(context: ContextTypes.DEFAULT_TYPE):
+    """Feina del JobQueue: finalitza els partits començats que ja tenen resultat a la font."""
+    pendents = []
+    for grup_id in GRUPS_AUTORITZATS:
+        partits = await executar(obtenir_partits_en_marxa, grup_id)
+        pendents.extend(partit for partit in partits if partit["apostes_tancades"])
+    if not pendents:
+        return
+
+    try:
+        resultats = await asyncio.to_thread(context.job.data.obtenir)
+    except Exception:
+        logger.exception("No s'han pogut obtenir els resultats")
+        return
+
+    for partit in pendents:
+        if partit["id"] not in resultats:
+            continue
+        marcador = llegir_resultat(resultats[partit["id"]])
+        if marcador is None:
+            logger.warning("Resultat incorrecte per al partit %s: %r", partit["id"], resultats[partit["id"]])
+            continue
+
+        resultat = await finalitzar_partit(partit, *marcador)
+        if resultat["estat"] == 0:
+            # Si ha fallat, el partit continua en marxa i es torna a provar a la consulta següent
+            logger.warning("Partit %s: %s", partit["id"], resultat["missatge"])
+        else:
+            await context.bot.send_message(
+                partit["grup_id"],
+                f"🏁 Final: {escapar_html(partit['nom_contrincant'])} {marcador[0]}-{marcador[1]}\n\n{resultat['missatge']}",
+                parse_mode="HTML",
+            )
+
+@instrumentar_handler
+async def buidar_apostes_pendents(context: ContextTypes.DEFAULT_TYPE):
+    """Feina del JobQueue: escriu a la base de dades les apostes diferides pendents."""
+    try:
+        await executar(buidar_apostes)
+    except Exception:
+        # Les apostes continuen pendents (i al diari): es tornarà a provar
+        logger.exception("No s'han pogut escriure les apostes pendents")
+
+@instrumentar_handler
+async def escriure_noms(context: ContextTypes.DEFAULT_TYPE):
+    """Feina del JobQueue: escriu a la base de dades els noms d'usuari que han canviat."""
+    try:
+        await executar(escriure_noms_pendents)
+    except Exception:
+        logger.exception("No s'han pogut escriure els noms d'usuari nous")
+
+def programar_feines(job_queue, partits):
+    """Torna a programar els tancaments pendents dels partits en marxa i la consulta de resultats."""
+    for partit in partits:
+        if not partit["apostes_tancades"]:
+            programar_tancament(job_queue, partit)
+
+    font = crear_font(RESULTATS)
+    if font is not None:
+        job_queue.run_repeating(comprovar_resultats, interval=RESULTATS["interval"], first=RESULTATS["interval"], data=font)
+
+    job_queue.run_repeating(escriure_noms, interval=INTERVAL_NOMS, first=INTERVAL_NOMS, name="escriure_noms")
+
+    if apostes_diferides():
+        interval = APOSTES_DIFERIDES["interval_ms"] / 1000
+        job_queue.run_repeating(buidar_apostes_pendents, interval=interval, first=interval, name="buidar_apostes")
+
+async def triar_partit(update: Update, context: ContextTypes.DEFAULT_TYPE, comanda, num_arguments, sense_partit):
+    """Tria a quin partit en marxa del xat es refereix la comanda.
+
+    Si la comanda porta un argument de més i el primer és un número, és l'id
+    del partit ('/apostar 12 3-1'). Si no, només es pot ometre quan el xat té
+    un sol partit en marxa. Retorna (partit, arguments restants), o
+    (None, None) si ja s'ha respost a l'usuari.
+    """
+    partits = await executar(obtenir_partits_en_marxa, update.effective_chat.id)
+    if not partits:
+        await update.message.reply_text(sense_partit)
+        return None, None
+
+    args = list(context.args)
+    if len(args) > num_arguments and args[0].isdigit():
+        partit = next((partit for partit in partits if partit["id"] == int(args[0])), None)
+        if partit:
+            return partit, args[1:]
+        await update.message.reply_text(f"No hi ha cap porra en marxa amb el número {args[0]}.")
+        return None, None
+
+    if len(partits) == 1:
+        return partits[0], args
+
+    linies = [f"Hi ha diverses porres en marxa. Indica el número del partit: '/{comanda} N ...'"]
+    linies.extend(f"- {descriure_partit(partit)}" for partit in partits)
+    await update.message.reply_text("\n".join(linies), parse_mode="HTML")
+    return None, None
+
+@instrumentar_handler
 @verificar_grup
 async def nova(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from database import existeix_porra_en_marxa  # Importa el control
-
     # Comprova si l'usuari està autoritzat
     if update.effective_user.id not in USUARIS_AUTORITZATS:
         await update.message.reply_text("No tens permisos per iniciar una porra.")
         return ConversationHandler.END
 
-    # Comprova si hi ha una porra en marxa
-    if existeix_porra_en_marxa():
-        await update.message.reply_text(
-            "Hi ha una porra en marxa! No pots crear-ne una altra fins que s'hagi finalitzat."
-        )
-        return ConversationHandler.END
-
-    # Si no hi ha cap porra en marxa, inicia el procés de creació de la porra
+    # Inicia el procés de creació de la porra
     await update.message.reply_text(
         "Amb quin equip juga el Barça?\n\n"
         "Escriu '/cancelar' en qualsevol moment per aturar el procés."
     )
     return ESPERANT_RIVAL
 
+@instrumentar_handler
 async def obtenir_rival(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Gestiona la resposta del rival."""
     context.user_data["rival"] = update.message.text
@@ -61,6 +400,7 @@ async def obtenir_rival(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ESPERANT_LOCAL_FORA
 
+@instrumentar_handler
 async def obtenir_juga_a_casa(update: Update, context: ContextTypes.DEFAULT_TYPE):
     resposta = update.message.text.lower()
     if resposta in ["casa", "fora"]:
@@ -74,6 +414,7 @@ async def obtenir_juga_a_casa(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Si us plau, respon només amb 'casa' o 'fora'.")
         return ESPERANT_LOCAL_FORA
 
+@instrumentar_handler
 async def obtenir_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Gestiona la resposta de la data."""
     data_partit = update.message.text
@@ -85,16 +426,26 @@ async def obtenir_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Format de data incorrecte! Si us plau, utilitza el format 'dd-mm-aaaa hh:mm'. Exemple: 24-03-2025 18:30."
         )
         return ESPERANT_DATA
+    if data_valida <= datetime.now():
+        await update.message.reply_text("Aquesta hora ja ha passat! Indica quan comença el partit (dd-mm-aaaa hh:mm).")
+        return ESPERANT_DATA
     context.user_data["data"] = data_valida.strftime("%d-%m-%Y %H:%M")
 
     # Registra el partit a la base de dades
-    from database import registrar_partit
-    resultat = registrar_partit(context.user_data, update)
+    resultat = await executar(registrar_partit, dict(context.user_data), update.effective_chat.id)
 
     if resultat["estat"] == 0:
+        context.user_data.clear()
         await update.message.reply_text(resultat["missatge"])
         return ConversationHandler.END
 
+    # Les apostes es tanquen soles a l'hora del partit
+    programar_tancament(context.job_queue, {
+        "id": resultat["partit_id"],
+        "grup_id": update.effective_chat.id,
+        "data_hora": data_valida,
+    })
+
     await update.message.reply_text(
         f"{resultat['missatge']}\n"
         f"Equip rival: {escapar_html(context.user_data['rival'])}\n"
@@ -102,12 +453,15 @@ async def obtenir_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Gràcies per utilitzar el bot!"
     )
 
-    # Finalitza el procés
+    # Finalitza el procés (i no cal recordar-ne les dades)
+    context.user_data.clear()
     return ConversationHandler.END
 
+@instrumentar_handler
 @verificar_grup
 async def cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel·la el procés en qualsevol moment."""
+    context.user_data.clear()
     await update.message.reply_text("Procés cancel·lat. Pots tornar a començar amb /nova.")
     return ConversationHandler.END
 
@@ -119,58 +473,61 @@ conversation_handler = ConversationHandler(
         ESPERANT_DATA: [MessageHandler(filters.TEXT & ~filters.COMMAND, obtenir_data)],
     },
     fallbacks=[CommandHandler("cancelar", cancelar)],
+    name="nova",
+    persistent=PERSISTENCIA["actiu"],
 )
 application.add_handler(conversation_handler)
 
+@instrumentar_handler
 @verificar_grup
 async def apostar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from datetime import datetime
-    from database import obtenir_participant, obtenir_partit_en_marxa, registrar_aposta
-
     # Comprova si l'usuari envia una comanda en un grup
     # if update.message.chat.type not in ["group", "supergroup"]:
     #     await update.message.reply_text("Aquest bot només accepta apostes des del grup.")
 
-    # Comprova si hi ha un partit en marxa
-    partit = obtenir_partit_en_marxa()
+    # Comprova si hi ha un partit en marxa i tria a quin s'aposta
+    partit, args = await triar_partit(update, context, "apostar", 1, "Actualment no hi ha cap porra en marxa.")
     if not partit:
-        await update.message.reply_text("Actualment no hi ha cap porra en marxa.")
         return
 
-    if len(context.args) == 0:
+    if len(args) == 0:
         missatge = (
             "No has proporcionat cap aposta. Usa '/apostar X-Y' (Exemple: '/apostar 3-1') per participar.\n\n"
-            f"<b>Partit en marxa:</b>\n"
-            f"Rival: {partit['nom_contrincant']}\n"
+            f"<b>Partit en marxa ({partit['id']}):</b>\n"
+            f"Rival: {escapar_html(partit['nom_contrincant'])}\n"
             f"Data: {partit['data_hora']}\n"
             f"Lloc: {'a casa' if partit['juga_a_casa'] == 1 else 'fora'}\n"
         )
         await update.message.reply_text(missatge, parse_mode="HTML")
         return
 
-    # Registra automàticament l'usuari si no existeix
-    telegram_id = update.effective_user.id
-    nom_usuari = update.effective_user.username or update.effective_user.full_name
-    participant_id = obtenir_participant(telegram_id, nom_usuari)
-
-    # Comprova si l'hora del partit ja ha passat
-    if partit["data_hora"] < datetime.now():
+    # Les apostes es tanquen a l'hora del partit (tancar_apostes_partit). L'hora
+    # també es comprova aquí: la feina pot arribar uns instants tard
+    if partit["apostes_tancades"] or partit["data_hora"] <= datetime.now():
         await update.message.reply_text("Ja ha passat l'hora del partit. No pots fer apostes.")
         return
 
     # Comprova si el format de l'aposta és correcte
-    if len(context.args) != 1 or "-" not in context.args[0]:
+    if len(args) != 1 or "-" not in args[0]:
         await update.message.reply_text("El format de l'aposta és incorrecte. Usa '/apostar X-Y' (Exemple: '/apostar 3-1').")
         return
 
     try:
-        gols_local, gols_visitant = map(int, context.args[0].split("-"))
+        gols_local, gols_visitant = map(int, args[0].split("-"))
     except ValueError:
         await update.message.reply_text("El format de l'aposta és incorrecte. Els gols han de ser números enters.")
         return
 
-    # Registra l'aposta a la base de dades
-    resultat = registrar_aposta(partit["id"], participant_id, gols_local, gols_visitant)
+    telegram_id = update.effective_user.id
+    nom_usuari = update.effective_user.username or update.effective_user.full_name
+    if apostes_diferides():
+        # Es confirma en desar-la al diari; fora del pool de la base de dades, que pot anar carregat
+        resultat = await asyncio.to_thread(registrar_aposta_diferida, partit["grup_id"], partit["id"], telegram_id, nom_usuari, gols_local, gols_visitant)
+        if resultat.get("pendents", 0) >= APOSTES_DIFERIDES["max_apostes"]:
+            context.application.create_task(executar(buidar_apostes))
+    else:
+        # Registra l'usuari (si no existeix) i l'aposta en una sola transacció
+        resultat = await executar(registrar_aposta_participant, partit["grup_id"], partit["id"], telegram_id, nom_usuari, gols_local, gols_visitant)
     if resultat["estat"] == 0:
         await update.message.reply_text(resultat["missatge"])
     else:
@@ -178,118 +535,355 @@ async def apostar(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 application.add_handler(CommandHandler("apostar", apostar))
 
+# Missatges de /consultar ja generats per xat i la versió de les apostes amb què es van fer
+missatges_consulta = {}
+
+@instrumentar_handler
+@verificar_grup
+@agrupar(versio_apostes)
 async def consultar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from database import obtenir_porra_en_marxa
     # from telegram.helpers import escape_markdown
 
-    # Obtenim la informació de la porra en marxa
-    resultat = obtenir_porra_en_marxa()
-
-    if resultat["estat"] == 0:
-        await update.message.reply_text(resultat["missatge"])
-        return
+    # Si cap aposta del xat ha canviat, reenviem els missatges que ja tenim
+    chat_id = update.effective_chat.id
+    versio = versio_apostes(chat_id)
+    en_cache = missatges_consulta.get(chat_id)
+    vigent = en_cache is not None and en_cache["versio"] == versio
+    metriques.incrementar("porra_cache_total", cache="consulta", resultat="encert" if vigent else "errada")
+    if not vigent:
+        # Obtenim la informació de les porres en marxa
+        resultat = await executar(obtenir_porra_en_marxa, chat_id)
+
+        if resultat["estat"] == 0:
+            await update.message.reply_text(resultat["missatge"])
+            return
 
-    partit = resultat["partit"]
-    apostes = resultat["apostes"]
+        linies = []
+        for porra in resultat["partits"]:
+            partit = porra["partit"]
+            apostes = porra["apostes"]
 
-    missatge = f"<b>Partit en marxa:</b>\nRival: {partit['nom_contrincant']}\nData: {partit['data_hora']}\n"
-    missatge += f"Lloc: {'a casa' if partit['juga_a_casa'] == 1 else 'fora'}\n\n"
-    missatge += "<b>Apostes:</b>\n"
+            if linies:
+                linies.append("")
+            linies.extend(linies_porra(partit, apostes))
 
-    if apostes:
-        for aposta in apostes:
-            missatge += f"- {aposta['nom_usuari']}: {aposta['gols_local']} - {aposta['gols_visitant']}\n"
-    else:
-        missatge += "Encara no hi ha apostes registrades."
+        en_cache = missatges_consulta[chat_id] = {"versio": versio, "missatges": dividir_missatge(linies)}
 
-    await update.message.reply_text(missatge, parse_mode="HTML")
+    for missatge in en_cache["missatges"]:
+        await update.message.reply_text(missatge, parse_mode="HTML")
 
 application.add_handler(CommandHandler("consultar", consultar))
 
+@instrumentar_handler
 @verificar_grup
 async def finalitzar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from database import obtenir_partit_en_marxa, tancar_porra, actualitzar_punts
-
     # Comprova si l'usuari està autoritzat
     if update.effective_user.id not in USUARIS_AUTORITZATS:
         await update.message.reply_text("No tens permisos per finalitzar un partit.")
         return
 
-    # Comprova si hi ha una porra en marxa
-    partit = obtenir_partit_en_marxa()
+    # Comprova si hi ha una porra en marxa i quina es tanca
+    partit, args = await triar_partit(update, context, "finalitzar", 1, "No hi ha cap porra activa per tancar.")
     if not partit:
-        await update.message.reply_text("No hi ha cap porra activa per tancar.")
         return
 
     # Comprova si s'ha passat el resultat
-    if len(context.args) != 1 or "-" not in context.args[0]:
+    if len(args) != 1 or "-" not in args[0]:
         await update.message.reply_text("Format de resultat incorrecte. Usa '/finalitzar X-Y' (Exemple: '/finalitzar 3-1').")
         return
 
     # Valida el resultat
-    try:
-        gols_local, gols_visitant = map(int, context.args[0].split("-"))
-    except ValueError:
+    marcador = llegir_resultat(args[0])
+    if marcador is None:
         await update.message.reply_text("El resultat ha de contenir números enters. Usa '/finalitzar X-Y' (Exemple: '/finalitzar 3-1').")
         return
 
-    # Tanca la porra amb el resultat
-    resultat = tancar_porra(partit["id"], f"{gols_local}-{gols_visitant}")
+    # Tanca la porra amb el resultat i mostrem el rànquing
+    treure_tancament(context.job_queue, partit["id"])
+    resultat = await finalitzar_partit(partit, *marcador)
     if resultat["estat"] == 0:
+        # Si no s'ha pogut puntuar, el partit continua en marxa i les apostes s'han de tancar igualment
+        if not partit["apostes_tancades"]:
+            programar_tancament(context.job_queue, partit)
         await update.message.reply_text(resultat["missatge"])
         return
 
-    ranquing = actualitzar_punts(partit["id"], gols_local, gols_visitant)
-
-    # Mostrem el rànquing
-    missatge = "🎉 <b>Classificació de la jornada:</b>\n"
-    for i, (nom_usuari, gols_local, gols_visitant, punts) in enumerate(ranquing, start=1):
-        missatge += f"{i}.- {nom_usuari} ({gols_local}-{gols_visitant}): {punts} punts\n"
-
-    await update.message.reply_text(missatge, parse_mode="HTML")
+    await update.message.reply_text(resultat["missatge"], parse_mode="HTML")
 
 application.add_handler(CommandHandler("finalitzar", finalitzar))
 
+@instrumentar_handler
 @verificar_grup
 async def anular(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from database import anular_partit, obtenir_partit_en_marxa
-
     # Comprova si l'usuari està autoritzat
     if update.effective_user.id not in USUARIS_AUTORITZATS:
         await update.message.reply_text("No tens permisos per anul·lar un partit.")
         return
 
-    # Comprova si hi ha un partit en marxa
-    partit = obtenir_partit_en_marxa()
+    # Comprova si hi ha un partit en marxa i quin s'anul·la
+    partit, args = await triar_partit(update, context, "anular", 0, "Actualment no hi ha cap porra en marxa.")
     if not partit:
-        await update.message.reply_text("Actualment no hi ha cap porra en marxa.")
         return
 
-    resultat = anular_partit(partit_id)
+    resultat = await executar(anular_partit, partit["grup_id"], partit["id"])
+    if resultat["estat"] == 1:
+        treure_tancament(context.job_queue, partit["id"])
 
     await update.message.reply_text(resultat["missatge"])
 
 application.add_handler(CommandHandler("anular", anular))
 
+# Missatges de classificació ja generats: (xat, pàgina) -> (versió de la classificació, missatge)
+missatges_classificacio = {}
+
+@instrumentar_handler
+@verificar_grup
+@agrupar(versio_classificacio, personal=lambda context: bool(context.args) and context.args[0].lower() == "jo")
 async def classificacio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from database import obtenir_classificacio
+    # '/classificacio jo' mostra només la posició de qui ho demana
+    if context.args and context.args[0].lower() == "jo":
+        posicio = await executar(obtenir_posicio_classificacio, update.effective_chat.id, update.effective_user.id)
+        if not posicio:
+            await update.message.reply_text("Encara no apareixes a la classificació. Participa amb '/apostar X-Y'!")
+        else:
+            await update.message.reply_text(f"{posicio[0]}.- {posicio[1]}: {posicio[2]} punts")
+        return
 
-    # Obtenim la classificació
-    classificacio = obtenir_classificacio()
+    try:
+        pagina = int(context.args[0]) if context.args else 1
+    except ValueError:
+        pagina = 0
+    if pagina < 1:
+        await update.message.reply_text("Usa '/classificacio', '/classificacio N' (pàgina N) o '/classificacio jo'.")
+        return
+
+    # Obtenim la pàgina de la classificació
+    dades = await executar(obtenir_pagina_classificacio, update.effective_chat.id, pagina, MIDA_PAGINA_CLASSIFICACIO)
 
-    if not classificacio:
+    if not dades["total"]:
         await update.message.reply_text("Encara no hi ha cap participant registrat ni punts acumulats.")
         return
 
-    # Generem el missatge de classificació
-    missatge = "🏆 <b>Classificació del grup:</b>\n"
-    for i, participant in enumerate(classificacio, start=1):
-        missatge += f"{i}.- {participant['nom_usuari']}: {participant['punts']} punts\n"
+    pagines = -(-dades["total"] // MIDA_PAGINA_CLASSIFICACIO)
+    if not dades["files"]:
+        await update.message.reply_text(f"La classificació només té {pagines} pàgines.")
+        return
+
+    # Reutilitzem el missatge si la classificació no ha canviat des de l'última vegada
+    en_cache = missatges_classificacio.get((update.effective_chat.id, pagina))
+    vigent = en_cache is not None and en_cache[0] == dades["versio"]
+    metriques.incrementar("porra_cache_total", cache="classificacio", resultat="encert" if vigent else "errada")
+    if vigent:
+        missatge = en_cache[1]
+    else:
+        linies = [f"🏆 <b>Classificació de la temporada {escapar_html(dades['temporada'])}:</b>"]
+        linies.extend(
+            f"{posicio}.- {escapar_html(nom_usuari)}: {punts} punts"
+            for posicio, nom_usuari, punts in dades["files"]
+        )
+        if pagines > 1:
+            linies.append(f"\nPàgina {pagina} de {pagines}. Usa '/classificacio N' per veure'n una altra.")
+        missatge = "\n".join(linies) + "\n"
+        missatges_classificacio[(update.effective_chat.id, pagina)] = (dades["versio"], missatge)
 
     # Enviem el missatge
     await update.message.reply_text(missatge, parse_mode="HTML") # , parse_mode="Markdown"
 
 application.add_handler(CommandHandler("classificacio", classificacio))
+
+@instrumentar_handler
+@verificar_grup
+async def temporada(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Temporades del grup; '/temporada N' en mostra la classificació final i
+    '/temporada nova COMPETICIÓ NOM' tanca la temporada en curs i n'obre una de nova."""
+    chat_id = update.effective_chat.id
+    args = context.args
+
+    if args and args[0].lower() == "nova":
+        if update.effective_user.id not in USUARIS_AUTORITZATS:
+            await update.message.reply_text("No tens permisos per començar una temporada nova.")
+            return
+        if len(args) < 3:
+            await update.message.reply_text("Usa '/temporada nova COMPETICIÓ NOM' (Exemple: '/temporada nova Lliga 2025-26').")
+            return
+        nom = " ".join(args[2:])
+        if len(args[1]) > 100 or len(nom) > 100:
+            await update.message.reply_text("El nom de la competició i el de la temporada han de tenir com a màxim 100 caràcters.")
+            return
+        resultat = await executar(nova_temporada, chat_id, args[1], nom)
+        await update.message.reply_text(resultat["missatge"])
+        return
+
+    if args and args[0].isdigit():
+        dades = await executar(obtenir_classificacio_temporada, chat_id, int(args[0]), MIDA_PAGINA_CLASSIFICACIO)
+        if dades is None:
+            await update.message.reply_text(f"Aquest grup no té cap temporada amb el número {args[0]}.")
+            return
+        linies = [f"🏆 <b>Classificació de la temporada {escapar_html(dades['temporada'])}:</b>"]
+        linies.extend(
+            f"{posicio}.- {escapar_html(fila['nom_usuari'])}: {fila['punts']} punts"
+            for posicio, fila in enumerate(dades["files"], start=1)
+        )
+        if not dades["files"]:
+            linies.append("Ningú no va puntuar en aquesta temporada.")
+        await update.message.reply_text("\n".join(linies), parse_mode="HTML")
+        return
+
+    temporades = await executar(obtenir_temporades, chat_id)
+    linies = ["📅 <b>Temporades del grup:</b>"]
+    for t in temporades:
+        periode = f"{t['inici']:%d-%m-%Y} - {t['fi']:%d-%m-%Y}" if t["tancada"] else f"des del {t['inici']:%d-%m-%Y}, en curs"
+        linies.append(f"{t['id']}: {escapar_html(t['nom'])} ({escapar_html(t['competicio'])}), {periode}")
+    actual = await executar(temporada_actual, chat_id)
+    linies.append("")
+    if actual is None:
+        linies.append("El grup encara no té cap temporada: la primera s'obre en crear una porra amb /nova.")
+    else:
+        linies.append(f"Puntuació de la temporada en curs: {regles.descriure(actual['regles'])}.")
+    linies.append("Usa '/temporada N' per veure la classificació final de la temporada N.")
+    for missatge in dividir_missatge(linies):
+        await update.message.reply_text(missatge, parse_mode="HTML")
+
+application.add_handler(CommandHandler("temporada", temporada))
+
+@instrumentar_handler
+@verificar_grup
+async def simular(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mostra com quedaria la classificació si el partit en marxa acabés amb el resultat indicat."""
+    partit, args = await triar_partit(update, context, "simular", 1, "No hi ha cap partit en marxa per simular.")
+    if not partit:
+        return
+
+    marcador = llegir_resultat(args[0]) if len(args) == 1 else None
+    if marcador is None:
+        await update.message.reply_text("Usa '/simular X-Y' (Exemple: '/simular 2-1') per veure com quedaria la classificació amb aquest resultat.")
+        return
+
+    files = await executar(simular_resultat, partit["grup_id"], partit["id"], *marcador)
+    if not files:
+        await update.message.reply_text("Encara no hi ha apostes ni punts per simular.")
+        return
+
+    def linia(fila):
+        if fila["canvi"] is None:
+            moviment = " 🆕"
+        elif fila["canvi"]:
+            moviment = f" {'⬆️' if fila['canvi'] > 0 else '⬇️'}{abs(fila['canvi'])}"
+        else:
+            moviment = ""
+        return f"{fila['posicio']}.- {escapar_html(fila['nom_usuari'])}: {fila['punts']} punts ({fila['punts_partit']:+d}){moviment}"
+
+    linies = [f"🔮 <b>Si acabés {escapar_html(partit['nom_contrincant'])} {marcador[0]}-{marcador[1]}:</b>"]
+    linies.extend(linia(fila) for fila in files[:MIDA_PAGINA_CLASSIFICACIO])
+    jo = next((fila for fila in files if fila["telegram_id"] == update.effective_user.id), None)
+    if jo is not None and jo["posicio"] > MIDA_PAGINA_CLASSIFICACIO:
+        linies.append("...")
+        linies.append(linia(jo))
+    await update.message.reply_text("\n".join(linies), parse_mode="HTML")
+
+application.add_handler(CommandHandler("simular", simular))
+
+def per_partit(punts, partits):
+    return f"{punts / partits:.2f}" if partits else "-"
+
+@instrumentar_handler
+@verificar_grup
+async def estadistiques(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Estadístiques de qui ho demana; amb un nom d'usuari, també el cara a cara."""
+    chat_id = update.effective_chat.id
+    telegram_id = update.effective_user.id
+    e = await executar(obtenir_estadistiques, chat_id, telegram_id)
+    if e is None:
+        await update.message.reply_text("Encara no tens cap partit puntuat en aquest grup. Participa amb '/apostar X-Y'!")
+        return
+
+    partits_fora = e["partits"] - e["partits_casa"]
+    linies = [
+        f"📈 <b>Estadístiques de {escapar_html(e['nom_usuari'])}</b>",
+        f"Partits: {e['partits']} · Punts: {e['punts']} ({per_partit(e['punts'], e['partits'])} per partit)",
+        f"Resultats exactes: {e['exactes']} ({e['exactes'] / e['partits']:.0%})",
+        f"A casa: {per_partit(e['punts_casa'], e['partits_casa'])} punts per partit ({e['partits_casa']} partits, {e['exactes_casa']} exactes)",
+        f"A fora: {per_partit(e['punts'] - e['punts_casa'], partits_fora)} punts per partit"
+        f" ({partits_fora} partits, {e['exactes'] - e['exactes_casa']} exactes)",
+        f"Ratxa actual: {e['ratxa_actual']} partits seguits puntuant (la millor: {e['ratxa_maxima']})",
+    ]
+    if e["millor_jornada"] and e["millor_rival"]:
+        linies.append(
+            f"Millor jornada: {e['millor_jornada']} punts ({escapar_html(e['millor_rival'])}, {e['millor_data']:%d-%m-%Y})"
+        )
+
+    if context.args:
+        nom_rival = context.args[0].lstrip("@")
+        cara_a_cara = await executar(obtenir_cara_a_cara, chat_id, telegram_id, nom_rival)
+        linies.append("")
+        if cara_a_cara is None:
+            linies.append(f"No hi ha cap participant que es digui {escapar_html(nom_rival)}.")
+        elif cara_a_cara.get("ambigu"):
+            linies.append(f"Hi ha més d'un participant que es diu {escapar_html(nom_rival)}: no sé amb quin comparar-te.")
+        elif not cara_a_cara["partits"]:
+            linies.append(f"Encara no has coincidit amb {escapar_html(cara_a_cara['rival'])} en cap partit puntuat.")
+        else:
+            linies.append(
+                f"<b>Cara a cara amb {escapar_html(cara_a_cara['rival'])}</b> ({cara_a_cara['partits']} partits): "
+                f"{cara_a_cara['guanyades']} guanyats, {cara_a_cara['empatades']} empatats, {cara_a_cara['perdudes']} perduts"
+            )
+
+    await update.message.reply_text("\n".join(linies), parse_mode="HTML")
+
+application.add_handler(CommandHandler("estadistiques", estadistiques))
+
+@instrumentar_handler
+@verificar_grup
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Resum de les mètriques del bot per als administradors."""
+    if update.effective_user.id not in USUARIS_AUTORITZATS:
+        await update.message.reply_text("No tens permisos per veure les estadístiques del bot.")
+        return
+
+    segons = int(time.time() - metriques.INICI)
+    linies = [f"📊 <b>Estadístiques del bot</b> (en marxa fa {segons // 3600} h {segons % 3600 // 60} min)", ""]
+
+    linies.append("<b>Handlers</b> (crides, mitjana, p99):")
+    for nom, estat in sorted(metriques.histogrames("porra_handler_segons").items()):
+        linies.append(
+            f"- {nom}: {estat['total']}, {estat['suma'] / estat['total'] * 1000:.1f} ms,"
+            f" ≤{metriques.percentil(estat, 0.99) * 1000:g} ms"
+        )
+
+    linies.append("")
+    linies.append("<b>Base de dades</b> (les 5 funcions amb més temps total):")
+    funcions = sorted(metriques.histogrames("porra_bd_funcio_segons").items(), key=lambda f: -f[1]["suma"])
+    for nom, estat in funcions[:5]:
+        linies.append(f"- {nom}: {estat['total']} crides, {estat['suma']:.2f} s")
+    connexions = sum(metriques.valors("porra_bd_connexions_total").values())
+    lentes = sum(metriques.valors("porra_bd_consultes_lentes_total").values())
+    linies.append(f"Connexions: {connexions}. Consultes lentes: {lentes}.")
+
+    descartades = {dict(clau)["motiu"]: valor for clau, valor in metriques.valors("porra_comandes_descartades_total").items()}
+    if descartades:
+        linies.append("")
+        linies.append(
+            f"<b>Comandes descartades:</b> {descartades.get('usuari', 0)} per usuari, {descartades.get('xat', 0)} per xat,"
+            f" {descartades.get('repetida', 0)} repetides ({len(limits)} usuaris i xats amb límit)."
+        )
+
+    linies.append("")
+    linies.append("<b>Caches</b> (encerts):")
+    caches = {}
+    for clau, valor in metriques.valors("porra_cache_total").items():
+        etiquetes = dict(clau)
+        caches.setdefault(etiquetes["cache"], {"encert": 0, "errada": 0})[etiquetes["resultat"]] += valor
+    participants = estadistiques_participants()
+    caches["participants"] = {"encert": participants["encerts"], "errada": participants["errades"]}
+    for nom, valors in sorted(caches.items()):
+        total = valors["encert"] + valors["errada"]
+        if total:
+            linies.append(f"- {nom}: {valors['encert'] / total:.0%} de {total}")
+
+    for missatge in dividir_missatge(linies):
+        await update.message.reply_text(missatge, parse_mode="HTML")
+
+application.add_handler(CommandHandler("stats", stats))
 """
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat.id
@@ -307,7 +901,77 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 """
+async def servir_webhook_local():
+    """Serveix l'endpoint del webhook sense registrar cap URL a Telegram.
+
+    run_webhook sempre crida setWebhook: sense `url`, en registra una de feta
+    amb escoltar, port i ruta (http://127.0.0.1:8443/porra), que Telegram
+    rebutja. Aquí el servidor HTTP només rep les actualitzacions que li
+    arriben (per exemple, les d'eines/reproduir_updates.py) i les posa a la
+    cua de l'aplicació, amb el mateix cicle de vida que run_webhook.
+    """
+    import tornado.web
+
+    class Endpoint(tornado.web.RequestHandler):
+        async def post(self):
+            secret_token = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+            if WEBHOOK["secret_token"] and secret_token != WEBHOOK["secret_token"]:
+                raise tornado.web.HTTPError(403)
+            try:
+                update = Update.de_json(json.loads(self.request.body), application.bot)
+            except ValueError:
+                raise tornado.web.HTTPError(400)
+            await application.update_queue.put(update)
+
+    aturar = asyncio.Event()
+    bucle = asyncio.get_running_loop()
+    for senyal in (signal.SIGINT, signal.SIGTERM):
+        bucle.add_signal_handler(senyal, aturar.set)
+
+    await application.initialize()
+    try:
+        await application.post_init(application)
+        await application.start()
+        ruta = "/" + WEBHOOK["ruta"].lstrip("/")
+        servidor = tornado.web.Application([(ruta, Endpoint)]).listen(WEBHOOK["port"], WEBHOOK["escoltar"])
+        try:
+            await aturar.wait()
+        finally:
+            servidor.stop()
+            await application.stop()
+    finally:
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+def executar_bot():
+    """Rep les actualitzacions per webhook si està configurat i, si no, per polling."""
+    if MODE == "webhook":
+        # El servidor del webhook necessita python-telegram-bot[webhooks] (tornado)
+        if importlib.util.find_spec("tornado") is None:
+            logger.warning(
+                "Falta python-telegram-bot[webhooks]: el bot farà servir polling."
+            )
+        elif WEBHOOK["url"] is None:
+            print("Bot en marxa (webhook local, sense registrar-lo a Telegram)!")
+            asyncio.run(servir_webhook_local())
+            return
+        else:
+            print("Bot en marxa (webhook)!")
+            application.run_webhook(
+                listen=WEBHOOK["escoltar"],
+                port=WEBHOOK["port"],
+                url_path=WEBHOOK["ruta"],
+                webhook_url=WEBHOOK["url"],
+                secret_token=WEBHOOK["secret_token"],
+                cert=WEBHOOK["certificat"],
+                key=WEBHOOK["clau"],
+            )
+            return
+
+    print("Bot en marxa (polling)!")
+    application.run_polling()
+
 # Executa el bot
 if __name__ == "__main__":
-    application.run_polling()
-    print("Bot en marxa!")
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    executar_bot()
@@ -0,0 +1,141 @@
+"""Classificacions mantingudes en memòria, una per grup.
+
+Cada classificació és la de la temporada en curs del grup. Es carrega una
+sola vegada de la taula punts_temporada i després s'actualitza de manera
+incremental quan es tanca un partit del grup, de manera que /classificacio
+no ha de tornar a ordenar tota la taula a cada consulta. Les entrades es guarden ordenades per (punts descendents, nom) com
+feia l'antic ORDER BY.
+"""
+import bisect
+import threading
+
+class Classificacio:
+    def __init__(self, files):
+        self.entrades = []       # Llista ordenada de claus (-punts, nom en minúscules, participant_id)
+        self.participants = {}   # participant_id -> {"nom_usuari", "telegram_id", "punts"}
+        self.per_telegram = {}   # telegram_id -> participant_id
+        self.versio = 0
+        for fila in files:
+            self.participants[fila["id"]] = {
+                "nom_usuari": fila["nom_usuari"],
+                "telegram_id": fila["telegram_id"],
+                "punts": fila["punts"],
+            }
+            self.per_telegram[fila["telegram_id"]] = fila["id"]
+        self.entrades.extend(sorted(self._clau(pid, dades) for pid, dades in self.participants.items()))
+
+    @staticmethod
+    def _clau(participant_id, dades):
+        return (-dades["punts"], dades["nom_usuari"].lower(), participant_id)
+
+    def _inserir(self, participant_id, dades):
+        self.participants[participant_id] = dades
+        self.per_telegram[dades["telegram_id"]] = participant_id
+        bisect.insort(self.entrades, self._clau(participant_id, dades))
+
+    def _treure(self, participant_id):
+        dades = self.participants.pop(participant_id)
+        del self.entrades[bisect.bisect_left(self.entrades, self._clau(participant_id, dades))]
+        return dades
+
+    def sumar_punts(self, apostes):
+        for participant_id, nom_usuari, telegram_id, punts in apostes:
+            if participant_id in self.participants:
+                dades = self._treure(participant_id)
+            else:
+                dades = {"nom_usuari": nom_usuari, "telegram_id": telegram_id, "punts": 0}
+            dades["punts"] += punts
+            self._inserir(participant_id, dades)
+
+    def canviar_nom(self, participant_id, nom_usuari):
+        if participant_id not in self.participants or self.participants[participant_id]["nom_usuari"] == nom_usuari:
+            return False
+        dades = self._treure(participant_id)
+        dades["nom_usuari"] = nom_usuari
+        self._inserir(participant_id, dades)
+        return True
+
+    def pagina(self, inici, mida):
+        return [
+            (posicio, self.participants[participant_id]["nom_usuari"], -punts_negatius)
+            for posicio, (punts_negatius, _, participant_id) in enumerate(
+                self.entrades[inici:inici + mida], start=inici + 1
+            )
+        ]
+
+    def posicio(self, telegram_id):
+        participant_id = self.per_telegram.get(telegram_id)
+        if participant_id is None:
+            return None
+        dades = self.participants[participant_id]
+        index = bisect.bisect_left(self.entrades, self._clau(participant_id, dades))
+        return (index + 1, dades["nom_usuari"], dades["punts"])
+
+_lock = threading.Lock()
+_grups = {}  # grup_id -> Classificacio
+_versions = {"seguent": 1}
+
+def _nova_versio():
+    # Comptador global: la versió d'un grup no es repeteix ni quan es recarrega
+    versio = _versions["seguent"]
+    _versions["seguent"] += 1
+    return versio
+
+def carregar(grup_id, files):
+    """Substitueix la classificació del grup per les files (id, nom_usuari, telegram_id, punts)."""
+    classificacio = Classificacio(files)
+    with _lock:
+        classificacio.versio = _nova_versio()
+        _grups[grup_id] = classificacio
+
+def carregat(grup_id):
+    return grup_id in _grups
+
+def versio(grup_id):
+    """Canvia cada vegada que canvia l'ordre o el contingut de la classificació del grup."""
+    with _lock:
+        classificacio = _grups.get(grup_id)
+        return classificacio.versio if classificacio else None
+
+def sumar_punts(grup_id, apostes):
+    """Suma punts al grup: iterable de (participant_id, nom_usuari, telegram_id, punts)."""
+    with _lock:
+        classificacio = _grups.get(grup_id)
+        if classificacio is not None:
+            classificacio.sumar_punts(apostes)
+            classificacio.versio = _nova_versio()
+
+def canviar_nom(participant_id, nom_usuari):
+    """Posa el nom nou del participant a totes les classificacions on apareix."""
+    with _lock:
+        for classificacio in _grups.values():
+            if classificacio.canviar_nom(participant_id, nom_usuari):
+                classificacio.versio = _nova_versio()
+
+def punts(grup_id):
+    """Retorna {participant_id: (nom_usuari, telegram_id, punts)} de tota la classificació del grup."""
+    with _lock:
+        classificacio = _grups.get(grup_id)
+        if classificacio is None:
+            return {}
+        return {
+            participant_id: (dades["nom_usuari"], dades["telegram_id"], dades["punts"])
+            for participant_id, dades in classificacio.participants.items()
+        }
+
+def total(grup_id):
+    with _lock:
+        classificacio = _grups.get(grup_id)
+        return len(classificacio.entrades) if classificacio else 0
+
+def pagina(grup_id, inici, mida):
+    """Retorna [(posicio, nom_usuari, punts), ...] a partir de la posició `inici` (0 = primer)."""
+    with _lock:
+        classificacio = _grups.get(grup_id)
+        return classificacio.pagina(inici, mida) if classificacio else []
+
+def posicio(grup_id, telegram_id):
+    """Retorna (posicio, nom_usuari, punts) del participant al grup o None si no hi és."""
+    with _lock:
+        classificacio = _grups.get(grup_id)
+        return classificacio.posicio(telegram_id) if classificacio else None
@@ -0,0 +1,112 @@
+"""Regles de puntuació de la porra.
+
+Les regles són un diccionari amb els punts de cada encert:
+
+- exacte: el resultat exacte
+- diferencia: la diferència de gols
+- parcial: els gols d'un dels dos equips
+- guanyador: punts de més (a qualsevol aposta) per encertar qui guanya o l'empat
+- sense_aposta: punts (normalment negatius) dels participants de la temporada que no aposten
+
+D'exacte, diferencia i parcial només compta el primer que s'encerta, en aquest
+ordre. Les regles surten de config.PUNTUACIO i config.PUNTUACIO_GRUPS, i cada
+temporada es queda les que hi havia quan va començar.
+
+database.actualitzar_punts puntua els partits reals amb una sola sentència SQL.
+Apostes puntua totes les apostes d'un partit per a un resultat hipotètic
+(/simular), amb NumPy si està instal·lat i, si no, amb Python pur.
+"""
+from config import PUNTUACIO, PUNTUACIO_GRUPS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+REGLES_PER_DEFECTE = {"exacte": 3, "diferencia": 2, "parcial": 1, "guanyador": 0, "sense_aposta": 0}
+
+def completar(regles):
+    """Afegeix els valors per defecte a unes regles i comprova que són correctes."""
+    completes = dict(REGLES_PER_DEFECTE)
+    for nom, punts in regles.items():
+        if nom not in REGLES_PER_DEFECTE:
+            raise ValueError(f"Regla de puntuació desconeguda: {nom!r}. Opcions: {', '.join(REGLES_PER_DEFECTE)}.")
+        if not isinstance(punts, int) or isinstance(punts, bool):
+            raise ValueError(f"La regla de puntuació {nom!r} ha de ser un nombre enter de punts.")
+        completes[nom] = punts
+    return completes
+
+def del_grup(grup_id):
+    """Regles amb què començaran les temporades noves del grup."""
+    return completar({**PUNTUACIO, **PUNTUACIO_GRUPS.get(grup_id, {})})
+
+def descriure(regles):
+    text = f"exacte {regles['exacte']}, diferència {regles['diferencia']}, parcial {regles['parcial']}"
+    if regles["guanyador"]:
+        text += f", guanyador {regles['guanyador']:+d}"
+    if regles["sense_aposta"]:
+        text += f", sense aposta {regles['sense_aposta']:+d}"
+    return text
+
+def signe(gols_local, gols_visitant):
+    """1 si guanya el local, -1 si guanya el visitant i 0 si empaten."""
+    return (gols_local > gols_visitant) - (gols_local < gols_visitant)
+
+def punts_aposta(regles, aposta_local, aposta_visitant, resultat_local, resultat_visitant):
+    """Punts d'una sola aposta."""
+    if aposta_local == resultat_local and aposta_visitant == resultat_visitant:
+        punts = regles["exacte"]
+    elif aposta_local - aposta_visitant == resultat_local - resultat_visitant:
+        punts = regles["diferencia"]
+    elif aposta_local == resultat_local or aposta_visitant == resultat_visitant:
+        punts = regles["parcial"]
+    else:
+        punts = 0
+    if signe(aposta_local, aposta_visitant) == signe(resultat_local, resultat_visitant):
+        punts += regles["guanyador"]
+    return punts
+
+class Apostes:
+    """Les apostes d'un partit, preparades per puntuar-les de cop tantes vegades com calgui.
+
+    Encara que hi hagi milers d'apostes, els marcadors diferents són pocs: es
+    puntua cada marcador una vegada i el resultat s'estén a totes les apostes.
+    """
+
+    def __init__(self, gols_local, gols_visitant):
+        if np is not None:
+            marcadors = np.column_stack((
+                np.asarray(gols_local, dtype=np.int64),
+                np.asarray(gols_visitant, dtype=np.int64),
+            )).reshape(-1, 2)
+            unics, index = np.unique(marcadors, axis=0, return_inverse=True)
+            self._local, self._visitant = unics[:, 0], unics[:, 1]
+            self._signe = np.sign(self._local - self._visitant)
+            self._index = index.reshape(-1)
+        else:
+            marcadors = {}
+            self._index = [marcadors.setdefault(marcador, len(marcadors)) for marcador in zip(gols_local, gols_visitant)]
+            self._marcadors = list(marcadors)
+
+    def __len__(self):
+        return len(self._index)
+
+    def punts(self, regles, resultat_local, resultat_visitant):
+        """Punts de cada aposta, en el mateix ordre, si el partit acaba amb aquest resultat."""
+        if np is None:
+            per_marcador = [
+                punts_aposta(regles, local, visitant, resultat_local, resultat_visitant)
+                for local, visitant in self._marcadors
+            ]
+            return [per_marcador[i] for i in self._index]
+
+        exacte = (self._local == resultat_local) & (self._visitant == resultat_visitant)
+        diferencia = self._local - self._visitant == resultat_local - resultat_visitant
+        parcial = (self._local == resultat_local) | (self._visitant == resultat_visitant)
+        per_marcador = np.select(
+            [exacte, diferencia, parcial],
+            [regles["exacte"], regles["diferencia"], regles["parcial"]],
+            0,
+        )
+        per_marcador += regles["guanyador"] * (self._signe == signe(resultat_local, resultat_visitant))
+        return per_marcador[self._index]
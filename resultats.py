@@ -0,0 +1,59 @@
+"""Fonts de resultats per finalitzar les porres sense esperar /finalitzar.
+
+Una font retorna els resultats que ja coneix com a diccionari
+{partit_id: "X-Y"}. El bot la consulta cada `interval` segons mentre hi ha
+partits començats sense resultat, i finalitza els que hi apareixen.
+
+- "fitxer": un fitxer JSON local, per exemple {"12": "2-1"}.
+- "http": una URL que retorna el mateix JSON.
+"""
+import json
+import urllib.request
+
+class FontResultats:
+    def obtenir(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def _normalitzar(dades):
+        return {int(partit_id): str(resultat) for partit_id, resultat in dades.items()}
+
+class FontFitxer(FontResultats):
+    def __init__(self, fitxer):
+        self.fitxer = fitxer
+
+    def obtenir(self):
+        try:
+            with open(self.fitxer, encoding="utf-8") as fitxer:
+                return self._normalitzar(json.load(fitxer))
+        except FileNotFoundError:
+            return {}
+
+class FontHTTP(FontResultats):
+    def __init__(self, url, espera=10):
+        self.url = url
+        self.espera = espera
+
+    def obtenir(self):
+        with urllib.request.urlopen(self.url, timeout=self.espera) as resposta:
+            return self._normalitzar(json.load(resposta))
+
+def crear_font(config):
+    """Crea la font de config.RESULTATS, o retorna None si no n'hi ha cap."""
+    if not config or not config.get("font"):
+        return None
+    if config["font"] == "fitxer":
+        return FontFitxer(config["fitxer"])
+    if config["font"] == "http":
+        return FontHTTP(config["url"])
+    raise ValueError(f"Font de resultats desconeguda: {config['font']!r}")
+
+def llegir_resultat(text):
+    """Converteix 'X-Y' a (X, Y), o retorna None si el format no és correcte."""
+    try:
+        gols_local, gols_visitant = map(int, text.split("-"))
+    except ValueError:
+        return None
+    if gols_local < 0 or gols_visitant < 0:
+        return None
+    return gols_local, gols_visitant